@@ -0,0 +1 @@
+"""Benchmarks for osa-differ, run with ``python -m benchmarks.<name>``."""
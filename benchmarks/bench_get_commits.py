@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# Copyright 2016, Major Hayden
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Compare get_commits() with walking GitPython Commit objects.
+
+Builds a throwaway repository with a large number of commits and times both
+ways of reading the range, touching each commit the way the templates do.
+Run it from the top of the source tree::
+
+    python -m benchmarks.bench_get_commits --commits 20000
+"""
+import argparse
+import shutil
+import tempfile
+import time
+
+from git import Repo
+
+from osa_differ import osa_differ
+
+from . import fixture
+
+
+def gitpython_commits(repo_dir, old_commit, new_commit):
+    """Read the range the way get_commits() used to."""
+    repo = Repo(repo_dir)
+    commits = repo.iter_commits(rev="{0}..{1}".format(old_commit, new_commit))
+    return [x for x in commits if not x.summary.startswith("Merge ")]
+
+
+def touch(commits):
+    """Access each commit like offline-repo-changes.j2 does."""
+    for commit in commits:
+        if commit.summary[0:7] == 'Merge "':
+            continue
+        commit.hexsha[0:8]
+        commit.summary[0:80].ljust(80)
+
+
+def run(repo_dir, count, repeat):
+    """Time both implementations and print the results."""
+    old_commit = "HEAD~{0}".format(count - 1)
+    implementations = [
+        ('GitPython Commit objects', gitpython_commits),
+        ('git log records', osa_differ.get_commits),
+    ]
+    print("{0} commits in range, best of {1} runs".format(count - 1, repeat))
+    for name, get_commits in implementations:
+        timings = []
+        for _ in range(repeat):
+            start = time.time()
+            touch(get_commits(repo_dir, old_commit, 'HEAD'))
+            timings.append(time.time() - start)
+        print("  {0:<28} {1:8.3f}s".format(name, min(timings)))
+
+
+def main():
+    """Start here."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--commits', type=int, default=20000,
+                        help="Number of commits to create (default: 20000)")
+    parser.add_argument('--repeat', type=int, default=3,
+                        help="Number of timed runs (default: 3)")
+    args = parser.parse_args()
+
+    repo_dir = tempfile.mkdtemp(prefix='osa-differ-bench-')
+    try:
+        fixture.build_repo(repo_dir, [
+            ("Change number {0}\n\nSome details about it.".format(x),
+             {'file.txt': "{0}\n".format(x)},
+             [])
+            for x in range(args.commits)
+        ], bare=False)
+        run(repo_dir, args.commits, args.repeat)
+    finally:
+        shutil.rmtree(repo_dir)
+
+
+if __name__ == "__main__":
+    main()
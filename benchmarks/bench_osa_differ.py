@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+# Copyright 2016, Major Hayden
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Time osa-differ against synthetic openstack-ansible repositories.
+
+Builds a fixture for each size, with file:// remotes for every role and
+project, and times the main stages of a report on it. Results are saved as
+JSON, and an earlier result file can be passed to --compare to look for
+regressions. Run it from the top of the source tree::
+
+    python -m benchmarks.bench_osa_differ --sizes small medium
+    python -m benchmarks.bench_osa_differ --compare results-before.json
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from osa_differ import cache
+from osa_differ import osa_differ
+
+from . import fixture
+
+
+# Fixture parameters for each size.
+SIZES = {
+    'small': {'roles': 5, 'projects': 5, 'commits': 20, 'tags': 3,
+              'notes': 2},
+    'medium': {'roles': 20, 'projects': 20, 'commits': 100, 'tags': 5,
+               'notes': 5},
+    'large': {'roles': 60, 'projects': 40, 'commits': 300, 'tags': 10,
+              'notes': 10},
+}
+
+
+def reset_process_state():
+    """Forget everything osa-differ keeps in memory between reports."""
+    osa_differ._manifest_cache = cache.MemoryCache(64)
+    osa_differ._parse_cache = cache.MemoryCache(1024)
+    osa_differ._repo_handles.clear()
+
+
+def run_cli(argv):
+    """Run osa-differ like the command line would, without any output."""
+    reset_process_state()
+    saved_argv, saved_stdout = sys.argv, sys.stdout
+    sys.argv = ['osa-differ'] + argv
+    try:
+        with open(os.devnull, 'w') as sys.stdout:
+            osa_differ.run_osa_differ()
+    finally:
+        sys.argv, sys.stdout = saved_argv, saved_stdout
+
+
+def make_benchmarks(bench_fixture, work_dir):
+    """Build the benchmarks for one fixture.
+
+    Returns ``(name, setup, run)`` tuples. ``setup`` prepares a fresh state
+    that is not timed, and ``run`` is the timed part.
+    """
+    old_tag = bench_fixture.tags[0]
+    new_tag = bench_fixture.tags[-1]
+    storage = os.path.join(work_dir, 'storage')
+    osa_dir = os.path.join(storage, 'openstack-ansible')
+    cli_args = [old_tag, new_tag,
+                '--directory', storage,
+                '--osa-repo-url', bench_fixture.osa_url,
+                '--quiet']
+    report_args = osa_differ.create_parser().parse_args(cli_args)
+
+    def clear_storage():
+        if os.path.exists(storage):
+            shutil.rmtree(storage)
+        os.makedirs(storage)
+
+    def prepare_storage():
+        if not os.path.exists(osa_dir):
+            clear_storage()
+            run_cli(cli_args + ['--no-cache'])
+        reset_process_state()
+
+    def prepare_cache():
+        prepare_storage()
+        run_cli(cli_args)
+
+    def manifests(commit):
+        return osa_differ.get_manifests(osa_dir, commit, 'ansible-role-'
+                                        'requirements.yml')
+
+    def make_report():
+        old_roles, old_projects = manifests(old_tag)
+        new_roles, new_projects = manifests(new_tag)
+        osa_differ.make_report(storage, old_roles, new_roles)
+        osa_differ.make_report(storage, old_projects, new_projects)
+
+    def get_commits():
+        role_dir = os.path.join(storage, sorted(bench_fixture.role_urls)[0])
+        old_roles, _ = manifests(old_tag)
+        new_roles, _ = manifests(new_tag)
+        old_sha = [x[2] for x in old_roles if x[0] == 'os_role0'][0]
+        new_sha = [x[2] for x in new_roles if x[0] == 'os_role0'][0]
+        osa_differ.get_commits(role_dir, old_sha, new_sha)
+
+    return [
+        ('run_osa_differ (cold)', clear_storage,
+         lambda: run_cli(cli_args + ['--no-cache'])),
+        ('run_osa_differ (warm)', prepare_storage,
+         lambda: run_cli(cli_args + ['--no-cache'])),
+        ('run_osa_differ (cached)', prepare_cache,
+         lambda: run_cli(cli_args)),
+        ('make_osa_report', prepare_storage,
+         lambda: osa_differ.make_osa_report(osa_dir, old_tag, new_tag,
+                                            report_args)),
+        ('make_report', prepare_storage, make_report),
+        ('get_commits', prepare_storage, get_commits),
+        ('get_release_notes', prepare_storage,
+         lambda: osa_differ.get_release_notes(osa_dir, old_tag, new_tag)),
+    ]
+
+
+def run_benchmarks(sizes, repeat, only=None):
+    """Run every benchmark for every size and return the results."""
+    results = []
+    for size in sizes:
+        params = SIZES[size]
+        work_dir = tempfile.mkdtemp(prefix='osa-differ-bench-')
+        try:
+            print("Building {0} fixture: {1}".format(
+                size, ", ".join("{0}={1}".format(k, v)
+                                for k, v in sorted(params.items()))))
+            start = time.time()
+            bench_fixture = fixture.build_fixture(
+                os.path.join(work_dir, 'remotes'), **params)
+            print("  built in {0:.2f}s".format(time.time() - start))
+
+            for name, setup, run in make_benchmarks(bench_fixture, work_dir):
+                if only and not any(x in name for x in only):
+                    continue
+                runs = []
+                for _ in range(repeat):
+                    setup()
+                    start = time.time()
+                    run()
+                    runs.append(time.time() - start)
+                result = {
+                    'size': size,
+                    'params': params,
+                    'benchmark': name,
+                    'runs': runs,
+                    'best': min(runs),
+                    'median': sorted(runs)[len(runs) // 2],
+                }
+                print("  {0:<28} best {1:8.3f}s  median {2:8.3f}s".format(
+                    name, result['best'], result['median']))
+                results.append(result)
+        finally:
+            shutil.rmtree(work_dir)
+
+    return results
+
+
+def get_environment():
+    """Describe the code and tools the results were measured with."""
+    source_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    try:
+        revision = subprocess.check_output(
+            ['git', 'describe', '--always', '--dirty'], cwd=source_dir
+        ).decode('UTF-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        revision = None
+
+    return {
+        'created': datetime.datetime.utcnow().isoformat() + 'Z',
+        'revision': revision,
+        'python': platform.python_version(),
+        'git': subprocess.check_output(
+            ['git', '--version']).decode('UTF-8').strip(),
+        'platform': platform.platform(),
+    }
+
+
+def compare(baseline, results, threshold):
+    """Print how results changed from a baseline.
+
+    Returns the number of benchmarks that got slower by more than
+    ``threshold`` percent.
+    """
+    baseline_results = {(x['size'], x['benchmark']): x
+                        for x in baseline['results']}
+    print("Compared with {0} ({1})".format(baseline['revision'],
+                                           baseline['created']))
+    regressions = 0
+    for result in results:
+        before = baseline_results.get((result['size'], result['benchmark']))
+        if before is None or before['params'] != result['params']:
+            continue
+        change = (result['best'] - before['best']) / before['best'] * 100
+        flag = ""
+        if change > threshold:
+            flag = "  <-- slower"
+            regressions += 1
+        print("  {0:<8} {1:<28} {2:8.3f}s -> {3:8.3f}s {4:+7.1f}%{5}".format(
+            result['size'], result['benchmark'], before['best'],
+            result['best'], change, flag))
+
+    return regressions
+
+
+def main():
+    """Start here."""
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument('--sizes', nargs='+', choices=sorted(SIZES),
+                        default=['small', 'medium'],
+                        help="Fixture sizes to run (default: small medium)")
+    parser.add_argument('--repeat', type=int, default=3,
+                        help="Number of timed runs (default: 3)")
+    parser.add_argument('--only', nargs='+', metavar='NAME',
+                        help="Only run benchmarks whose names contain NAME")
+    parser.add_argument('--output', metavar='FILENAME',
+                        help=("Where to save the results (default: "
+                              "bench-results-<time>.json)"))
+    parser.add_argument('--compare', metavar='FILENAME',
+                        help="Earlier results to compare with")
+    parser.add_argument('--threshold', type=float, default=10.0,
+                        help=("Percentage by which a benchmark may get "
+                              "slower before it is flagged (default: 10)"))
+    args = parser.parse_args()
+
+    environment = get_environment()
+    results = run_benchmarks(args.sizes, args.repeat, args.only)
+
+    output = args.output or "bench-results-{0}.json".format(
+        datetime.datetime.utcnow().strftime('%Y%m%d-%H%M%S'))
+    with open(output, 'w') as f:
+        json.dump(dict(environment, results=results), f, indent=2,
+                  sort_keys=True)
+    print("Results saved to {0}".format(output))
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(baseline, results, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
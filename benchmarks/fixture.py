@@ -0,0 +1,162 @@
+# Copyright 2016, Major Hayden
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Build synthetic openstack-ansible repositories for benchmarks.
+
+Every repository is a bare repo written with git fast-import, and all of
+them refer to each other through file:// URLs, so a fixture behaves like the
+real upstream repositories without any network access.
+"""
+import os
+import subprocess
+from collections import namedtuple
+
+import yaml
+
+
+# First timestamp used for commits, so every fixture gets the same SHAs.
+EPOCH = 1500000000
+
+Fixture = namedtuple('Fixture', ['osa_url', 'tags', 'role_urls',
+                                 'project_urls'])
+
+
+def build_repo(repo_dir, commits, bare=True):
+    """Create a repo from a list of commits with git fast-import.
+
+    ``commits`` is a list of ``(message, files, tags)`` tuples. ``files``
+    maps paths to their new contents and every name in ``tags`` becomes an
+    annotated tag on that commit. Returns the SHAs of the commits, oldest
+    first.
+    """
+    command = ['git', 'init', '-q']
+    if bare:
+        command.append('--bare')
+    subprocess.check_call(command + [repo_dir])
+
+    stream = []
+    for mark, (message, files, tags) in enumerate(commits, 1):
+        timestamp = EPOCH + mark
+        stream.append(
+            "commit refs/heads/master\n"
+            "mark :{0}\n"
+            "author Bench <bench@example.com> {1} +0000\n"
+            "committer Bench <bench@example.com> {1} +0000\n"
+            "{2}".format(mark, timestamp, _data(message))
+        )
+        if mark > 1:
+            stream.append("from :{0}\n".format(mark - 1))
+        for path, content in sorted(files.items()):
+            stream.append("M 644 inline {0}\n{1}".format(
+                path, _data(content)))
+        for tag in tags:
+            stream.append(
+                "tag {0}\n"
+                "from :{1}\n"
+                "tagger Bench <bench@example.com> {2} +0000\n"
+                "{3}".format(tag, mark, timestamp, _data(tag))
+            )
+
+    fast_import = subprocess.Popen(['git', 'fast-import', '--quiet'],
+                                   cwd=repo_dir, stdin=subprocess.PIPE)
+    fast_import.communicate("".join(stream).encode('UTF-8'))
+    if fast_import.returncode != 0:
+        raise RuntimeError("git fast-import failed in {0}".format(repo_dir))
+
+    output = subprocess.check_output(['git', 'rev-list', '--reverse',
+                                      'master'], cwd=repo_dir)
+    return output.decode('UTF-8').split()
+
+
+def build_fixture(base_dir, roles=10, projects=10, commits=50, tags=4,
+                  notes=3):
+    """Build an openstack-ansible repo with its roles and projects.
+
+    The OSA repo gets one release for each of ``tags``. The first release
+    is a release candidate. Every release adds ``commits`` commits to each
+    role and project and to OSA itself, pins the roles and projects to
+    their newest commits, and adds ``notes`` reno release notes.
+    """
+    def make_dependency(name):
+        repo_commits = [("Initial commit of {0}".format(name),
+                         {'README': name}, [])]
+        for x in range(tags * commits):
+            repo_commits.append((
+                "Change {0} to {1}\n\nChange-Id: I{2:040x}".format(
+                    x, name, x),
+                {'file.txt': "{0}\n".format(x)},
+                []
+            ))
+        repo_dir = os.path.join(base_dir, name)
+        shas = build_repo(repo_dir, repo_commits)
+        # The pins of each release, oldest first.
+        return 'file://{0}'.format(repo_dir), shas[commits::commits]
+
+    role_urls = {}
+    role_pins = {}
+    for x in range(roles):
+        name = 'os_role{0}'.format(x)
+        role_urls[name], role_pins[name] = make_dependency(name)
+
+    project_urls = {}
+    project_pins = {}
+    for x in range(projects):
+        name = 'project{0}'.format(x)
+        project_urls[name], project_pins[name] = make_dependency(name)
+
+    tag_names = ['30.0.0.0rc1'] + ['30.0.{0}'.format(x)
+                                   for x in range(tags - 1)]
+    osa_commits = [("Initial commit", {'README': 'openstack-ansible'}, [])]
+    for release, tag in enumerate(tag_names):
+        for x in range(commits - 1):
+            osa_commits.append((
+                "Change {0} for {1}".format(x, tag),
+                {'file.txt': "{0} {1}\n".format(tag, x)},
+                []
+            ))
+
+        role_requirements = [
+            {'name': name, 'scm': 'git', 'src': role_urls[name],
+             'version': role_pins[name][release]}
+            for name in sorted(role_urls)
+        ]
+        repo_packages = {}
+        for name in sorted(project_urls):
+            repo_packages['{0}_git_repo'.format(name)] = project_urls[name]
+            repo_packages['{0}_git_install_branch'.format(name)] = (
+                project_pins[name][release])
+        files = {
+            'ansible-role-requirements.yml': yaml.safe_dump(
+                role_requirements, default_flow_style=False),
+            'playbooks/defaults/repo_packages/projects.yml': yaml.safe_dump(
+                repo_packages, default_flow_style=False),
+        }
+        for x in range(notes):
+            path = 'releasenotes/notes/note-{0}-{1}-{2:016x}.yaml'.format(
+                release, x, release * 1000 + x)
+            files[path] = yaml.safe_dump({
+                'features': ["Feature {0} of release {1}.".format(x, tag)],
+                'fixes': ["Fix {0} of release {1}.".format(x, tag)],
+            }, default_flow_style=False)
+        osa_commits.append(("Release {0}".format(tag), files, [tag]))
+
+    osa_dir = os.path.join(base_dir, 'openstack-ansible')
+    build_repo(osa_dir, osa_commits)
+
+    return Fixture('file://{0}'.format(osa_dir), tag_names, role_urls,
+                   project_urls)
+
+
+def _data(content):
+    data = content.encode('UTF-8')
+    return "data {0}\n{1}\n".format(len(data), content)
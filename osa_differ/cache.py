@@ -0,0 +1,168 @@
+# Copyright 2016, Major Hayden
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Caches for osa-differ."""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+
+log = logging.getLogger()
+
+
+class DiskCache(object):
+    """Size-capped on-disk cache with least-recently-used eviction.
+
+    Every value is stored as JSON in its own file, named after a hash of its
+    key. Reading a value touches its file, so the modification times order
+    the entries from least to most recently used.
+    """
+
+    def __init__(self, directory, max_bytes):
+        """Initialise instance."""
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._size = None
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the value stored for a key, or None."""
+        path = self._path(key)
+        try:
+            with open(path, 'r') as f:
+                value = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+
+        return value
+
+    def put(self, key, value):
+        """Store a value for a key."""
+        if not os.path.isdir(self.directory):
+            try:
+                os.makedirs(self.directory)
+            except OSError:
+                if not os.path.isdir(self.directory):
+                    raise
+
+        data = json.dumps(value, separators=(',', ':'))
+        path = self._path(key)
+        # Write to a temporary file first so readers never see partial data.
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            f.write(data)
+        os.rename(tmp_path, path)
+
+        with self._lock:
+            if self._size is not None:
+                self._size += len(data)
+            if self._size is None or self._size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json'):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+
+        size = sum(x[1] for x in entries)
+        for _, entry_size, name in sorted(entries):
+            if size <= self.max_bytes:
+                break
+            log.debug("Evicting {0} from {1}".format(name, self.directory))
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+            size -= entry_size
+
+        self._size = size
+
+    def _path(self, key):
+        digest = hashlib.sha256(
+            json.dumps(key, sort_keys=True).encode('UTF-8')
+        ).hexdigest()
+        return os.path.join(self.directory, "{0}.json".format(digest))
+
+
+class MemoryCache(object):
+    """In-memory cache with least-recently-used eviction.
+
+    This has the same interface as ``DiskCache``, for data that only needs
+    to be shared within one process.
+    """
+
+    def __init__(self, max_entries=1024):
+        """Initialise instance."""
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the value stored for a key, or None."""
+        key = json.dumps(key, sort_keys=True)
+        with self._lock:
+            value = self._entries.pop(key, None)
+            if value is not None:
+                self._entries[key] = value
+        return value
+
+    def put(self, key, value):
+        """Store a value for a key."""
+        key = json.dumps(key, sort_keys=True)
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = value
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class TieredCache(object):
+    """In-memory cache in front of a slower cache.
+
+    Values read from or written to the backend are kept in memory as well,
+    so repeated reads in a long-running process never touch the disk.
+    """
+
+    def __init__(self, backend, max_entries=1024):
+        """Initialise instance."""
+        self.backend = backend
+        self.memory = MemoryCache(max_entries)
+
+    def get(self, key):
+        """Return the value stored for a key, or None."""
+        value = self.memory.get(key)
+        if value is None:
+            value = self.backend.get(key)
+            if value is not None:
+                self.memory.put(key, value)
+        return value
+
+    def put(self, key, value):
+        """Store a value for a key."""
+        self.memory.put(key, value)
+        self.backend.put(key, value)
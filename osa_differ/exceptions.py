@@ -28,3 +28,16 @@ class InvalidCommitRangeException(Exception):
     def __init__(self, *args, **kwargs):
         """Handle the exception."""
         Exception.__init__(self, *args, **kwargs)
+
+
+class RepoReportException(Exception):
+    """One or more repositories could not be reported on."""
+
+    def __init__(self, failures):
+        """Handle the exception."""
+        self.failures = failures
+        msg = "Unable to generate the report for {0} repositories:\n".format(
+            len(failures))
+        msg += "\n".join("  {0}: {1}".format(repo_name, error)
+                         for repo_name, error in failures)
+        Exception.__init__(self, msg)
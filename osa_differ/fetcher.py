@@ -0,0 +1,172 @@
+# Copyright 2016, Major Hayden
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Clone and fetch repositories concurrently before reporting on them."""
+import logging
+import os
+import shutil
+import subprocess
+import threading
+import time
+from collections import namedtuple
+from multiprocessing.pool import ThreadPool
+
+from git import Repo
+from git.cmd import Git
+
+from . import osa_differ
+from . import timing
+
+
+log = logging.getLogger()
+
+FetchResult = namedtuple('FetchResult', ['repo_dir', 'repo_url', 'action',
+                                         'status', 'duration', 'detail'])
+
+
+def fetch_repos(repo_updates, fetch=True, clone_options=None,
+                concurrency=4, timeout=600):
+    """Clone or fetch a list of repos concurrently.
+
+    ``repo_updates`` is a list of ``(repo_dir, repo_url, commits)`` tuples,
+    and ``fetch`` has the same meaning as for ``update_repo``. Missing repos
+    are always cloned. At most ``concurrency`` git processes run at once and
+    each one is killed after ``timeout`` seconds.
+
+    Failures are not raised. A ``FetchResult`` is returned for every repo,
+    in the same order as ``repo_updates``.
+    """
+    return _fetch_repos(repo_updates, fetch, clone_options or {},
+                        concurrency, timeout)
+
+
+def format_summary(results):
+    """Summarize the results of a fetch stage."""
+    counts = {}
+    for result in results:
+        key = "{0} {1}".format(result.action, result.status)
+        counts[key] = counts.get(key, 0) + 1
+
+    lines = ["Fetch summary: {0}".format(
+        ", ".join("{0}: {1}".format(k, v) for k, v in sorted(counts.items()))
+    )]
+    for result in results:
+        if result.action == 'skip':
+            continue
+        line = "  {0:<40} {1:<6} {2:<8} {3:7.2f}s".format(
+            os.path.basename(result.repo_dir), result.action, result.status,
+            result.duration)
+        if result.detail:
+            line += "  {0}".format(result.detail)
+        lines.append(line)
+
+    return "\n".join(lines)
+
+
+def _fetch_repos(repo_updates, fetch, clone_options, concurrency, timeout):
+    # The same repo may be needed more than once, so merge the commits of
+    # duplicate entries and only fetch it once.
+    merged = osa_differ.merge_repo_updates(repo_updates)
+
+    def worker(repo_update):
+        repo_dir, repo_url, commits = repo_update
+        return _update_repo(repo_dir, repo_url, commits, fetch,
+                            clone_options, timeout)
+
+    pool = ThreadPool(max(concurrency, 1))
+    try:
+        fetched = dict(zip([x[0] for x in merged], pool.map(worker, merged)))
+    finally:
+        pool.close()
+        pool.join()
+
+    return [fetched[repo_dir] for repo_dir, _, _ in repo_updates]
+
+
+def _update_repo(repo_dir, repo_url, commits, fetch, clone_options, timeout):
+    start = time.time()
+    if not os.path.exists(repo_dir):
+        action = 'clone'
+        clone_args = Git().transform_kwargs(**clone_options)
+        command = ['git', 'clone'] + clone_args + [repo_url, repo_dir]
+        cwd = None
+    else:
+        if fetch == 'auto':
+            fetch = bool(osa_differ.find_missing_commits(repo_dir, commits))
+        if not fetch:
+            return FetchResult(repo_dir, repo_url, 'skip', 'ok', 0, '')
+        action = 'fetch'
+        fetch_args = osa_differ.prepare_fetch(Repo(repo_dir), repo_url)
+        command = ['git', 'fetch'] + fetch_args
+        cwd = repo_dir
+
+    log.info("Running {0} for {1}".format(action, repo_url))
+    status, detail = _run(command, cwd, timeout)
+    if status != 'ok' and action == 'clone' and os.path.exists(repo_dir):
+        # Never leave a half-cloned repo behind for the report to use.
+        shutil.rmtree(repo_dir)
+    if status != 'ok':
+        log.warning("Unable to {0} {1}: {2}".format(action, repo_url,
+                                                    detail))
+    else:
+        for command in osa_differ.get_commit_graph_commands(repo_dir):
+            graph_status, graph_detail = _run(command, repo_dir, timeout)
+            if graph_status != 'ok':
+                log.warning("Unable to run {0} in {1}: {2}".format(
+                    " ".join(command), repo_dir, graph_detail))
+
+    duration = time.time() - start
+    repo_name = os.path.basename(repo_dir)
+    timing.record(action, start, duration,
+                  thread="{0} {1}".format(action, repo_name),
+                  repo=repo_name, status=status)
+    return FetchResult(repo_dir, repo_url, action, status, duration, detail)
+
+
+def _run(command, cwd, timeout):
+    env = dict(os.environ, GIT_TERMINAL_PROMPT='0')
+    with open(os.devnull, 'rb') as devnull:
+        process = subprocess.Popen(command,
+                                   cwd=cwd,
+                                   env=env,
+                                   stdin=devnull,
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE)
+
+    # Popen.communicate has no timeout on every Python we support, so a
+    # timer kills git instead.
+    timed_out = []
+
+    def kill():
+        if process.poll() is None:
+            timed_out.append(True)
+            try:
+                process.kill()
+            except OSError:
+                pass
+
+    timer = threading.Timer(timeout, kill)
+    timer.start()
+    try:
+        _, stderr = process.communicate()
+    finally:
+        timer.cancel()
+
+    if timed_out:
+        return 'timeout', "timed out after {0}s".format(timeout)
+
+    if process.returncode != 0:
+        lines = stderr.decode('UTF-8', 'replace').strip().splitlines()
+        return 'failed', lines[-1] if lines else ''
+
+    return 'ok', ''
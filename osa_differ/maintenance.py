@@ -0,0 +1,164 @@
+# Copyright 2016, Major Hayden
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Maintain the git repositories in the storage directory."""
+import logging
+import os
+import subprocess
+import time
+from collections import namedtuple
+from multiprocessing.pool import ThreadPool
+
+
+log = logging.getLogger()
+
+# git commands run on every repo, in order. Packing the refs first keeps the
+# thousands of fetched branch, tag and pull request refs in a single file.
+# Reflogs and loose objects expire like they would with 'git gc'.
+MAINTENANCE_STEPS = [
+    ('pack-refs', ['pack-refs', '--all', '--prune']),
+    ('reflog', ['reflog', 'expire', '--all']),
+    ('repack', ['repack', '-a', '-d', '-q']),
+    ('prune', ['prune', '--expire', '2.weeks.ago']),
+    ('commit-graph', ['commit-graph', 'write', '--reachable',
+                      '--split=replace']),
+    ('multi-pack-index', ['multi-pack-index', 'write']),
+]
+
+MaintenanceResult = namedtuple('MaintenanceResult', ['repo_dir',
+                                                     'size_before',
+                                                     'size_after',
+                                                     'steps'])
+
+StepResult = namedtuple('StepResult', ['name', 'status', 'duration',
+                                       'detail'])
+
+
+def find_repos(storage_directory):
+    """List the git repos in the storage directory."""
+    repo_dirs = []
+    for name in sorted(os.listdir(storage_directory)):
+        repo_dir = os.path.join(storage_directory, name)
+        if name.startswith('.') or not os.path.isdir(repo_dir):
+            continue
+        if (os.path.exists(os.path.join(repo_dir, '.git')) or
+                os.path.exists(os.path.join(repo_dir, 'HEAD'))):
+            repo_dirs.append(repo_dir)
+
+    return repo_dirs
+
+
+def maintain_repos(repo_dirs, jobs=4):
+    """Run every maintenance step on a list of repos.
+
+    Up to ``jobs`` repos are maintained at once, and the steps of each repo
+    run in order. Failed steps are reported, not raised. A
+    ``MaintenanceResult`` is returned for every repo, in the same order as
+    ``repo_dirs``.
+    """
+    pool = ThreadPool(max(jobs, 1))
+    try:
+        return pool.map(maintain_repo, repo_dirs)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def maintain_repo(repo_dir):
+    """Run every maintenance step on one repo."""
+    size_before = get_disk_usage(repo_dir)
+    steps = []
+    for name, command in MAINTENANCE_STEPS:
+        log.info("Running {0} in {1}".format(name, repo_dir))
+        start = time.time()
+        status, detail = _run(['git'] + command, repo_dir)
+        if status != 'ok':
+            log.warning("Unable to run {0} in {1}: {2}".format(
+                name, repo_dir, detail))
+        steps.append(StepResult(name, status, time.time() - start, detail))
+
+    return MaintenanceResult(repo_dir, size_before, get_disk_usage(repo_dir),
+                             steps)
+
+
+def get_disk_usage(path):
+    """Add up the size of all of the files below a path."""
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                total += os.lstat(os.path.join(dirpath, filename)).st_size
+            except OSError:
+                pass
+
+    return total
+
+
+def format_report(results):
+    """Summarize the results of a maintenance run."""
+    step_names = [name for name, _ in MAINTENANCE_STEPS]
+    lines = ["{0:<40} {1:>10} {2:>10}  {3}".format(
+        'Repository', 'Before', 'After',
+        " ".join("{0:>16}".format(x) for x in step_names))]
+    for result in results:
+        steps = " ".join(
+            "{0:>16}".format("{0:.2f}s".format(x.duration) if x.status == 'ok'
+                             else x.status)
+            for x in result.steps)
+        lines.append("{0:<40} {1:>10} {2:>10}  {3}".format(
+            os.path.basename(result.repo_dir),
+            format_size(result.size_before),
+            format_size(result.size_after),
+            steps))
+
+    size_before = sum(x.size_before for x in results)
+    size_after = sum(x.size_after for x in results)
+    lines.append("{0:<40} {1:>10} {2:>10}".format(
+        "Total ({0} repositories)".format(len(results)),
+        format_size(size_before),
+        format_size(size_after)))
+
+    for result in results:
+        for step in result.steps:
+            if step.status != 'ok':
+                lines.append("{0} {1}: {2}".format(
+                    os.path.basename(result.repo_dir), step.name,
+                    step.detail))
+
+    return "\n".join(lines)
+
+
+def format_size(size):
+    """Format a number of bytes for humans."""
+    if size < 1024:
+        return "{0} B".format(size)
+
+    for unit in ['KiB', 'MiB']:
+        size /= 1024.0
+        if size < 1024:
+            return "{0:.1f} {1}".format(size, unit)
+
+    return "{0:.1f} GiB".format(size / 1024.0)
+
+
+def _run(command, cwd):
+    process = subprocess.Popen(command,
+                               cwd=cwd,
+                               stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE)
+    _, stderr = process.communicate()
+    if process.returncode != 0:
+        lines = stderr.decode('UTF-8', 'replace').strip().splitlines()
+        return 'failed', lines[-1] if lines else ''
+
+    return 'ok', ''
@@ -14,30 +14,78 @@
 # limitations under the License.
 """Analyzes the differences between two OpenStack-Ansible commits."""
 import argparse
-import glob
+import fnmatch
+import hashlib
 import json
 import logging
 import os
+import posixpath
 import re
+import shutil
 import subprocess
 import sys
-from collections import defaultdict
-from distutils.version import LooseVersion
+import tempfile
+import threading
+from collections import (Counter, OrderedDict, defaultdict, deque,
+                         namedtuple)
+from contextlib import contextmanager
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+
+# GitPython, jinja2, requests and yaml are slow to import, so they are only
+# imported by the functions that use them.
+from . import cache
+from . import exceptions
+from . import tags
+from . import timing
 
-from git import Repo
 
-import jinja2
+# Configure logging
+log = logging.getLogger()
+log.setLevel(logging.ERROR)
 
-import requests
+# Location of the project pins inside the openstack-ansible repository.
+REPO_PACKAGES_GLOB = 'playbooks/defaults/repo_packages/*.yml'
 
-import yaml
+# Suffix for git directories being converted into bare repositories.
+MIGRATION_SUFFIX = '.bare-migration'
 
-from . import exceptions
+# git log format for CommitRecord fields, separated by ASCII unit separators.
+# Every record starts with an ASCII record separator and ends with the raw
+# message, whose first line is the summary.
+COMMIT_LOG_FORMAT = '%x1e%H%x1f%an%x1f%aI%x1f%B'
 
+# Titles of the role and project sections of a report.
+SECTION_TITLES = {
+    'roles': 'OpenStack-Ansible Roles',
+    'projects': 'OpenStack Projects',
+}
 
-# Configure logging
-log = logging.getLogger()
-log.setLevel(logging.ERROR)
+# Output formats of reports. Everything but RST is built from the structured
+# records of a report.
+OUTPUT_FORMATS = ['rst', 'json', 'ndjson']
+
+# Manifests read during this process, by repo, commit SHA and role file.
+_manifest_cache = cache.MemoryCache(64)
+
+# Pins parsed from manifest files during this process, by blob SHA.
+_parse_cache = cache.MemoryCache(1024)
+
+# Open repo handles shared between reports, and the locks guarding each repo.
+REPO_HANDLES_SIZE = 128
+_repo_handles = OrderedDict()
+_repo_locks = defaultdict(threading.RLock)
+_repo_locks_lock = threading.Lock()
+
+# Jinja environments and template digests, by template directory.
+_jinja_envs = {}
+_template_digests = {}
+_jinja_envs_lock = threading.Lock()
+
+# Directory holding our Jinja templates.
+TEMPLATE_DIR = "{0}/templates".format(
+    os.path.dirname(os.path.abspath(__file__))
+)
 
 
 class VersionMappingsAction(argparse.Action):
@@ -64,6 +112,15 @@ class VersionMappingsAction(argparse.Action):
         setattr(namespace, self.dest, version_mappings)
 
 
+def positive_int(value):
+    """Parse an argparse value that has to be a whole number of at least 1."""
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(
+            "{0} is not a number of at least 1".format(value))
+    return number
+
+
 def create_parser():
     """Create argument parser."""
     description = """Generate OpenStack-Ansible Diff
@@ -92,6 +149,150 @@ commits in OpenStack-Ansible.
         nargs=1,
         help="Git SHA of the newer commit",
     )
+    add_report_arguments(parser)
+    parser.add_argument(
+        '--previous',
+        metavar="FILENAME",
+        action='store',
+        help=("Extend a report saved with --format json or ndjson that\n"
+              "starts at the same old commit. Only the changes since its\n"
+              "new commit are read from the repositories."),
+    )
+    return parser
+
+
+def create_batch_parser():
+    """Create argument parser for batch reports."""
+    description = """Generate OpenStack-Ansible Diffs in batch
+----------------------------------------
+
+Generates one report for each pair of OpenStack-Ansible commits. Repositories,
+manifests and commit ranges are shared between all of the reports.
+
+"""
+
+    parser = argparse.ArgumentParser(
+        usage='%(prog)s batch',
+        description=description,
+        epilog='Licensed "Apache 2.0"',
+        formatter_class=argparse.RawTextHelpFormatter
+    )
+    parser.add_argument(
+        'pairs',
+        action='store',
+        nargs='*',
+        metavar='OLD..NEW',
+        help="Pair of older and newer commits to compare",
+    )
+    parser.add_argument(
+        '--pairs-file',
+        metavar="FILENAME",
+        action='store',
+        help=("File with one 'OLD NEW' or 'OLD..NEW' pair per line,\n"
+              "or - to read them from stdin"),
+    )
+    parser.add_argument(
+        '--output-dir',
+        metavar="DIRECTORY",
+        action='store',
+        help="Write each report to its own file in this directory",
+    )
+    add_report_arguments(parser)
+    parser.set_defaults(command='batch')
+    return parser
+
+
+def create_serve_parser():
+    """Create argument parser for the report server."""
+    description = """Serve OpenStack-Ansible Diffs
+----------------------------
+
+Runs a local HTTP server that generates reports on request. Repositories and
+caches stay open between requests, so reports are returned much faster than
+by running osa-differ for each of them.
+
+"""
+
+    parser = argparse.ArgumentParser(
+        usage='%(prog)s serve',
+        description=description,
+        epilog='Licensed "Apache 2.0"',
+        formatter_class=argparse.RawTextHelpFormatter
+    )
+    parser.add_argument(
+        '--host',
+        action='store',
+        default='127.0.0.1',
+        help="Address to listen on (default: %(default)s)",
+    )
+    parser.add_argument(
+        '--port',
+        action='store',
+        type=int,
+        default=8080,
+        help="Port to listen on (default: %(default)s)",
+    )
+    parser.add_argument(
+        '--socket',
+        metavar="PATH",
+        action='store',
+        help="Listen on a unix socket instead of a TCP port",
+    )
+    add_report_arguments(parser)
+    parser.set_defaults(command='serve')
+    return parser
+
+
+def create_maintain_parser():
+    """Create argument parser for storage maintenance."""
+    description = """Maintain OpenStack-Ansible Diff Storage
+--------------------------------------
+
+Packs refs and objects, expires old reflogs and loose objects, and writes
+commit-graph and multi-pack-index files for every repository in the storage
+directory. Reports the disk use of each repository and how long each step
+took.
+
+"""
+
+    parser = argparse.ArgumentParser(
+        usage='%(prog)s maintain',
+        description=description,
+        epilog='Licensed "Apache 2.0"',
+        formatter_class=argparse.RawTextHelpFormatter
+    )
+    parser.add_argument(
+        '--verbose',
+        action='store_true',
+        default=False,
+        help="Enable info output",
+    )
+    parser.add_argument(
+        '--debug',
+        action='store_true',
+        default=False,
+        help="Enable debug output",
+    )
+    parser.add_argument(
+        '-d', '--directory',
+        action='store',
+        default="~/.osa-differ",
+        help="Git repo storage directory (default: ~/.osa-differ)",
+    )
+    parser.add_argument(
+        '-j', '--jobs',
+        action='store',
+        type=int,
+        default=4,
+        help="Number of repositories to maintain in parallel (default: 4)",
+    )
+    parser.set_defaults(command='maintain')
+    return parser
+
+
+def add_report_arguments(parser):
+    """Add the arguments shared by every kind of report."""
+    parser.set_defaults(command='report')
     parser.add_argument(
         '--verbose',
         action='store_true',
@@ -122,6 +323,80 @@ commits in OpenStack-Ansible.
         default=False,
         help="Fetch latest changes to repo",
     )
+    parser.add_argument(
+        '--auto-update',
+        action='store_const',
+        dest='update',
+        const='auto',
+        help=("Fetch only the repos that are missing one of the pinned\n"
+              "commits"),
+    )
+    parser.add_argument(
+        '-j', '--jobs',
+        action='store',
+        type=int,
+        default=1,
+        help="Number of repositories to process in parallel (default: 1)",
+    )
+    parser.add_argument(
+        '--storage-mode',
+        action='store',
+        choices=['checkout', 'bare'],
+        default='checkout',
+        help=("How role and project repositories are stored. 'bare' keeps\n"
+              "bare repositories, skips all working tree operations and\n"
+              "converts existing checkouts (default: checkout)"),
+    )
+    parser.add_argument(
+        '--clone-filter',
+        action='store',
+        choices=['blob:none', 'tree:0'],
+        help=("Make partial clones of role and project repositories.\n"
+              "Missing objects are fetched on demand when needed."),
+    )
+    parser.add_argument(
+        '--fetch-concurrency',
+        action='store',
+        type=int,
+        default=4,
+        help=("Number of role and project repositories to clone or fetch\n"
+              "at once before reporting. 0 fetches each repo while it is\n"
+              "being reported on instead (default: 4)"),
+    )
+    parser.add_argument(
+        '--fetch-timeout',
+        action='store',
+        type=float,
+        default=600,
+        help="Seconds to wait for each clone or fetch (default: 600)",
+    )
+    parser.add_argument(
+        '--cache-size',
+        action='store',
+        type=int,
+        default=256,
+        help=("Size limit in MB for each cache in the storage directory\n"
+              "(default: 256)"),
+    )
+    parser.add_argument(
+        '--no-cache',
+        action='store_true',
+        default=False,
+        help="Do not read or write any caches",
+    )
+    parser.add_argument(
+        '--timings',
+        action='store_true',
+        default=False,
+        help="Print how long each phase and repository took to stderr",
+    )
+    parser.add_argument(
+        '--trace',
+        metavar="FILENAME",
+        action='store',
+        help=("Write timing spans to a Chrome trace file, or to a JSON\n"
+              "lines file if FILENAME ends in .jsonl"),
+    )
     parser.add_argument(
         '--osa-repo-url',
         action='store',
@@ -148,6 +423,14 @@ commits in OpenStack-Ansible.
         action="store_true",
         help="Skip checking for changes in OpenStack-Ansible roles"
     )
+    display_opts.add_argument(
+        "--max-commits-per-repo",
+        action="store",
+        type=positive_int,
+        metavar="N",
+        help=("List at most N commits of each repository. Larger\n"
+              "ranges are summarized by author and month instead")
+    )
     release_note_opts = parser.add_argument_group("Release notes")
     release_note_opts.add_argument(
         "--release-notes",
@@ -163,6 +446,14 @@ commits in OpenStack-Ansible.
         default=False,
         help="Do not output to stdout",
     )
+    output_opts.add_argument(
+        '--format',
+        action='store',
+        choices=OUTPUT_FORMATS,
+        default='rst',
+        help=("Report format. 'json' and 'ndjson' write structured records\n"
+              "for each repo instead of RST (default: rst)"),
+    )
     output_opts.add_argument(
         '--gist',
         action='store_true',
@@ -175,17 +466,271 @@ commits in OpenStack-Ansible.
         action='store',
         help="Output to a file",
     )
-    return parser
 
 
-def get_commits(repo_dir, old_commit, new_commit, hide_merges=True):
-    """Find all commits between two commit SHAs."""
-    repo = Repo(repo_dir)
-    commits = repo.iter_commits(rev="{0}..{1}".format(old_commit, new_commit))
-    if hide_merges:
-        return [x for x in commits if not x.summary.startswith("Merge ")]
-    else:
-        return list(commits)
+class CommitRecord(namedtuple('CommitRecord', ['hexsha', 'summary', 'author',
+                                               'date'])):
+    """The details of a commit that are used in reports."""
+
+    __slots__ = ()
+
+
+class PinDiff(namedtuple('PinDiff', ['ranges', 'added', 'removed'])):
+    """How the pins of a list of repos changed between two manifests.
+
+    ``ranges`` holds a ``(repo_name, repo_url, old_commit, new_commit)``
+    range for every repo that is pinned in both manifests, in the order of
+    the new pins. ``added`` holds the new pins of repos that were not pinned
+    before, and ``removed`` the old pins of repos that are no longer pinned.
+    """
+
+    __slots__ = ()
+
+    @property
+    def changed(self):
+        """List the ranges of the repos whose pins moved."""
+        return [x for x in self.ranges if x[2] != x[3]]
+
+    @property
+    def unchanged(self):
+        """List the ranges of the repos whose pins did not move."""
+        return [x for x in self.ranges if x[2] == x[3]]
+
+    def counts(self):
+        """Count the repos in each group."""
+        return OrderedDict([('added', len(self.added)),
+                            ('removed', len(self.removed)),
+                            ('changed', len(self.changed)),
+                            ('unchanged', len(self.unchanged))])
+
+
+def get_commits(repo_dir, old_commit, new_commit, hide_merges=True,
+                commit_cache=None, repo_url=None):
+    """Find all commits between two commit SHAs.
+
+    With a ``commit_cache``, both commits are resolved to SHAs first and
+    the range is looked up in the cache before walking any history.
+    """
+    if commit_cache is not None:
+        repo_url = repo_url or repo_dir
+        old_sha = resolve_commit(repo_dir, old_commit)
+        new_sha = resolve_commit(repo_dir, new_commit)
+        commits = get_cached_commits(commit_cache, repo_url, old_sha, new_sha,
+                                     hide_merges)
+        if commits is None:
+            commits = get_commits(repo_dir, old_sha, new_sha, hide_merges)
+            commit_cache.put(
+                _commit_cache_key(repo_url, old_sha, new_sha, hide_merges),
+                [list(x) for x in commits]
+            )
+        return commits
+
+    return list(iter_commits(repo_dir, old_commit, new_commit, hide_merges))
+
+
+def iter_commits(repo_dir, old_commit, new_commit, hide_merges=True):
+    """Stream the commits between two commits as ``CommitRecord``s.
+
+    The whole range is read from a single ``git log`` process, so no commit
+    objects have to be loaded one at a time.
+    """
+    from git import GitCommandError
+    rev = "{0}..{1}".format(old_commit, new_commit)
+    command = ['git', 'log', '--format={0}'.format(COMMIT_LOG_FORMAT), rev,
+               '--']
+    log_p = subprocess.Popen(command,
+                             cwd=repo_dir,
+                             stdout=subprocess.PIPE,
+                             stderr=subprocess.PIPE)
+    finished = False
+    try:
+        for line in log_p.stdout:
+            # Only the first line of each record is needed, the rest of the
+            # message is skipped.
+            if not line.startswith(b'\x1e'):
+                continue
+            fields = line[1:].decode('UTF-8', 'replace').rstrip('\n').split(
+                '\x1f', 3)
+            commit = CommitRecord(fields[0], fields[3], fields[1], fields[2])
+            if hide_merges and commit.summary.startswith("Merge "):
+                continue
+            yield commit
+        finished = True
+    finally:
+        # Stop git if the caller did not read the whole range.
+        if not finished:
+            log_p.kill()
+        log_p.stdout.close()
+        stderr = log_p.stderr.read().decode('UTF-8', 'replace')
+        log_p.stderr.close()
+        returncode = log_p.wait()
+
+    if returncode != 0:
+        raise GitCommandError(command, returncode, stderr)
+
+
+def get_cached_commits(commit_cache, repo_url, old_sha, new_sha,
+                       hide_merges=True):
+    """Look up the commits between two full SHAs in the commit cache."""
+    records = commit_cache.get(
+        _commit_cache_key(repo_url, old_sha, new_sha, hide_merges)
+    )
+    if records is None:
+        return None
+
+    return [CommitRecord(*x) for x in records]
+
+
+def _commit_cache_key(repo_url, old_sha, new_sha, hide_merges):
+    return ['commits', repo_url, old_sha, new_sha, hide_merges]
+
+
+def get_report_commits(repo_dir, old_commit, new_commit, commit_cache=None,
+                       repo_url=None, max_commits=None):
+    """Find the commits of a range that are listed in a report.
+
+    Returns ``(commits, truncated)``. The range is streamed once through
+    ``summarize_commits``, so ranges with more than ``max_commits`` commits
+    are never held in memory in full, and ``truncated`` holds their
+    summary. It is None for every other range.
+    """
+    if not max_commits:
+        return get_commits(repo_dir, old_commit, new_commit,
+                           commit_cache=commit_cache, repo_url=repo_url), None
+
+    if commit_cache is not None:
+        repo_url = repo_url or repo_dir
+        old_commit = resolve_commit(repo_dir, old_commit)
+        new_commit = resolve_commit(repo_dir, new_commit)
+        result = get_cached_report_commits(commit_cache, repo_url, old_commit,
+                                           new_commit, max_commits)
+        if result is not None:
+            return result
+
+    commits, truncated = summarize_commits(
+        iter_commits(repo_dir, old_commit, new_commit), max_commits)
+    if not truncated['omitted']:
+        # Every commit fits, so this is the same as the full range.
+        if commit_cache is not None:
+            commit_cache.put(
+                _commit_cache_key(repo_url, old_commit, new_commit, True),
+                [list(x) for x in commits]
+            )
+        return commits, None
+
+    if commit_cache is not None:
+        commit_cache.put(
+            _summary_cache_key(repo_url, old_commit, new_commit, max_commits),
+            {'commits': [list(x) for x in commits], 'truncated': truncated}
+        )
+    return commits, truncated
+
+
+def get_cached_report_commits(commit_cache, repo_url, old_sha, new_sha,
+                              max_commits=None):
+    """Look up the listed commits between two full SHAs in the commit cache.
+
+    Returns ``(commits, truncated)`` like ``get_report_commits``, or None if
+    the range is not cached.
+    """
+    if max_commits:
+        summary = commit_cache.get(
+            _summary_cache_key(repo_url, old_sha, new_sha, max_commits)
+        )
+        if summary is not None:
+            return ([CommitRecord(*x) for x in summary['commits']],
+                    summary['truncated'])
+
+    commits = get_cached_commits(commit_cache, repo_url, old_sha, new_sha)
+    if commits is None:
+        return None
+    return _limit_commits(commits, max_commits)
+
+
+def _summary_cache_key(repo_url, old_sha, new_sha, max_commits):
+    return ['commit-summary', repo_url, old_sha, new_sha, max_commits]
+
+
+def summarize_commits(commits, max_commits):
+    """Summarize a range of commits that is too long to list in full.
+
+    ``commits`` may be any iterable, newest first, and is only read once.
+    The newest and the oldest commits are kept, ``max_commits`` of them in
+    total, and every commit is counted by author and by month. Nothing is
+    omitted from ranges that fit. Returns ``(kept_commits, summary)``.
+    """
+    newest_count = (max_commits + 1) // 2
+    newest = []
+    oldest = deque(maxlen=max_commits - newest_count)
+    authors = Counter()
+    months = Counter()
+    total = 0
+    for commit in commits:
+        total += 1
+        authors[commit.author] += 1
+        months[commit.date[:7]] += 1
+        if len(newest) < newest_count:
+            newest.append(commit)
+        else:
+            oldest.append(commit)
+
+    summary = {
+        'total': total,
+        'newest': len(newest),
+        'oldest': len(oldest),
+        'omitted': total - len(newest) - len(oldest),
+        'authors': [[name, count] for name, count in
+                    sorted(authors.items(), key=lambda x: (-x[1], x[0]))],
+        'months': [[month, months[month]]
+                   for month in sorted(months, reverse=True)],
+    }
+    return newest + list(oldest), summary
+
+
+def is_commit_sha(ref):
+    """Check if a reference is a full commit SHA."""
+    return re.match('^[0-9a-fA-F]{40}$', ref) is not None
+
+
+def resolve_commit(repo_dir, ref):
+    """Resolve a reference to a full commit SHA."""
+    if is_commit_sha(ref):
+        return ref.lower()
+
+    with locked_repo(repo_dir) as repo:
+        return repo.commit(ref).hexsha
+
+
+def repo_lock(repo_dir):
+    """Return the lock that serializes access to a repo."""
+    with _repo_locks_lock:
+        return _repo_locks[os.path.abspath(repo_dir)]
+
+
+@contextmanager
+def locked_repo(repo_dir):
+    """Hold the lock of a repo and yield a shared handle for it.
+
+    Handles stay open between calls, so their git processes and object
+    caches are reused. They must only be used while the lock is held.
+    """
+    from git import Repo
+    repo_dir = os.path.abspath(repo_dir)
+    with repo_lock(repo_dir):
+        with _repo_locks_lock:
+            repo = _repo_handles.pop(repo_dir, None)
+            if repo is None:
+                repo = Repo(repo_dir)
+            _repo_handles[repo_dir] = repo
+            while len(_repo_handles) > REPO_HANDLES_SIZE:
+                _repo_handles.popitem(last=False)
+        yield repo
+
+
+def forget_repo(repo_dir):
+    """Drop the shared handle of a repo that was replaced on disk."""
+    with _repo_locks_lock:
+        _repo_handles.pop(os.path.abspath(repo_dir), None)
 
 
 def get_commit_url(repo_url):
@@ -202,23 +747,96 @@ def get_commit_url(repo_url):
 
 def get_projects(osa_repo_dir, commit):
     """Get all projects from multiple YAML files."""
-    # Check out the correct commit SHA from the repository
+    from git import Repo
     repo = Repo(osa_repo_dir)
-    checkout(repo, commit)
+    return _read_projects(repo.commit(commit).tree, _parse_cache)
 
-    yaml_files = glob.glob(
-        '{0}/playbooks/defaults/repo_packages/*.yml'.format(osa_repo_dir)
-    )
-    yaml_parsed = []
-    for yaml_file in yaml_files:
-        with open(yaml_file, 'r') as f:
-            yaml_parsed.append(yaml.load(f))
 
-    merged_dicts = {k: v for d in yaml_parsed for k, v in d.items()}
+def get_manifests(osa_repo_dir, commit, role_requirements,
+                  parse_cache=None):
+    """Read the role and project pins at a particular commit.
+
+    Both manifests are read straight from the commit's tree objects in a
+    single pass, so the OpenStack-Ansible working tree is never touched.
+    The result is kept in memory for the rest of the process.
+
+    The pins of each file are kept in ``parse_cache`` by the SHA of the
+    file's blob, so files that are the same in many commits are only
+    parsed once. An in-memory cache is used if none is given.
+    """
+    if parse_cache is None:
+        parse_cache = _parse_cache
+    with locked_repo(osa_repo_dir) as repo:
+        commit = repo.commit(commit)
+        key = [os.path.abspath(osa_repo_dir), commit.hexsha,
+               role_requirements]
+        manifests = _manifest_cache.get(key)
+        if manifests is None:
+            log.info("Reading manifests from commit {c} in repo {r}".format(
+                c=commit.hexsha, r=osa_repo_dir))
+            manifests = (_read_roles(commit.tree, role_requirements,
+                                     parse_cache),
+                         _read_projects(commit.tree, parse_cache))
+            _manifest_cache.put(key, manifests)
+
+    return manifests
+
+
+def _read_projects(tree, parse_cache=None):
+    # Only the project pins of each file are kept, as a list of pairs so
+    # they are merged in the same order as the files.
+    merged_dicts = OrderedDict()
+    for blob in _tree_glob(tree, REPO_PACKAGES_GLOB):
+        key = ['project-pins', blob.hexsha]
+        pins = parse_cache.get(key) if parse_cache is not None else None
+        if pins is None:
+            pins = [[k, v] for k, v in _load_blob_yaml(blob).items()
+                    if k.endswith(('git_repo', 'git_install_branch'))]
+            if parse_cache is not None:
+                parse_cache.put(key, pins)
+        merged_dicts.update(pins)
 
     return normalize_yaml(merged_dicts)
 
 
+def _read_roles(tree, role_requirements, parse_cache=None):
+    try:
+        blob = tree / role_requirements
+    except KeyError:
+        raise IOError("File {0} could not be found in tree {1}".format(
+            role_requirements, tree.hexsha))
+
+    key = ['role-pins', blob.hexsha]
+    pins = parse_cache.get(key) if parse_cache is not None else None
+    if pins is None:
+        pins = normalize_yaml(_load_blob_yaml(blob))
+        if parse_cache is not None:
+            parse_cache.put(key, [list(x) for x in pins])
+        return pins
+
+    return [tuple(x) for x in pins]
+
+
+def _load_blob_yaml(blob):
+    import yaml
+    # The C loader is many times faster, but needs PyYAML built with
+    # libyaml.
+    loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+    return yaml.load(blob.data_stream.read(), Loader=loader)
+
+
+def _tree_glob(tree, pattern):
+    # Only the last path component may contain wildcards, which lets us
+    # walk straight down to the directory instead of traversing the tree.
+    dirname, basename = posixpath.split(pattern)
+    try:
+        subtree = tree / dirname if dirname else tree
+    except KeyError:
+        return []
+    blobs = [x for x in subtree.blobs if fnmatch.fnmatch(x.name, basename)]
+    return sorted(blobs, key=lambda x: x.path)
+
+
 def checkout(repo, ref):
     """Checkout a repoself."""
     # Delete local branch if it exists, remote branch will be tracked
@@ -247,86 +865,484 @@ def checkout(repo, ref):
 
 def get_roles(osa_repo_dir, commit, role_requirements):
     """Read OSA role information at a particular commit."""
+    from git import Repo
     repo = Repo(osa_repo_dir)
 
-    checkout(repo, commit)
-
     log.info("Looking for file {f} in repo {r}".format(r=osa_repo_dir,
                                                        f=role_requirements))
-    filename = "{0}/{1}".format(osa_repo_dir, role_requirements)
-    with open(filename, 'r') as f:
-        roles_yaml = yaml.load(f)
-
-    return normalize_yaml(roles_yaml)
+    return _read_roles(repo.commit(commit).tree, role_requirements,
+                       _parse_cache)
 
 
 def make_osa_report(repo_dir, old_commit, new_commit,
-                    args):
+                    args, commit_cache=None):
     """Create initial RST report header for OpenStack-Ansible."""
-    update_repo(repo_dir, args.osa_repo_url, args.update)
+    record = make_osa_record(repo_dir, old_commit, new_commit, args,
+                             commit_cache)
+    return render_osa_report(record, args)
 
-    # Are these commits valid?
-    validate_commits(repo_dir, [old_commit, new_commit])
 
-    # Do we have a valid commit range?
-    validate_commit_range(repo_dir, old_commit, new_commit)
+def make_osa_record(repo_dir, old_commit, new_commit,
+                    args, commit_cache=None, previous=None):
+    """Collect the OpenStack-Ansible commits between two commits.
 
-    # Get the commits in the range
-    commits = get_commits(repo_dir, old_commit, new_commit)
+    A ``previous`` record that starts at the same old commit is extended
+    to the new commit instead of reading the whole range again.
+    """
+    # Manifests are read from git objects, so the working tree is left alone.
+    with timing.span('osa-update'):
+        update_repo(repo_dir, args.osa_repo_url, args.update, reset=False,
+                    commits=[old_commit, new_commit])
+        if args.release_notes:
+            # Pick up any tags the update brought in.
+            tags.TagIndex(repo_dir)
+
+    with timing.span('validate', repo='openstack-ansible'):
+        # Are these commits valid?
+        validate_commits(repo_dir, [old_commit, new_commit])
+
+        # Do we have a valid commit range?
+        validate_commit_range(repo_dir, old_commit, new_commit)
 
+    old_sha = resolve_commit(repo_dir, old_commit)
+    new_sha = resolve_commit(repo_dir, new_commit)
+
+    # Get the commits in the range
+    max_commits = args.max_commits_per_repo
+    with timing.span('log', repo='openstack-ansible'):
+        commits = None
+        if (previous is not None and not previous.get('truncated') and
+                previous.get('resolved_old_sha') == old_sha):
+            commits = extend_commits(repo_dir, previous,
+                                     previous['resolved_new_sha'], new_sha,
+                                     commit_cache, args.osa_repo_url)
+        if commits is not None:
+            commits, truncated = _limit_commits(commits, max_commits)
+        else:
+            commits, truncated = get_report_commits(
+                repo_dir, old_commit, new_commit, commit_cache,
+                args.osa_repo_url, max_commits
+            )
+
+    record = make_repo_record('openstack-ansible', args.osa_repo_url,
+                              old_commit, new_commit, commits, truncated)
+    # Keep the SHAs, so the report can be extended later on even if the
+    # commits were given as tags or branches.
+    record['resolved_old_sha'] = old_sha
+    record['resolved_new_sha'] = new_sha
+    return record
+
+
+def render_osa_report(record, args):
+    """Render the report header from the OpenStack-Ansible record."""
     # Start off our report with a header and our OpenStack-Ansible commits.
-    template_vars = {
-        'args': args,
-        'repo': 'openstack-ansible',
-        'commits': commits,
-        'commit_base_url': get_commit_url(args.osa_repo_url),
-        'old_sha': old_commit,
-        'new_sha': new_commit
+    template_vars = dict(record, args=args)
+    with timing.span('render', repo='openstack-ansible'):
+        return render_template('offline-header.j2', template_vars)
+
+
+def make_repo_record(repo_name, repo_url, old_sha, new_sha, commits,
+                     truncated=None):
+    """Build the structured record of the commits in one repo.
+
+    Records only hold plain types, so they can be written out as JSON.
+    Their keys are also the variables of the report templates. Ranges that
+    were too long to list in full only hold some of their commits, and the
+    summary from ``summarize_commits`` in ``truncated``.
+    """
+    commit_base_url = get_commit_url(repo_url)
+    return {
+        'type': 'repo',
+        'repo': repo_name,
+        'repo_url': repo_url,
+        'commit_base_url': commit_base_url,
+        'old_sha': old_sha,
+        'new_sha': new_sha,
+        'commits': [
+            dict(x._asdict(),
+                 url="{0}/commit/{1}".format(commit_base_url, x.hexsha))
+            for x in commits
+        ],
+        'truncated': truncated,
     }
-    return render_template('offline-header.j2', template_vars)
 
 
 def make_report(storage_directory, old_pins, new_pins, do_update=False,
-                version_mappings=None):
-    """Create RST report from a list of projects/roles."""
-    report = ""
-    version_mappings = version_mappings or {}
-    for new_pin in new_pins:
-        repo_name, repo_url, commit_sha = new_pin
-        commit_sha = version_mappings.get(repo_name, {}
-                                          ).get(commit_sha, commit_sha)
+                version_mappings=None, jobs=1, clone_options=None,
+                commit_cache=None, fragment_cache=None, max_commits=None):
+    """Create RST report from a list of projects/roles.
+
+    Repositories are processed by a pool of ``jobs`` workers, but their
+    sections are always assembled in the order of ``new_pins``. Failures
+    are collected per repository and raised together once every repository
+    has been processed. Ranges with more than ``max_commits`` commits are
+    summarized.
+    """
+    pin_diff = diff_pins(old_pins, new_pins, version_mappings)
+    return "".join(iter_range_sections(storage_directory, pin_diff.ranges,
+                                       do_update, jobs, clone_options,
+                                       commit_cache, fragment_cache,
+                                       max_commits))
 
-        # Prepare our repo directory and clone the repo if needed. Only pull
-        # if the user requests it.
-        repo_dir = "{0}/{1}".format(storage_directory, repo_name)
-        update_repo(repo_dir, repo_url, do_update)
 
-        # Get the old SHA from the previous pins. If this pin didn't exist
-        # in the previous OSA revision, skip it. This could happen with newly-
-        # added projects and roles.
+def iter_range_sections(storage_directory, pin_ranges, do_update=False,
+                        jobs=1, clone_options=None, commit_cache=None,
+                        fragment_cache=None, max_commits=None):
+    """Generate the RST sections of the ranges of a ``PinDiff``.
+
+    Sections are yielded in the order of ``pin_ranges`` as soon as each
+    repo is finished, and failures are raised after the last section.
+    Ranges with more than ``max_commits`` commits are summarized.
+    """
+    def report_worker(pin_range):
+        return make_range_report(storage_directory, pin_range, do_update,
+                                 clone_options, commit_cache, fragment_cache,
+                                 max_commits)
+
+    return _iter_pins(report_worker, pin_ranges, jobs)
+
+
+def iter_range_records(storage_directory, pin_ranges, do_update=False,
+                       jobs=1, clone_options=None, commit_cache=None,
+                       previous_records=None, max_commits=None):
+    """Generate the structured records of the ranges of a ``PinDiff``.
+
+    Works like ``iter_range_sections``, without rendering anything.
+    ``previous_records`` maps repo names to the records of an earlier
+    report, which are extended where possible.
+    """
+    previous_records = previous_records or {}
+
+    def record_worker(pin_range):
+        return make_range_record(storage_directory, pin_range, do_update,
+                                 clone_options, commit_cache,
+                                 previous_records.get(pin_range[0]),
+                                 max_commits)
+
+    return _iter_pins(record_worker, pin_ranges, jobs)
+
+
+def _iter_pins(worker, pin_ranges, jobs):
+    def pin_worker(pin_range):
         try:
-            commit_sha_old = next(x[2] for x in old_pins if x[0] == repo_name)
-        except Exception:
-            continue
+            result = worker(pin_range)
+        except Exception as e:
+            log.error("Unable to generate report for {0}: {1}".format(
+                pin_range[0], e))
+            return None, e
+        return result, None
+
+    pool = None
+    if jobs > 1:
+        pool = ThreadPool(jobs)
+        results = pool.imap(pin_worker, pin_ranges)
+    else:
+        results = (pin_worker(x) for x in pin_ranges)
+
+    failures = []
+    try:
+        for pin_range, (result, error) in zip(pin_ranges, results):
+            if error:
+                failures.append((pin_range[0], error))
+            elif result:
+                yield result
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    if failures:
+        raise exceptions.RepoReportException(failures)
+
+
+def get_repo_updates(storage_directory, pin_diff):
+    """List the repos a report needs and the commits it needs from them.
+
+    Returns ``(repo_dir, repo_url, commits)`` tuples for every repo whose
+    pin changed in a ``PinDiff``. Repos that were not moved have no commits
+    to report, so they are never needed.
+    """
+    return [("{0}/{1}".format(storage_directory, repo_name), repo_url,
+             [old_commit, new_commit])
+            for repo_name, repo_url, old_commit, new_commit
+            in pin_diff.changed]
+
+
+def merge_repo_updates(repo_updates):
+    """Merge the repo updates that need the same repo.
+
+    Returns one ``(repo_dir, repo_url, commits)`` tuple for each repo, in
+    the order they first appear, with the commits of every entry for it.
+    """
+    merged = OrderedDict()
+    for repo_dir, repo_url, commits in repo_updates:
+        if repo_dir in merged:
+            merged[repo_dir][2].extend(commits)
         else:
-            commit_sha_old = version_mappings.get(repo_name, {}
-                                                  ).get(commit_sha_old,
-                                                        commit_sha_old)
-
-        # Loop through the commits and render our template.
-        validate_commits(repo_dir, [commit_sha_old, commit_sha])
-        commits = get_commits(repo_dir, commit_sha_old, commit_sha)
-        template_vars = {
-            'repo': repo_name,
-            'commits': commits,
-            'commit_base_url': get_commit_url(repo_url),
-            'old_sha': commit_sha_old,
-            'new_sha': commit_sha
-        }
-        rst = render_template('offline-repo-changes.j2', template_vars)
-        report += rst
+            merged[repo_dir] = (repo_dir, repo_url, list(commits))
+
+    return list(merged.values())
+
 
-    return report
+def diff_pins(old_pins, new_pins, version_mappings=None):
+    """Sort repos into added, removed, changed and unchanged ones.
+
+    Both lists of pins are indexed once, and ``version_mappings`` are
+    applied before the commits are compared. Returns a ``PinDiff``.
+    """
+    version_mappings = version_mappings or {}
+    old_index = {}
+    for pin in old_pins:
+        old_index.setdefault(pin[0], pin)
+    new_names = set(x[0] for x in new_pins)
+
+    ranges = []
+    added = []
+    for repo_name, repo_url, commit_sha in new_pins:
+        # Pins that didn't exist in the previous OSA revision have no range.
+        # This happens with newly-added projects and roles.
+        old_pin = old_index.get(repo_name)
+        if old_pin is None:
+            added.append((repo_name, repo_url, commit_sha))
+            continue
+        mappings = version_mappings.get(repo_name, {})
+        ranges.append((repo_name, repo_url,
+                       mappings.get(old_pin[2], old_pin[2]),
+                       mappings.get(commit_sha, commit_sha)))
+
+    removed = [x for x in old_pins if x[0] not in new_names]
+    return PinDiff(ranges, added, removed)
+
+
+def make_range_report(storage_directory, pin_range, do_update=False,
+                      clone_options=None, commit_cache=None,
+                      fragment_cache=None, max_commits=None):
+    """Create the RST section for the range of a single project/role.
+
+    Pins that did not move have no commits, so their repo is never used.
+    Ranges with more than ``max_commits`` commits are summarized.
+    """
+    repo_name, repo_url, commit_sha_old, commit_sha = pin_range
+    if commit_sha_old == commit_sha:
+        record = make_repo_record(repo_name, repo_url, commit_sha_old,
+                                  commit_sha, [])
+        with timing.span('render', repo=repo_name):
+            return render_template('offline-repo-changes.j2', record)
+
+    template_vars = {
+        'repo': repo_name,
+        'commit_base_url': get_commit_url(repo_url),
+        'old_sha': commit_sha_old,
+        'new_sha': commit_sha
+    }
+
+    # Ranges between two full SHAs never change, so cached output can be
+    # used without touching the repo at all.
+    commits = None
+    truncated = None
+    fragment_key = None
+    if is_commit_sha(commit_sha_old) and is_commit_sha(commit_sha):
+        if fragment_cache is not None:
+            fragment_key = _fragment_cache_key(template_vars,
+                                               commit_sha_old.lower(),
+                                               commit_sha.lower(),
+                                               max_commits)
+            rst = fragment_cache.get(fragment_key)
+            if rst is not None:
+                return rst
+        if commit_cache is not None:
+            cached = get_cached_report_commits(commit_cache, repo_url,
+                                               commit_sha_old.lower(),
+                                               commit_sha.lower(),
+                                               max_commits)
+            if cached is not None:
+                commits, truncated = cached
+
+    repo_dir = "{0}/{1}".format(storage_directory, repo_name)
+    if commits is None:
+        # Updating the repo can change its working tree, so nothing else may
+        # use the repo in the meantime.
+        with repo_lock(repo_dir):
+            prepare_pin_repo(repo_dir, repo_url, commit_sha_old, commit_sha,
+                             do_update, clone_options)
+            if fragment_cache is not None and fragment_key is None:
+                fragment_key = _fragment_cache_key(
+                    template_vars,
+                    resolve_commit(repo_dir, commit_sha_old),
+                    resolve_commit(repo_dir, commit_sha),
+                    max_commits
+                )
+                rst = fragment_cache.get(fragment_key)
+                if rst is not None:
+                    return rst
+            with timing.span('log', repo=repo_name):
+                commits, truncated = get_report_commits(
+                    repo_dir, commit_sha_old, commit_sha, commit_cache,
+                    repo_url, max_commits
+                )
+
+    # Loop through the commits and render our template.
+    record = make_repo_record(repo_name, repo_url, commit_sha_old,
+                              commit_sha, commits, truncated)
+    with timing.span('render', repo=repo_name):
+        rst = render_template('offline-repo-changes.j2', record)
+    if fragment_key is not None:
+        fragment_cache.put(fragment_key, rst)
+
+    return rst
+
+
+def make_range_record(storage_directory, pin_range, do_update=False,
+                      clone_options=None, commit_cache=None, previous=None,
+                      max_commits=None):
+    """Create the structured record for the range of a single project/role.
+
+    Pins that did not move have no commits, so their repo is never used.
+    A ``previous`` record of the repo is extended when both reports start
+    at the same pin. Only full SHA pins are extended, because branches and
+    tags may have moved since the previous report. Ranges with more than
+    ``max_commits`` commits are summarized.
+    """
+    repo_name, repo_url, commit_sha_old, commit_sha = pin_range
+    if commit_sha_old == commit_sha:
+        return make_repo_record(repo_name, repo_url, commit_sha_old,
+                                commit_sha, [])
+
+    commits = None
+    truncated = None
+    if (commit_cache is not None and is_commit_sha(commit_sha_old) and
+            is_commit_sha(commit_sha)):
+        cached = get_cached_report_commits(commit_cache, repo_url,
+                                           commit_sha_old.lower(),
+                                           commit_sha.lower(), max_commits)
+        if cached is not None:
+            commits, truncated = cached
+
+    if previous is not None and not _can_extend(previous, repo_url,
+                                                commit_sha_old, commit_sha):
+        previous = None
+    if (commits is None and previous is not None and
+            previous['new_sha'].lower() == commit_sha.lower()):
+        # The pin did not move, so the repo isn't needed at all.
+        commits, truncated = _limit_commits(_record_commits(previous),
+                                            max_commits)
+
+    if commits is None:
+        repo_dir = "{0}/{1}".format(storage_directory, repo_name)
+        with repo_lock(repo_dir):
+            prepare_pin_repo(repo_dir, repo_url, commit_sha_old, commit_sha,
+                             do_update, clone_options)
+            with timing.span('log', repo=repo_name):
+                if previous is not None:
+                    commits = extend_commits(repo_dir, previous,
+                                             previous['new_sha'], commit_sha,
+                                             commit_cache, repo_url)
+                if commits is not None:
+                    commits, truncated = _limit_commits(commits, max_commits)
+                else:
+                    commits, truncated = get_report_commits(
+                        repo_dir, commit_sha_old, commit_sha, commit_cache,
+                        repo_url, max_commits
+                    )
+
+    return make_repo_record(repo_name, repo_url, commit_sha_old, commit_sha,
+                            commits, truncated)
+
+
+def extend_commits(repo_dir, previous, previous_sha, new_sha,
+                   commit_cache=None, repo_url=None):
+    """Extend the commits of a previous record up to a newer commit.
+
+    ``previous_sha`` is the commit the previous record ended at. Returns
+    None if it is not an ancestor of ``new_sha``, for example because the
+    pin was rolled back or replaced, and the whole range has to be read
+    again.
+    """
+    previous_commits = _record_commits(previous)
+    if previous_sha.lower() == new_sha.lower():
+        return previous_commits
+
+    if not is_ancestor(repo_dir, previous_sha, new_sha):
+        log.info("Unable to extend the previous report of {0} from {1} to "
+                 "{2}".format(repo_dir, previous_sha, new_sha))
+        return None
+
+    return get_commits(repo_dir, previous_sha, new_sha,
+                       commit_cache=commit_cache,
+                       repo_url=repo_url) + previous_commits
+
+
+def _can_extend(previous, repo_url, old_sha, new_sha):
+    return (not previous.get('truncated') and
+            previous['repo_url'] == repo_url and
+            previous['old_sha'] == old_sha and
+            all(is_commit_sha(x) for x in [old_sha, new_sha,
+                                           previous['new_sha']]))
+
+
+def _limit_commits(commits, max_commits):
+    if max_commits and len(commits) > max_commits:
+        return summarize_commits(commits, max_commits)
+    return commits, None
+
+
+def _record_commits(record):
+    return [CommitRecord(x['hexsha'], x['summary'], x['author'], x['date'])
+            for x in record['commits']]
+
+
+def prepare_pin_repo(repo_dir, repo_url, old_commit, new_commit,
+                     do_update=False, clone_options=None):
+    """Clone or update a project/role repo and check both of its pins.
+
+    The caller must hold the lock of the repo.
+    """
+    repo_name = os.path.basename(repo_dir)
+    # Prepare our repo directory and clone the repo if needed. Only
+    # pull if the user requests it.
+    with timing.span('update', repo=repo_name):
+        update_repo(repo_dir, repo_url, do_update,
+                    clone_options=clone_options,
+                    commits=[old_commit, new_commit])
+
+    with timing.span('validate', repo=repo_name):
+        validate_commits(repo_dir, [old_commit, new_commit])
+
+
+def _fragment_cache_key(template_vars, old_sha, new_sha, max_commits=None):
+    return ['fragment', template_vars['repo'],
+            template_vars['commit_base_url'], template_vars['old_sha'],
+            template_vars['new_sha'], old_sha, new_sha, max_commits,
+            get_template_digest()]
+
+
+def get_report_cache_key(osa_repo_dir, old_commit, new_commit, args):
+    """Build the cache key for a whole report.
+
+    Returns None if the OpenStack-Ansible commits can't be resolved.
+    """
+    try:
+        old_sha = resolve_commit(osa_repo_dir, old_commit)
+        new_sha = resolve_commit(osa_repo_dir, new_commit)
+    except Exception:
+        return None
+
+    options = {
+        'osa_repo_url': args.osa_repo_url,
+        'role_requirements': args.role_requirements,
+        'skip_projects': args.skip_projects,
+        'skip_roles': args.skip_roles,
+        'release_notes': args.release_notes,
+        'version_mappings': args.version_mappings,
+        'max_commits_per_repo': args.max_commits_per_repo,
+    }
+    key = ['report', old_commit, new_commit, old_sha, new_sha, options,
+           get_template_digest()]
+    if args.release_notes:
+        # Release notes depend on the tags in the repo, not only the commits.
+        key.append(tags.TagIndex(osa_repo_dir).digest())
+
+    return key
 
 
 def normalize_yaml(yaml):
@@ -353,19 +1369,28 @@ def normalize_yaml(yaml):
 
 def parse_arguments():
     """Parse arguments."""
+    if sys.argv[1:2] == ['batch']:
+        return create_batch_parser().parse_args(sys.argv[2:])
+    if sys.argv[1:2] == ['serve']:
+        return create_serve_parser().parse_args(sys.argv[2:])
+    if sys.argv[1:2] == ['maintain']:
+        return create_maintain_parser().parse_args(sys.argv[2:])
+
     parser = create_parser()
     args = parser.parse_args()
     return args
 
 
-def post_gist(report_data, old_sha, new_sha):
+def post_gist(report_data, old_sha, new_sha, output_format='rst'):
     """Post the report to a GitHub Gist and return the URL of the gist."""
+    import requests
     payload = {
         "description": ("Changes in OpenStack-Ansible between "
                         "{0} and {1}".format(old_sha, new_sha)),
         "public": True,
         "files": {
-            "osa-diff-{0}-{1}.rst".format(old_sha, new_sha): {
+            "osa-diff-{0}-{1}.{2}".format(old_sha, new_sha,
+                                          output_format): {
                 "content": report_data
             }
         }
@@ -385,17 +1410,46 @@ def publish_report(report, args, old_commit, new_commit):
         return report
 
     if args.gist:
-        gist_url = post_gist(report, old_commit, new_commit)
+        with timing.span('publish'):
+            gist_url = post_gist(report, old_commit, new_commit,
+                                 args.format)
         output += "\nReport posted to GitHub Gist: {0}".format(gist_url)
 
     if args.file is not None:
-        with open(args.file, 'w') as f:
+        with timing.span('publish'), open(args.file, 'w') as f:
             f.write(report)
         output += "\nReport written to file: {0}".format(args.file)
 
     return output
 
 
+def stream_report(sections, args, old_commit, new_commit):
+    """Publish the RST report while its sections are being generated.
+
+    Sections are written to stdout or to the report file as soon as they
+    arrive. A gist can only be posted once the report is complete. Returns
+    the output to print, like ``publish_report``.
+    """
+    if args.gist:
+        return publish_report("".join(sections), args, old_commit,
+                              new_commit)
+
+    if args.file is not None:
+        with open(args.file, 'w') as f:
+            for rst in sections:
+                with timing.span('publish'):
+                    f.write(rst)
+        return "\nReport written to file: {0}".format(args.file)
+
+    for rst in sections:
+        if not args.quiet:
+            with timing.span('publish'):
+                sys.stdout.write(rst)
+                sys.stdout.flush()
+
+    return ""
+
+
 def prepare_storage_dir(storage_directory):
     """Prepare the storage directory."""
     storage_directory = os.path.expanduser(storage_directory)
@@ -405,36 +1459,149 @@ def prepare_storage_dir(storage_directory):
     return storage_directory
 
 
+def get_clone_options(args):
+    """Build the git clone options for role and project repositories."""
+    clone_options = {}
+    if args.storage_mode == 'bare':
+        clone_options['bare'] = True
+    if args.clone_filter:
+        clone_options['filter'] = args.clone_filter
+
+    return clone_options
+
+
+def migrate_storage_dir(storage_directory, skip=('openstack-ansible',)):
+    """Convert role and project checkouts into bare repositories.
+
+    The ``.git`` directory of each checkout is moved into place of the
+    checkout itself, so no objects need to be fetched again. Repositories
+    that are already bare are left alone, which makes this safe to run on
+    every invocation.
+    """
+    from git import Repo
+    migrated = []
+    for name in sorted(os.listdir(storage_directory)):
+        repo_dir = os.path.join(storage_directory, name)
+        if name.endswith(MIGRATION_SUFFIX):
+            # Finish a migration that was interrupted after the git
+            # directory had been moved out of the checkout. What is left of
+            # the checkout has no git directory, so it can go.
+            final_dir = repo_dir[:-len(MIGRATION_SUFFIX)]
+            if (os.path.isdir(final_dir) and
+                    not os.path.exists(os.path.join(final_dir, '.git'))):
+                shutil.rmtree(final_dir)
+            if not os.path.exists(final_dir):
+                os.rename(repo_dir, final_dir)
+                migrated.append(os.path.basename(final_dir))
+            continue
+
+        git_dir = os.path.join(repo_dir, '.git')
+        if name in skip or not os.path.isdir(git_dir):
+            continue
+
+        log.info("Converting {0} into a bare repository".format(repo_dir))
+        forget_repo(repo_dir)
+        Repo(repo_dir).git.config('--bool', 'core.bare', 'true')
+        moved_dir = "{0}{1}".format(repo_dir, MIGRATION_SUFFIX)
+        os.rename(git_dir, moved_dir)
+        shutil.rmtree(repo_dir)
+        os.rename(moved_dir, repo_dir)
+        migrated.append(name)
+
+    return migrated
+
+
+def get_cache(storage_directory, name, args):
+    """Open one of the caches in the storage directory, if enabled."""
+    if args.no_cache:
+        return None
+
+    return cache.DiskCache(os.path.join(storage_directory, '.cache', name),
+                           args.cache_size * 1024 * 1024)
+
+
+def get_template_digest():
+    """Hash the contents of all templates.
+
+    Cached output is keyed on this digest, so it becomes invalid as soon as
+    any template changes. Templates are only read once per process, like
+    the Jinja environment that renders them.
+    """
+    with _jinja_envs_lock:
+        digest = _template_digests.get(TEMPLATE_DIR)
+        if digest is None:
+            sha = hashlib.sha256()
+            for name in sorted(os.listdir(TEMPLATE_DIR)):
+                with open(os.path.join(TEMPLATE_DIR, name), 'rb') as f:
+                    sha.update(name.encode('UTF-8') + b'\0' + f.read() +
+                               b'\0')
+            digest = sha.hexdigest()
+            _template_digests[TEMPLATE_DIR] = digest
+
+    return digest
+
+
+def get_jinja_env():
+    """Return the Jinja environment for our templates.
+
+    Environments are created once for each template directory and reused,
+    so templates are only loaded and compiled once.
+    """
+    import jinja2
+    with _jinja_envs_lock:
+        jinja_env = _jinja_envs.get(TEMPLATE_DIR)
+        if jinja_env is None:
+            jinja_env = jinja2.Environment(
+                loader=jinja2.FileSystemLoader(TEMPLATE_DIR),
+                trim_blocks=True
+            )
+            _jinja_envs[TEMPLATE_DIR] = jinja_env
+
+    return jinja_env
+
+
+def iter_template(template_file, template_vars):
+    """Render a jinja template piece by piece."""
+    template = get_jinja_env().get_template(template_file)
+    return template.generate(template_vars)
+
+
 def render_template(template_file, template_vars):
     """Render a jinja template."""
-    # Load our Jinja templates
-    template_dir = "{0}/templates".format(
-        os.path.dirname(os.path.abspath(__file__))
-    )
-    jinja_env = jinja2.Environment(
-        loader=jinja2.FileSystemLoader(template_dir),
-        trim_blocks=True
-    )
-    rendered = jinja_env.get_template(template_file).render(template_vars)
+    return "".join(iter_template(template_file, template_vars))
 
-    return rendered
 
+def repo_clone(repo_dir, repo_url, **clone_options):
+    """Clone repository to this host.
 
-def repo_clone(repo_dir, repo_url):
-    """Clone repository to this host."""
-    repo = Repo.clone_from(repo_url, repo_dir)
+    Extra keyword arguments are passed to ``git clone`` as options, for
+    example ``bare=True``.
+    """
+    from git import Repo
+    repo = Repo.clone_from(repo_url, repo_dir, **clone_options)
     return repo
 
 
-def repo_pull(repo_dir, repo_url, fetch=False):
+def repo_pull(repo_dir, repo_url, fetch=False, reset=True):
     """Reset repository and optionally update it."""
-    # Make sure the repository is reset to the master branch.
+    from git import Repo
     repo = Repo(repo_dir)
-    repo.git.clean("-df")
-    repo.git.reset("--hard")
-    repo.git.checkout("master")
-    repo.head.reset(index=True, working_tree=True)
+    # Bare repositories have no working tree to clean up.
+    if reset and not repo.bare:
+        # Make sure the repository is reset to the master branch.
+        repo.git.clean("-df")
+        repo.git.reset("--hard")
+        repo.git.checkout("master")
+        repo.head.reset(index=True, working_tree=True)
+
+    # Only get the latest updates if requested.
+    if fetch:
+        repo.git.fetch(prepare_fetch(repo, repo_url))
+    return repo
 
+
+def prepare_fetch(repo, repo_url):
+    """Prepare a repo for fetching and return the git fetch arguments."""
     # Compile the refspec appropriately to ensure
     # that if the repo is from github it includes
     # all the refs needed, including PR's.
@@ -448,160 +1615,333 @@ def repo_pull(repo_dir, repo_url, fetch=False):
             "+refs/pull/*:refs/remotes/origin/pr/*",
             "+refs/heads/*:refs/remotes/origin/*"])
 
-    # Only get the latest updates if requested.
-    if fetch:
-        repo.git.fetch(["-u", "-v", "-f",
-                        repo_url,
-                        refspec_list])
-    return repo
+    fetch_args = ["-u", "-v", "-f"]
+    remote = repo_url
+    partial_clone_filter = get_partial_clone_filter(repo)
+    if partial_clone_filter:
+        # Partial clones must fetch through their promisor remote to keep
+        # new objects filtered out and fetch missing ones lazily later.
+        repo.git.remote("set-url", "origin", repo_url)
+        fetch_args.append("--filter={0}".format(partial_clone_filter))
+        remote = "origin"
+
+    return fetch_args + [remote] + refspec_list
+
+
+def get_partial_clone_filter(repo):
+    """Return the object filter of a partial clone, or None."""
+    config = repo.config_reader()
+    return config.get_value('remote "origin"', 'partialclonefilter',
+                            '') or None
+
 
+def update_repo(repo_dir, repo_url, fetch=False, reset=True,
+                clone_options=None, commits=None):
+    """Clone the repo if it doesn't exist already, otherwise update it.
 
-def update_repo(repo_dir, repo_url, fetch=False):
-    """Clone the repo if it doesn't exist already, otherwise update it."""
+    When ``fetch`` is ``'auto'``, the repo is only fetched if any of
+    ``commits`` is missing from it.
+    """
     repo_exists = os.path.exists(repo_dir)
     if not repo_exists:
         log.info("Cloning repo {}".format(repo_url))
-        repo = repo_clone(repo_dir, repo_url)
+        forget_repo(repo_dir)
+        repo = repo_clone(repo_dir, repo_url, **(clone_options or {}))
+
+    if fetch == 'auto':
+        missing_commits = find_missing_commits(repo_dir, commits or [])
+        if missing_commits:
+            log.info("Repo {r} is missing {c}".format(r=repo_url,
+                                                      c=missing_commits))
+        fetch = bool(missing_commits)
 
     # Make sure the repo is properly prepared
     # and has all the refs required
     log.info("Fetching repo {} (fetch: {})".format(repo_url, fetch))
-    repo = repo_pull(repo_dir, repo_url, fetch)
+    repo = repo_pull(repo_dir, repo_url, fetch, reset)
+
+    for command in get_commit_graph_commands(repo_dir):
+        log.info("Running {0} in {1}".format(" ".join(command), repo_dir))
+        repo.git.execute(command)
 
     return repo
 
 
+def get_commit_graph_commands(repo_dir):
+    """List the git commands that set up commit-graph files for a repo.
+
+    Commit-graph files make ancestry checks and history walks fast on large
+    repos. Once one is written, every fetch keeps it up to date.
+    """
+    from git import Repo
+    repo = Repo(repo_dir)
+    commands = []
+    reader = repo.config_reader('repository')
+    if not reader.get_value('fetch', 'writeCommitGraph', False):
+        commands.append(['git', 'config', 'fetch.writeCommitGraph', 'true'])
+
+    info_dir = os.path.join(repo.common_dir, 'objects', 'info')
+    if not (os.path.exists(os.path.join(info_dir, 'commit-graph')) or
+            os.path.exists(os.path.join(info_dir, 'commit-graphs'))):
+        commands.append(['git', 'commit-graph', 'write', '--reachable'])
+
+    return commands
+
+
+def find_missing_commits(repo_dir, commits):
+    """Find which commits are missing from a repository.
+
+    All of the commits are checked with a single ``git cat-file`` call.
+    """
+    if not commits:
+        return []
+
+    check_input = "".join("{0}^{{commit}}\n".format(x) for x in commits)
+    check_p = subprocess.Popen(['git', 'cat-file', '--batch-check'],
+                               cwd=repo_dir,
+                               stdin=subprocess.PIPE,
+                               stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE)
+    check_output = check_p.communicate(check_input.encode('UTF-8'))[0]
+    results = check_output.decode('UTF-8').splitlines()
+    results += [''] * (len(commits) - len(results))
+
+    # Found objects are printed as "<sha> commit <size>", anything else is
+    # either missing, ambiguous or not a commit.
+    return [commit for commit, result in zip(commits, results)
+            if result.split()[1:2] != ['commit']]
+
+
 def validate_commits(repo_dir, commits):
     """Test if a commit is valid for the repository."""
     log.debug("Validating {c} exist in {r}".format(c=commits, r=repo_dir))
-    repo = Repo(repo_dir)
-    for commit in commits:
-        try:
-            commit = repo.commit(commit)
-        except Exception:
-            msg = ("Commit {commit} could not be found in repo {repo}. "
-                   "You may need to pass --update to fetch the latest "
-                   "updates to the git repositories stored on "
-                   "your local computer.".format(repo=repo_dir, commit=commit))
-            raise exceptions.InvalidCommitException(msg)
+    with locked_repo(repo_dir) as repo:
+        for commit in commits:
+            try:
+                commit = repo.commit(commit)
+            except Exception:
+                msg = ("Commit {commit} could not be found in repo {repo}. "
+                       "You may need to pass --update to fetch the latest "
+                       "updates to the git repositories stored on "
+                       "your local computer.".format(repo=repo_dir,
+                                                     commit=commit))
+                raise exceptions.InvalidCommitException(msg)
 
     return True
 
 
+def is_ancestor(repo_dir, ancestor, commit):
+    """Check if a commit is part of the history of another commit.
+
+    Commits that are missing from the repo are never ancestors.
+    """
+    from git import GitCommandError
+    try:
+        with locked_repo(repo_dir) as repo:
+            return repo.is_ancestor(ancestor, commit)
+    except GitCommandError:
+        return False
+
+
 def validate_commit_range(repo_dir, old_commit, new_commit):
-    """Check if commit range is valid. Flip it if needed."""
-    # Are there any commits between the two commits that were provided?
+    """Check if commit range is valid. Flip it if needed.
+
+    Only the ancestry of the two commits is checked, so the commits in the
+    range are never walked.
+    """
     try:
-        commits = get_commits(repo_dir, old_commit, new_commit)
+        with locked_repo(repo_dir) as repo:
+            old_sha = repo.commit(old_commit).hexsha
+            new_sha = repo.commit(new_commit).hexsha
+            # If the new commit is already part of the old one, there are no
+            # commits between them. The user might have gotten their
+            # commits out of order.
+            new_in_old = repo.is_ancestor(new_sha, old_sha)
     except Exception:
-        commits = []
-    if len(commits) == 0:
-        # The user might have gotten their commits out of order. Let's flip
-        # the order of the commits and try again.
-        try:
-            commits = get_commits(repo_dir, new_commit, old_commit)
-        except Exception:
-            commits = []
-        if len(commits) == 0:
-            # Okay, so there really are no commits between the two commits
-            # provided by the user. :)
-            msg = ("The commit range {0}..{1} is invalid for {2}."
-                   "You may need to use the --update option to fetch the "
-                   "latest updates to the git repositories stored on your "
-                   "local computer.".format(old_commit, new_commit, repo_dir))
-            raise exceptions.InvalidCommitRangeException(msg)
-        else:
+        old_sha = new_sha = None
+        new_in_old = True
+
+    if new_in_old:
+        if old_sha != new_sha:
             return 'flip'
 
+        # Okay, so there really are no commits between the two commits
+        # provided by the user. :)
+        msg = ("The commit range {0}..{1} is invalid for {2}."
+               "You may need to use the --update option to fetch the "
+               "latest updates to the git repositories stored on your "
+               "local computer.".format(old_commit, new_commit, repo_dir))
+        raise exceptions.InvalidCommitRangeException(msg)
+
     return True
 
 
-def get_release_notes(osa_repo_dir, osa_old_commit, osa_new_commit):
-    """Get release notes between the two revisions."""
-    repo = Repo(osa_repo_dir)
+def get_release_notes(osa_repo_dir, osa_old_commit, osa_new_commit,
+                      jobs=None, notes_cache=None):
+    """Get release notes between the two revisions.
+
+    Takes the same arguments as ``get_reno_outputs``.
+    """
+    reno_outputs, _ = get_reno_outputs(osa_repo_dir, osa_old_commit,
+                                       osa_new_commit, jobs, notes_cache)
+    return "".join(format_release_notes(x) for x in reno_outputs)
+
 
-    # Get a list of tags, sorted
-    tags = repo.git.tag().split('\n')
-    tags = sorted(tags, key=LooseVersion)
-    # Currently major tags are being printed after rc and
-    # b tags. We need to fix the list so that major
-    # tags are printed before rc and b releases
-    tags = _fix_tags_list(tags)
+def get_release_note_entries(osa_repo_dir, osa_old_commit, osa_new_commit,
+                             jobs=None, notes_cache=None):
+    """Get release notes between the two revisions as a list of entries.
+
+    Takes the same arguments as ``get_reno_outputs``. Entries are returned
+    in the same order as they appear in ``get_release_notes``.
+    """
+    entries = []
+    reno_outputs, _ = get_reno_outputs(osa_repo_dir, osa_old_commit,
+                                       osa_new_commit, jobs, notes_cache)
+    for reno_output in reno_outputs:
+        entries += parse_release_notes(reno_output)
+    return entries
+
+
+def get_reno_outputs(osa_repo_dir, osa_old_commit, osa_new_commit,
+                     jobs=None, notes_cache=None):
+    """Run reno for the releases between the two revisions.
+
+    Returns the output of ``reno report`` for the new commit, followed by
+    the output for each packaged release, newest first, and whether every
+    reno run succeeded. The output of a failed run is empty. Reno runs for
+    each release in a temporary working tree of its own, so up to ``jobs``
+    of them run at once. By default there is one per CPU. The output of
+    each released tag is kept in ``notes_cache`` if one is given.
+    """
+    tag_index = tags.TagIndex(osa_repo_dir)
 
     # Find the closest tag from a given SHA
     # The tag found here is the tag that was cut
     # either on or before the given SHA
-    checkout(repo, osa_old_commit)
-    old_tag = repo.git.describe()
-
-    # If the SHA given is between two release tags, then
-    # 'git describe' will return a tag in form of
-    # <tag>-<commitNum>-<sha>. For example:
-    # 14.0.2-3-g6931e26
-    # Since reno does not support this format, we need to
-    # strip away the commit number and sha bits.
-    if '-' in old_tag:
-        old_tag = old_tag[0:old_tag.index('-')]
+    old_tag = tag_index.nearest_tag(osa_old_commit)
 
     # Get the nearest tag associated with the new commit
-    checkout(repo, osa_new_commit)
-    new_tag = repo.git.describe()
-    if '-' in new_tag:
-        nearest_new_tag = new_tag[0:new_tag.index('-')]
-    else:
-        nearest_new_tag = new_tag
+    nearest_new_tag = tag_index.nearest_tag(osa_new_commit)
 
     # Truncate the tags list to only include versions
     # between old_sha and new_sha. The latest release
     # is not included in this list. That version will be
     # printed separately in the following step.
-    tags = tags[tags.index(old_tag):tags.index(nearest_new_tag)]
-
-    release_notes = ""
-    # Checkout the new commit, then run reno to get the latest
-    # releasenotes that have been created or updated between
-    # the latest release and this new commit.
-    repo.git.checkout(osa_new_commit, '-f')
-    reno_report_command = ['reno',
-                           'report',
-                           '--earliest-version',
-                           nearest_new_tag]
-    reno_report_p = subprocess.Popen(reno_report_command,
-                                     cwd=osa_repo_dir,
-                                     stdout=subprocess.PIPE,
-                                     stderr=subprocess.PIPE)
-    reno_output = reno_report_p.communicate()[0].decode('UTF-8')
-    release_notes += reno_output
-
-    # We want to start with the latest packaged release first, so
-    # the tags list is reversed
-    for version in reversed(tags):
-        # If version is an rc or b tag, and it has a major
-        # release tag, then skip it. There is no need to print
-        # release notes for an rc or b release unless we are
-        # comparing shas between two rc or b releases.
-        repo.git.checkout(version, '-f')
-        # We are outputing one version at a time here
-        reno_report_command = ['reno',
-                               'report',
-                               '--branch',
-                               version,
-                               '--earliest-version',
-                               version]
-        reno_report_p = subprocess.Popen(reno_report_command,
-                                         cwd=osa_repo_dir,
-                                         stdout=subprocess.PIPE,
-                                         stderr=subprocess.PIPE)
-        reno_output = reno_report_p.communicate()[0].decode('UTF-8')
+    release_tags = tag_index.between(old_tag, nearest_new_tag)
+
+    # Notes of a released tag never change, so only the ones that are not
+    # cached yet are generated. Keys include the SHA the tag points to, in
+    # case a tag is ever moved.
+    releases = list(reversed(release_tags))
+    release_outputs = [None] * len(releases)
+    release_keys = [None] * len(releases)
+    if notes_cache is not None:
+        for index, version in enumerate(releases):
+            release_keys[index] = ['reno-output', version,
+                                   tag_index.tags[version]['object']]
+            release_outputs[index] = notes_cache.get(release_keys[index])
+
+    # The first run gets the latest releasenotes that have been created or
+    # updated between the latest release and the new commit. We then want
+    # the latest packaged release first, so the tags list is reversed.
+    reno_runs = [(osa_new_commit, ['--earliest-version', nearest_new_tag])]
+    reno_runs += [(version, ['--branch', version, '--earliest-version',
+                             version])
+                  for version, output in zip(releases, release_outputs)
+                  if output is None]
+
+    def reno_worker(reno_run):
+        return run_reno(osa_repo_dir, *reno_run)
+
+    pool = ThreadPool(jobs or cpu_count())
+    try:
+        reno_outputs = pool.map(reno_worker, reno_runs)
+    finally:
+        pool.close()
+        pool.join()
+
+    # Failed runs show no notes, and are never cached.
+    complete = None not in reno_outputs
+    outputs = [reno_outputs[0] or ""]
+    reno_outputs = iter(reno_outputs[1:])
+    for index, version in enumerate(releases):
+        if release_outputs[index] is not None:
+            outputs.append(release_outputs[index])
+            continue
+
+        reno_output = next(reno_outputs)
+        if reno_output is None:
+            outputs.append("")
+            continue
+
         # We need to ensure the output includes the version we are concerned
         # about.
         # This is due to https://bugs.launchpad.net/reno/+bug/1670173
-        if version in reno_output:
-            release_notes += reno_output
+        if version not in reno_output:
+            reno_output = ""
+        if release_keys[index] is not None:
+            notes_cache.put(release_keys[index], reno_output)
+        outputs.append(reno_output)
+
+    return outputs, complete
+
+
+def parse_release_notes(reno_output):
+    """Split the output of ``reno report`` into release note entries.
+
+    Every note becomes a dict with its ``version``, its ``section`` (like
+    "New Features") and the RST ``text`` of the note. The ``file`` the note
+    came from is included when reno names it.
+    """
+    entries = []
+    lines = reno_output.splitlines()
+    version = section = note_file = entry = None
+    bullet = False
+    for index, line in enumerate(lines):
+        next_line = lines[index + 1] if index + 1 < len(lines) else ""
+        if _is_underline(line, '=') or _is_underline(line, '-'):
+            continue
+        if _is_underline(next_line, '=') and line.strip():
+            version, section, entry = line.strip(), None, None
+        elif _is_underline(next_line, '-') and line.strip():
+            section, entry = line.strip(), None
+        elif line.startswith('.. '):
+            # reno names the file of each note in a comment before it.
+            entry = None
+            note_file = None
+            if ' @ ' in line:
+                note_file = line[3:].split(' @ ', 1)[0].strip()
+        elif version is None or section is None:
+            continue
+        elif line.startswith('- '):
+            entry = {'version': version, 'section': section,
+                     'file': note_file, 'lines': [line[2:]]}
+            entries.append(entry)
+            bullet = True
+        elif entry is not None:
+            entry['lines'].append(line[2:] if bullet else line)
+        elif line.strip():
+            # Sections like the prelude are paragraphs, not bullet lists.
+            entry = {'version': version, 'section': section,
+                     'file': note_file, 'lines': [line]}
+            entries.append(entry)
+            bullet = False
 
+    for entry in entries:
+        entry['text'] = "\n".join(entry.pop('lines')).strip()
+
+    return entries
+
+
+def _is_underline(line, character):
+    return len(line) >= 3 and line == character * len(line)
+
+
+def format_release_notes(reno_output):
+    """Adapt the output of ``reno report`` to the headers of our reports."""
     # Clean up "Release Notes" title. We don't need this title for
     # each tagged release.
-    release_notes = release_notes.replace(
+    release_notes = reno_output.replace(
         "=============\nRelease Notes\n=============",
         ""
     )
@@ -614,6 +1954,59 @@ def get_release_notes(osa_repo_dir, osa_old_commit, osa_new_commit):
     return release_notes
 
 
+def run_reno(repo_dir, ref, options):
+    """Run ``reno report`` on a temporary checkout of a ref.
+
+    Returns None if reno fails.
+    """
+    with timing.span('reno', ref=ref), \
+            temporary_worktree(repo_dir, ref) as worktree_dir:
+        reno_report_command = ['reno', 'report'] + options
+        reno_report_p = subprocess.Popen(reno_report_command,
+                                         cwd=worktree_dir,
+                                         stdout=subprocess.PIPE,
+                                         stderr=subprocess.PIPE)
+        stdout, stderr = reno_report_p.communicate()
+
+    if reno_report_p.returncode != 0:
+        log.error("Unable to run reno for {0}: {1}".format(
+            ref, stderr.decode('UTF-8', 'replace').strip()))
+        return None
+
+    return stdout.decode('UTF-8')
+
+
+@contextmanager
+def temporary_worktree(repo_dir, ref):
+    """Check out a ref into a temporary working tree of a repo.
+
+    The repo itself is left untouched, so any number of these can be used
+    at the same time. Falls back to a shared clone for git versions without
+    ``git worktree``.
+    """
+    from git import GitCommandError, Repo
+    worktree_dir = tempfile.mkdtemp(prefix='osa-differ-')
+    repo = Repo(repo_dir)
+    try:
+        repo.git.worktree('add', '--detach', worktree_dir, ref)
+    except GitCommandError:
+        log.debug("Unable to add a worktree to {0}, using a shared "
+                  "clone".format(repo_dir))
+        shutil.rmtree(worktree_dir)
+        repo.git.clone('--shared', '--no-checkout', repo_dir, worktree_dir)
+        Repo(worktree_dir).git.checkout(ref)
+        is_worktree = False
+    else:
+        is_worktree = True
+
+    try:
+        yield worktree_dir
+    finally:
+        if is_worktree:
+            repo.git.worktree('remove', '--force', worktree_dir)
+        shutil.rmtree(worktree_dir, ignore_errors=True)
+
+
 def _equal_to_tilde(matchobj):
     num_of_equal = len(matchobj.group(0))
     return '~' * num_of_equal
@@ -624,23 +2017,411 @@ def _dash_to_num(matchobj):
     return '#' * num_of_dashes
 
 
-def _fix_tags_list(tags):
-    new_list = []
-    for tag in tags:
-        rc_releases = []
-        # Ignore rc and b releases, these will be built
-        # out in the list comprehension below.
-        # Finding the rc and b releases of the tag..
-        if 'rc' not in tag and 'b' not in tag:
-            rc_releases = [
-                rc_tag for rc_tag in tags
-                if tag in rc_tag and ('rc' in rc_tag or 'b' in rc_tag)
-            ]
-        new_list.extend(rc_releases)
-        # Make sure we don't add the tag in twice
-        if tag not in new_list:
-            new_list.append(tag)
-    return new_list
+def get_caches(storage_directory, args):
+    """Open all of the caches in the storage directory."""
+    return {name: get_cache(storage_directory, name, args)
+            for name in ['commits', 'fragments', 'reports', 'release-notes',
+                         'manifests']}
+
+
+def get_report_repo_updates(storage_directory, old_manifests, new_manifests,
+                            args):
+    """List the role and project repos a report needs."""
+    pin_diffs = get_pin_diffs(old_manifests, new_manifests, args)
+    return [x for pin_diff in pin_diffs.values()
+            for x in get_repo_updates(storage_directory, pin_diff)]
+
+
+def get_pin_diffs(old_manifests, new_manifests, args):
+    """Diff the role and project pins of a report.
+
+    Returns a ``PinDiff`` for each section of the report, by section name,
+    in the order the sections appear in.
+    """
+    pin_diffs = OrderedDict()
+    if not args.skip_roles:
+        pin_diffs['roles'] = diff_pins(old_manifests[0], new_manifests[0],
+                                       args.version_mappings)
+    if not args.skip_projects:
+        pin_diffs['projects'] = diff_pins(old_manifests[1], new_manifests[1])
+    return pin_diffs
+
+
+def fetch_report_repos(repo_updates, args):
+    """Clone and fetch role and project repos before any reporting.
+
+    Returns the set of repo directories that still need to be updated while
+    they are reported on: every repo if the fetch stage is disabled, or the
+    repos the stage was unable to clone or fetch.
+    """
+    if args.fetch_concurrency < 1:
+        return set(x[0] for x in repo_updates)
+
+    from . import fetcher
+
+    # Hold every repo while it is updated, so that other reports running in
+    # the same process never read a half cloned or fetched repo. The locks
+    # are always taken in the same order to avoid deadlocks.
+    locks = [repo_lock(x) for x in sorted(set(x[0] for x in repo_updates))]
+    for lock in locks:
+        lock.acquire()
+    try:
+        fetch_results = fetcher.fetch_repos(repo_updates,
+                                            args.update,
+                                            get_clone_options(args),
+                                            args.fetch_concurrency,
+                                            args.fetch_timeout)
+    finally:
+        for lock in reversed(locks):
+            lock.release()
+    log.info(fetcher.format_summary(fetch_results))
+
+    stale_repos = set()
+    for result in fetch_results:
+        if result.status != 'ok':
+            log.error("Unable to {0} {1} ({2}): {3}".format(
+                result.action, result.repo_url, result.status,
+                result.detail))
+            stale_repos.add(result.repo_dir)
+    return stale_repos
+
+
+def generate_report(args, storage_directory, osa_old_commit, osa_new_commit,
+                    caches=None, prefetched=False):
+    """Generate the report for a pair of OpenStack-Ansible commits.
+
+    ``prefetched`` means the role and project repos have already been
+    updated for this report, so none of them are cloned or fetched.
+    """
+    return "".join(iter_report(args, storage_directory, osa_old_commit,
+                               osa_new_commit, caches, prefetched))
+
+
+def iter_report(args, storage_directory, osa_old_commit, osa_new_commit,
+                caches=None, prefetched=False):
+    """Generate the report piece by piece.
+
+    Takes the same arguments as ``generate_report``. Every section is
+    yielded as soon as it is ready, so it can be written out while the
+    rest of the report is still being generated. Reports in a JSON
+    ``format`` are serialized from ``iter_report_records`` instead.
+    """
+    if args.format != 'rst':
+        records = iter_report_records(args, storage_directory,
+                                      osa_old_commit, osa_new_commit,
+                                      caches, prefetched)
+        for chunk in iter_json(records, args.format):
+            yield chunk
+        return
+
+    caches = caches or {}
+    commit_cache = caches.get('commits')
+    fragment_cache = caches.get('fragments')
+    report_cache = caches.get('reports')
+    clone_options = get_clone_options(args)
+    osa_repo_dir = "{0}/openstack-ansible".format(storage_directory)
+
+    # An identical request for a report that was generated before can be
+    # answered from the cache, unless the user asked for fresh data.
+    if report_cache is not None and not args.update:
+        report_key = get_report_cache_key(osa_repo_dir,
+                                          osa_old_commit,
+                                          osa_new_commit,
+                                          args)
+        report_rst = report_cache.get(report_key) if report_key else None
+        if report_rst is not None:
+            yield report_rst
+            return
+
+    osa_record, pin_diffs, repo_updates = prepare_report(
+        args, storage_directory, osa_old_commit, osa_new_commit, commit_cache,
+        parse_cache=caches.get('manifests')
+    )
+
+    # Whole reports are only cached when every pin is a full SHA, because
+    # pins like branch names can point somewhere else on the next run.
+    # Otherwise the sections are never kept around.
+    pinned_commits = [x for _, _, commits in repo_updates for x in commits]
+    report_sections = None
+    if (report_cache is not None and
+            all(is_commit_sha(x) for x in pinned_commits)):
+        report_sections = []
+
+    def emit(rst):
+        if report_sections is not None:
+            report_sections.append(rst)
+        return rst
+
+    # Generate OpenStack-Ansible report header.
+    yield emit(render_osa_report(osa_record, args))
+
+    do_update = fetch_report_stage(repo_updates, args, prefetched)
+
+    # Get OpenStack-Ansible Reno release notes for the packaged
+    # releases between the two commits.
+    if args.release_notes:
+        yield emit("\nRelease Notes\n"
+                   "-------------")
+        with timing.span('release-notes'):
+            reno_outputs, notes_complete = get_reno_outputs(
+                osa_repo_dir,
+                osa_old_commit,
+                osa_new_commit,
+                notes_cache=caches.get('release-notes')
+            )
+        # A report missing the notes of a failed reno run is never kept.
+        if not notes_complete:
+            report_sections = None
+        yield emit("".join(format_release_notes(x) for x in reno_outputs))
+
+    # Generate the role and project reports.
+    for section, pin_diff in pin_diffs.items():
+        title = SECTION_TITLES[section]
+        yield emit("\n{0}\n{1}".format(title, '-' * len(title)))
+        yield emit(render_template('offline-pin-summary.j2',
+                                   {'pin_diff': pin_diff}))
+        for rst in iter_range_sections(storage_directory,
+                                       pin_diff.ranges,
+                                       do_update,
+                                       args.jobs,
+                                       clone_options,
+                                       commit_cache,
+                                       fragment_cache,
+                                       args.max_commits_per_repo):
+            yield emit(rst)
+
+    if report_sections is not None:
+        report_key = get_report_cache_key(osa_repo_dir,
+                                          osa_old_commit,
+                                          osa_new_commit,
+                                          args)
+        if report_key:
+            report_cache.put(report_key, "".join(report_sections))
+
+
+def iter_report_records(args, storage_directory, osa_old_commit,
+                        osa_new_commit, caches=None, prefetched=False,
+                        previous=None):
+    """Generate the structured records of a report.
+
+    Takes the same arguments as ``generate_report``. The first record is
+    the OpenStack-Ansible repo, followed by the release notes if they were
+    requested, and then a record for each role and project repo as soon as
+    it is finished. Nothing is rendered, so only the commit and release
+    notes caches are used.
+
+    ``previous`` is the list of records of an earlier report from the same
+    old commit. Every repo that only moved forward since then is extended
+    with its new commits. Repos that were rolled back or replaced are read
+    in full again. Release notes are always generated again, since new
+    tags may have been added.
+    """
+    caches = caches or {}
+    commit_cache = caches.get('commits')
+    clone_options = get_clone_options(args)
+    osa_repo_dir = "{0}/openstack-ansible".format(storage_directory)
+
+    previous_records = defaultdict(dict)
+    for record in previous or []:
+        if record.get('type') == 'repo':
+            previous_records[record['section']][record['repo']] = record
+
+    osa_record, pin_diffs, repo_updates = prepare_report(
+        args, storage_directory, osa_old_commit, osa_new_commit, commit_cache,
+        previous_records['openstack-ansible'].get('openstack-ansible'),
+        caches.get('manifests')
+    )
+    osa_record['section'] = 'openstack-ansible'
+    yield osa_record
+
+    do_update = fetch_report_stage(repo_updates, args, prefetched)
+
+    if args.release_notes:
+        with timing.span('release-notes'):
+            entries = get_release_note_entries(
+                osa_repo_dir,
+                osa_old_commit,
+                osa_new_commit,
+                notes_cache=caches.get('release-notes')
+            )
+        yield {'type': 'release-notes', 'entries': entries}
+
+    for section, pin_diff in pin_diffs.items():
+        yield {
+            'type': 'pins',
+            'section': section,
+            'counts': pin_diff.counts(),
+            'added': [_pin_record(x) for x in pin_diff.added],
+            'removed': [_pin_record(x) for x in pin_diff.removed],
+        }
+        for record in iter_range_records(storage_directory,
+                                         pin_diff.ranges,
+                                         do_update,
+                                         args.jobs,
+                                         clone_options,
+                                         commit_cache,
+                                         previous_records[section],
+                                         args.max_commits_per_repo):
+            record['section'] = section
+            yield record
+
+
+def prepare_report(args, storage_directory, osa_old_commit, osa_new_commit,
+                   commit_cache=None, previous_osa_record=None,
+                   parse_cache=None):
+    """Check the OpenStack-Ansible commits of a report and read their pins.
+
+    Returns the OpenStack-Ansible record, the ``PinDiff`` of each role and
+    project section, and the repo updates those sections need.
+    """
+    osa_repo_dir = "{0}/openstack-ansible".format(storage_directory)
+    with repo_lock(osa_repo_dir):
+        osa_record = make_osa_record(osa_repo_dir,
+                                     osa_old_commit,
+                                     osa_new_commit,
+                                     args,
+                                     commit_cache,
+                                     previous_osa_record)
+
+    # Get the list of OpenStack roles and projects from the older and newer
+    # commits.
+    with timing.span('manifests'):
+        old_manifests = get_manifests(osa_repo_dir,
+                                      osa_old_commit,
+                                      args.role_requirements,
+                                      parse_cache)
+        new_manifests = get_manifests(osa_repo_dir,
+                                      osa_new_commit,
+                                      args.role_requirements,
+                                      parse_cache)
+    pin_diffs = get_pin_diffs(old_manifests, new_manifests, args)
+    repo_updates = [x for pin_diff in pin_diffs.values()
+                    for x in get_repo_updates(storage_directory, pin_diff)]
+
+    return osa_record, pin_diffs, repo_updates
+
+
+def fetch_report_stage(repo_updates, args, prefetched=False):
+    """Clone and fetch the role and project repos of a report.
+
+    All of them are updated in a single network stage before any of them
+    are reported on. Returns whether the repos still need to be updated
+    while they are reported on, which is the case if the stage is disabled
+    or was unable to update any of them.
+    """
+    if prefetched:
+        return False
+    with timing.span('fetch-stage'):
+        stale_repos = fetch_report_repos(repo_updates, args)
+    if stale_repos:
+        return args.update
+    return False
+
+
+def _pin_record(pin):
+    return {'repo': pin[0], 'repo_url': pin[1], 'commit': pin[2]}
+
+
+def load_report_records(path):
+    """Read the records of a report saved as JSON or as JSON lines."""
+    with open(path, 'r') as f:
+        data = f.read()
+
+    if data.lstrip().startswith('['):
+        return json.loads(data)
+    return [json.loads(x) for x in data.splitlines() if x.strip()]
+
+
+def iter_json(records, output_format='json'):
+    """Serialize report records as they arrive.
+
+    ``ndjson`` gives one JSON object per line, and ``json`` gives a single
+    JSON array of all of the records.
+    """
+    if output_format == 'ndjson':
+        for record in records:
+            yield json.dumps(record, sort_keys=True) + "\n"
+        return
+
+    separator = "[\n"
+    for record in records:
+        yield separator + json.dumps(record, sort_keys=True)
+        separator = ",\n"
+    yield "[]\n" if separator == "[\n" else "\n]\n"
+
+
+def parse_commit_pairs(pairs, pairs_file=None):
+    """Parse 'OLD..NEW' or 'OLD NEW' commit pairs.
+
+    Blank lines and lines starting with '#' in the pairs file are ignored.
+    """
+    values = list(pairs)
+    if pairs_file == '-':
+        values += sys.stdin.read().splitlines()
+    elif pairs_file:
+        with open(pairs_file, 'r') as f:
+            values += f.read().splitlines()
+
+    commit_pairs = []
+    for value in values:
+        value = value.strip()
+        if not value or value.startswith('#'):
+            continue
+        pair = value.split('..', 1) if '..' in value else value.split()
+        if len(pair) != 2 or not all(pair):
+            raise ValueError("Invalid commit pair: {0}".format(value))
+        commit_pairs.append((pair[0].strip(), pair[1].strip()))
+
+    return commit_pairs
+
+
+def make_batch_reports(args, storage_directory, commit_pairs):
+    """Generate reports for many pairs of OpenStack-Ansible commits.
+
+    Every repository is updated at most once for the whole batch, and the
+    manifests and commit ranges of one report are reused by the others.
+    Yields ``(old_commit, new_commit, report)`` for each pair in order.
+    """
+    osa_repo_dir = "{0}/openstack-ansible".format(storage_directory)
+    all_commits = [x for pair in commit_pairs for x in pair]
+    update_repo(osa_repo_dir, args.osa_repo_url, args.update, reset=False,
+                commits=all_commits)
+
+    # Fall back to in-memory caches so the reports can still share their
+    # commit ranges and sections when the on-disk caches are disabled.
+    caches = get_caches(storage_directory, args)
+    for name in ['commits', 'fragments', 'release-notes']:
+        if caches[name] is None:
+            caches[name] = cache.MemoryCache()
+
+    # Update every role and project repository needed by any of the
+    # reports up front, so the reports themselves never fetch.
+    repo_updates = []
+    for old_commit, new_commit in commit_pairs:
+        validate_commits(osa_repo_dir, [old_commit, new_commit])
+        repo_updates += get_report_repo_updates(
+            storage_directory,
+            get_manifests(osa_repo_dir, old_commit, args.role_requirements,
+                          caches['manifests']),
+            get_manifests(osa_repo_dir, new_commit, args.role_requirements,
+                          caches['manifests']),
+            args
+        )
+    with timing.span('fetch-stage'):
+        stale_repos = fetch_report_repos(repo_updates, args)
+    for repo_dir, repo_url, commits in merge_repo_updates(repo_updates):
+        if repo_dir in stale_repos:
+            with timing.span('update', repo=os.path.basename(repo_dir)):
+                update_repo(repo_dir, repo_url, args.update,
+                            clone_options=get_clone_options(args),
+                            commits=commits)
+
+    report_args = argparse.Namespace(**vars(args))
+    report_args.update = False
+    for old_commit, new_commit in commit_pairs:
+        report = generate_report(report_args, storage_directory, old_commit,
+                                 new_commit, caches, prefetched=True)
+        yield old_commit, new_commit, report
 
 
 def run_osa_differ():
@@ -662,62 +2443,102 @@ def run_osa_differ():
               "Please create it manually.".format(args.directory))
         sys.exit(1)
 
+    if args.command == 'maintain':
+        from . import maintenance
+        results = maintenance.maintain_repos(
+            maintenance.find_repos(storage_directory), args.jobs)
+        print(maintenance.format_report(results))
+        return
+
+    tracer = None
+    if args.timings or args.trace:
+        tracer = timing.enable()
+    try:
+        run_command(args, storage_directory)
+    finally:
+        if tracer is not None:
+            timing.disable()
+            if args.trace:
+                timing.write_trace(tracer, args.trace)
+            if args.timings:
+                sys.stderr.write(timing.format_summary(tracer) + "\n")
+
+
+def run_command(args, storage_directory):
+    """Run a report command with the prepared storage directory."""
+    if args.storage_mode == 'bare':
+        migrate_storage_dir(storage_directory)
+
+    if args.command == 'batch':
+        run_batch(args, storage_directory)
+        return
+
+    if args.command == 'serve':
+        from . import server
+        server.serve(args, storage_directory)
+        return
+
     # Assemble some variables for the OSA repository.
     osa_old_commit = args.old_commit[0]
     osa_new_commit = args.new_commit[0]
-    osa_repo_dir = "{0}/openstack-ansible".format(storage_directory)
-
-    # Generate OpenStack-Ansible report header.
-    report_rst = make_osa_report(osa_repo_dir,
-                                 osa_old_commit,
-                                 osa_new_commit,
-                                 args)
 
-    # Get OpenStack-Ansible Reno release notes for the packaged
-    # releases between the two commits.
-    if args.release_notes:
-        report_rst += ("\nRelease Notes\n"
-                       "-------------")
-        report_rst += get_release_notes(osa_repo_dir,
-                                        osa_old_commit,
-                                        osa_new_commit)
-
-    # Get the list of OpenStack roles from the newer and older commits.
-    role_yaml = get_roles(osa_repo_dir,
-                          osa_old_commit,
-                          args.role_requirements)
-    role_yaml_latest = get_roles(osa_repo_dir,
-                                 osa_new_commit,
-                                 args.role_requirements)
+    caches = get_caches(storage_directory, args)
+    if args.previous:
+        if args.format == 'rst':
+            print("ERROR: --previous needs --format json or ndjson.")
+            sys.exit(1)
+        try:
+            previous = load_report_records(args.previous)
+        except (IOError, ValueError) as e:
+            print("ERROR: Unable to read the previous report: {0}".format(e))
+            sys.exit(1)
+        records = iter_report_records(args, storage_directory,
+                                      osa_old_commit, osa_new_commit, caches,
+                                      previous=previous)
+        report_sections = iter_json(records, args.format)
+    else:
+        report_sections = iter_report(args,
+                                      storage_directory,
+                                      osa_old_commit,
+                                      osa_new_commit,
+                                      caches)
 
-    if not args.skip_roles:
-        # Generate the role report.
-        report_rst += ("\nOpenStack-Ansible Roles\n"
-                       "-----------------------")
-        report_rst += make_report(storage_directory,
-                                  role_yaml,
-                                  role_yaml_latest,
-                                  args.update,
-                                  args.version_mappings)
+    # Publish report according to the user's request.
+    output = stream_report(report_sections, args, osa_old_commit,
+                           osa_new_commit)
+    # JSON records already end with a newline, and a blank line after them
+    # would break line-based readers.
+    if output or args.format == 'rst':
+        print(output)
+
+
+def run_batch(args, storage_directory):
+    """Generate and publish the reports of a batch."""
+    if args.file:
+        print("ERROR: --file can't be used with batch reports, use "
+              "--output-dir instead.")
+        sys.exit(1)
 
-    if not args.skip_projects:
-        # Get the list of OpenStack projects from newer commit and older
-        # commit.
-        project_yaml = get_projects(osa_repo_dir, osa_old_commit)
-        project_yaml_latest = get_projects(osa_repo_dir,
-                                           osa_new_commit)
-
-        # Generate the project report.
-        report_rst += ("\nOpenStack Projects\n"
-                       "------------------")
-        report_rst += make_report(storage_directory,
-                                  project_yaml,
-                                  project_yaml_latest,
-                                  args.update)
+    try:
+        commit_pairs = parse_commit_pairs(args.pairs, args.pairs_file)
+    except (IOError, ValueError) as e:
+        print("ERROR: {0}".format(e))
+        sys.exit(1)
 
-    # Publish report according to the user's request.
-    output = publish_report(report_rst, args, osa_old_commit, osa_new_commit)
-    print(output)
+    if args.output_dir and not os.path.isdir(args.output_dir):
+        os.makedirs(args.output_dir)
+
+    for old_commit, new_commit, report_rst in make_batch_reports(
+            args, storage_directory, commit_pairs):
+        if args.output_dir:
+            args.file = os.path.join(
+                args.output_dir,
+                "osa-diff-{0}-{1}.{2}".format(old_commit.replace('/', '_'),
+                                              new_commit.replace('/', '_'),
+                                              args.format)
+            )
+        output = publish_report(report_rst, args, old_commit, new_commit)
+        print(output)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,211 @@
+# Copyright 2016, Major Hayden
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Serve reports over HTTP from a long-running process.
+
+Repo handles, manifests and caches are kept between requests. Every report
+runs in its own thread, and access to each repo is serialized with the repo
+locks in ``osa_differ``.
+"""
+import argparse
+import logging
+import os
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn, UnixStreamServer
+    from urllib.parse import parse_qs, urlparse
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn, UnixStreamServer
+    from urlparse import parse_qs, urlparse
+
+from . import cache
+from . import exceptions
+from . import osa_differ
+
+
+log = logging.getLogger()
+
+# Query parameters that switch report options on or off.
+FLAG_PARAMS = ['skip_projects', 'skip_roles', 'release_notes']
+
+# Content type of the response for each report format.
+CONTENT_TYPES = {
+    'rst': 'text/plain; charset=utf-8',
+    'json': 'application/json',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+class ReportHandler(BaseHTTPRequestHandler):
+    """Answer report requests.
+
+    ``GET /report?old=OLD&new=NEW`` returns the report for a pair of
+    OpenStack-Ansible commits. The ``skip_projects``, ``skip_roles``,
+    ``release_notes``, ``update`` and ``format`` parameters override the
+    options the server was started with. ``GET /health`` can be used to
+    check that the server is up.
+    """
+
+    def do_GET(self):  # noqa: N802
+        """Handle a GET request."""
+        url = urlparse(self.path)
+        if url.path == '/health':
+            self._respond(200, "ok\n")
+            return
+        if url.path != '/report':
+            self._respond(404, "Not found\n")
+            return
+
+        try:
+            args = get_report_args(self.server.args, parse_qs(url.query))
+            report_rst = osa_differ.generate_report(
+                args,
+                self.server.storage_directory,
+                args.old_commit[0],
+                args.new_commit[0],
+                self.server.caches
+            )
+        except (ValueError,
+                exceptions.InvalidCommitException,
+                exceptions.InvalidCommitRangeException) as e:
+            self._respond(400, "{0}\n".format(e))
+        except Exception as e:
+            log.exception("Unable to generate report for {0}".format(
+                self.path))
+            self._respond(500, "{0}\n".format(e))
+        else:
+            self._respond(200, report_rst, CONTENT_TYPES[args.format])
+
+    def address_string(self):
+        """Return the client address for logging."""
+        # Clients of unix sockets have no address.
+        if not self.client_address:
+            return 'unix'
+        return self.client_address[0]
+
+    def log_message(self, format, *args):
+        """Log requests with the rest of osa-differ's output."""
+        log.info("{0} - {1}".format(self.address_string(), format % args))
+
+    def _respond(self, status, body, content_type=CONTENT_TYPES['rst']):
+        data = body.encode('UTF-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class ReportServerMixin(object):
+    """Shared state of the report servers."""
+
+    daemon_threads = True
+
+    def setup_reports(self, args, storage_directory):
+        """Keep the options, storage and caches used for every report."""
+        self.args = args
+        self.storage_directory = storage_directory
+        self.caches = get_server_caches(storage_directory, args)
+
+
+class ReportServer(ReportServerMixin, ThreadingMixIn, HTTPServer):
+    """Threaded report server listening on a TCP port."""
+
+
+class UnixReportServer(ReportServerMixin, ThreadingMixIn, UnixStreamServer):
+    """Threaded report server listening on a unix socket."""
+
+
+def create_server(args, storage_directory):
+    """Create a report server from the command line arguments."""
+    if args.socket:
+        # Remove the socket left behind by a previous server.
+        if os.path.exists(args.socket):
+            os.remove(args.socket)
+        server = UnixReportServer(args.socket, ReportHandler)
+    else:
+        server = ReportServer((args.host, args.port), ReportHandler)
+
+    server.setup_reports(args, storage_directory)
+    return server
+
+
+def get_report_args(server_args, params):
+    """Build the arguments of one report from request parameters."""
+    try:
+        old_commit = params['old'][-1]
+        new_commit = params['new'][-1]
+    except KeyError:
+        raise ValueError("Both the old and new commits are required")
+
+    args = argparse.Namespace(**vars(server_args))
+    args.old_commit = [old_commit]
+    args.new_commit = [new_commit]
+    for name in FLAG_PARAMS:
+        if name in params:
+            setattr(args, name, parse_flag(params[name][-1]))
+    if 'update' in params:
+        value = params['update'][-1]
+        args.update = 'auto' if value == 'auto' else parse_flag(value)
+    if 'format' in params:
+        args.format = params['format'][-1]
+        if args.format not in osa_differ.OUTPUT_FORMATS:
+            raise ValueError("Invalid report format: {0}".format(args.format))
+
+    return args
+
+
+def get_server_caches(storage_directory, args):
+    """Open the caches of the server.
+
+    On-disk caches get an in-memory layer in front of them, and in-memory
+    caches are used instead of the ones that are disabled.
+    """
+    caches = osa_differ.get_caches(storage_directory, args)
+    for name, disk_cache in caches.items():
+        if disk_cache is None:
+            caches[name] = cache.MemoryCache()
+        else:
+            caches[name] = cache.TieredCache(disk_cache)
+    return caches
+
+
+def parse_flag(value):
+    """Parse the value of an on/off query parameter."""
+    value = value.lower()
+    if value in ['1', 'true', 'yes', 'on']:
+        return True
+    if value in ['0', 'false', 'no', 'off']:
+        return False
+    raise ValueError("Invalid value for an option: {0}".format(value))
+
+
+def serve(args, storage_directory):
+    """Serve reports until interrupted."""
+    server = create_server(args, storage_directory)
+    if args.socket:
+        address = args.socket
+    else:
+        address = "http://{0}:{1}".format(*server.server_address[:2])
+    print("Serving reports on {0}".format(address))
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if args.socket and os.path.exists(args.socket):
+            os.remove(args.socket)
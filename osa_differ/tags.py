@@ -0,0 +1,192 @@
+# Copyright 2016, Major Hayden
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Index of the release tags in a repository."""
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+
+
+log = logging.getLogger()
+
+# Name of the index file inside the git directory of a repo.
+INDEX_FILE = 'osa-differ-tags.json'
+
+# Indexes written with another layout are rebuilt from scratch.
+INDEX_VERSION = 1
+
+# Releases like 17.0.0, and pre-releases like 17.0.0.0b1 or 17.0.0.0rc1.
+VERSION_RE = re.compile(r'^(?P<release>\d+(?:\.\d+)*)'
+                        r'(?:(?P<stage>a|b|rc)(?P<number>\d+))?$')
+
+# Pre-release stages in the order they come before their release.
+PRE_RELEASE_STAGES = ['a', 'b', 'rc']
+
+
+def parse_tag(name):
+    """Parse a tag into its sort key, release and pre-release flag.
+
+    Pre-releases sort before their release, for example 17.0.0.0b1 comes
+    before 17.0.0.0rc1, which comes before 17.0.0. Tags that are not
+    versions sort before all of the versions, by name.
+    """
+    match = VERSION_RE.match(name)
+    if match is None:
+        return [0, name], name, False
+
+    release = match.group('release')
+    stage = match.group('stage')
+    if stage and release.count('.') == 3 and release.endswith('.0'):
+        # pbr adds a fourth component to pre-releases, 17.0.0.0rc1 is a
+        # pre-release of 17.0.0.
+        release = release[:-2]
+
+    parts = [int(x) for x in release.split('.')]
+    while len(parts) > 1 and parts[-1] == 0:
+        parts.pop()
+
+    if stage:
+        key = [1, parts, PRE_RELEASE_STAGES.index(stage),
+               int(match.group('number')), name]
+    else:
+        key = [1, parts, len(PRE_RELEASE_STAGES), 0, name]
+
+    return key, release, bool(stage)
+
+
+class TagIndex(object):
+    """Tags of a repo, sorted by version.
+
+    The index is kept in the git directory of the repo. It is refreshed
+    whenever the tags of the repo change, and only new or moved tags are
+    parsed again.
+    """
+
+    def __init__(self, repo_dir):
+        """Open the index of a repo, refreshing it if needed."""
+        from git import Repo
+        self.repo = Repo(repo_dir)
+        self.git_dir = self.repo.common_dir
+        self.path = os.path.join(self.git_dir, INDEX_FILE)
+        self.stamp = None
+        self.tags = {}
+        self._load()
+        self.refresh()
+
+    def refresh(self, force=False):
+        """Update the index if the tags of the repo have changed.
+
+        Returns True if the index was updated.
+        """
+        stamp = self._stamp()
+        if stamp == self.stamp and not force:
+            return False
+
+        output = self.repo.git.for_each_ref(
+            '--format=%(refname:strip=2)%00%(objectname)%00%(*objectname)',
+            'refs/tags'
+        )
+        tags = {}
+        for line in output.splitlines():
+            name, object_sha, peeled_sha = line.split('\0')
+            entry = self.tags.get(name)
+            if entry is None or entry['object'] != object_sha:
+                key, release, pre_release = parse_tag(name)
+                entry = {
+                    'object': object_sha,
+                    'commit': peeled_sha or object_sha,
+                    'annotated': bool(peeled_sha),
+                    'key': key,
+                    'release': release,
+                    'pre_release': pre_release,
+                }
+            tags[name] = entry
+
+        log.debug("Indexed {0} tags in {1}".format(len(tags), self.git_dir))
+        self.tags = tags
+        self.stamp = stamp
+        self._sort()
+        self._save()
+        return True
+
+    def between(self, old_tag, new_tag):
+        """List the tags from ``old_tag`` up to, but excluding, ``new_tag``."""
+        return self.names[self.positions[old_tag]:self.positions[new_tag]]
+
+    def nearest_tag(self, commit):
+        """Find the newest annotated tag on or before a commit."""
+        sha = self.repo.commit(commit).hexsha
+        if sha not in self.commit_tags:
+            tag = self.repo.git.describe('--abbrev=0', sha)
+            if tag not in self.tags:
+                return tag
+            sha = self.tags[tag]['commit']
+        return self.commit_tags[sha]
+
+    def digest(self):
+        """Hash the names and objects of all of the tags."""
+        tags = {name: entry['object'] for name, entry in self.tags.items()}
+        return hashlib.sha256(
+            json.dumps(tags, sort_keys=True).encode('UTF-8')
+        ).hexdigest()
+
+    def _sort(self):
+        self.names = sorted(self.tags, key=lambda x: self.tags[x]['key'])
+        self.positions = {name: x for x, name in enumerate(self.names)}
+        # Like 'git describe', only annotated tags count as nearest tags.
+        # The newest version wins when a commit has several of them.
+        self.commit_tags = {self.tags[name]['commit']: name
+                            for name in self.names
+                            if self.tags[name]['annotated']}
+
+    def _stamp(self):
+        # Adding, moving or packing tags changes at least one of these.
+        stamp = []
+        for path in ['packed-refs', 'refs/tags', 'reftable/tables.list']:
+            try:
+                stat = os.stat(os.path.join(self.git_dir, path))
+            except OSError:
+                stamp.append(None)
+            else:
+                stamp.append([stat.st_mtime, stat.st_size])
+        return stamp
+
+    def _load(self):
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+        except (IOError, OSError, ValueError):
+            return
+
+        if data.get('version') == INDEX_VERSION:
+            self.stamp = data['stamp']
+            self.tags = data['tags']
+            self._sort()
+
+    def _save(self):
+        data = json.dumps({
+            'version': INDEX_VERSION,
+            'stamp': self.stamp,
+            'tags': self.tags,
+        }, separators=(',', ':'))
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.git_dir, suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                f.write(data)
+            os.rename(tmp_path, self.path)
+        except (IOError, OSError) as e:
+            log.debug("Unable to save the tag index {0}: {1}".format(
+                self.path, e))
@@ -0,0 +1,167 @@
+# Copyright 2016, Major Hayden
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Timing spans that show where a report spends its time.
+
+Spans are only recorded once ``enable`` has been called, otherwise ``span``
+does nothing.
+"""
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+
+# Per-repo phases, in the order they appear in the summary.
+REPO_PHASES = ['clone', 'fetch', 'update', 'validate', 'log', 'render']
+
+_tracer = None
+
+
+class Tracer(object):
+    """Collect the timing spans of every thread."""
+
+    def __init__(self):
+        """Initialise instance."""
+        self.start = time.time()
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def record(self, name, start, duration, thread=None, **attrs):
+        """Record a span that started at ``start`` and took ``duration``.
+
+        Spans are shown on the lane of the current thread, unless another
+        ``thread`` name is given.
+        """
+        span = {
+            'name': name,
+            'start': start - self.start,
+            'duration': duration,
+            'thread': thread or threading.current_thread().name,
+            'attrs': attrs,
+        }
+        with self._lock:
+            self.spans.append(span)
+
+
+def enable():
+    """Start recording spans."""
+    global _tracer
+    _tracer = Tracer()
+    return _tracer
+
+
+def disable():
+    """Stop recording spans."""
+    global _tracer
+    _tracer = None
+
+
+@contextmanager
+def span(name, **attrs):
+    """Time a block of code, if timings are enabled."""
+    tracer = _tracer
+    if tracer is None:
+        yield
+        return
+
+    start = time.time()
+    try:
+        yield
+    finally:
+        tracer.record(name, start, time.time() - start, **attrs)
+
+
+def record(name, start, duration, thread=None, **attrs):
+    """Record a span that was timed elsewhere, if timings are enabled."""
+    tracer = _tracer
+    if tracer is not None:
+        tracer.record(name, start, duration, thread, **attrs)
+
+
+def write_trace(tracer, path):
+    """Write all spans to a file.
+
+    Files ending in ``.jsonl`` get one JSON span per line. Anything else
+    gets the Chrome trace event format, which can be loaded into
+    chrome://tracing or Perfetto.
+    """
+    with tracer._lock:
+        spans = list(tracer.spans)
+
+    with open(path, 'w') as f:
+        if path.endswith('.jsonl'):
+            for x in spans:
+                line = dict(x['attrs'], name=x['name'], start=x['start'],
+                            duration=x['duration'], thread=x['thread'])
+                f.write(json.dumps(line, sort_keys=True) + "\n")
+            return
+
+        pid = os.getpid()
+        threads = {}
+        events = []
+        for x in spans:
+            if x['thread'] not in threads:
+                threads[x['thread']] = len(threads) + 1
+                events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid,
+                               'tid': threads[x['thread']],
+                               'args': {'name': x['thread']}})
+            events.append({
+                'name': x['name'],
+                'cat': x['attrs'].get('repo', 'osa-differ'),
+                'ph': 'X',
+                'ts': int(x['start'] * 1000000),
+                'dur': int(x['duration'] * 1000000),
+                'pid': pid,
+                'tid': threads[x['thread']],
+                'args': x['attrs'],
+            })
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+
+def format_summary(tracer):
+    """Summarize the spans by phase, and by repo for per-repo phases."""
+    with tracer._lock:
+        spans = list(tracer.spans)
+
+    phases = defaultdict(lambda: [0, 0.0])
+    repos = defaultdict(lambda: defaultdict(float))
+    for x in spans:
+        phases[x['name']][0] += 1
+        phases[x['name']][1] += x['duration']
+        if 'repo' in x['attrs'] and x['name'] in REPO_PHASES:
+            repos[x['attrs']['repo']][x['name']] += x['duration']
+
+    lines = ["Timings ({0:.2f}s in total)".format(time.time() - tracer.start),
+             "{0:<40} {1:>6} {2:>10}".format('Phase', 'Count', 'Time')]
+    for name, (count, duration) in sorted(phases.items(),
+                                          key=lambda x: -x[1][1]):
+        lines.append("{0:<40} {1:>6} {2:>9.2f}s".format(name, count,
+                                                        duration))
+
+    if repos:
+        lines.append("")
+        lines.append("{0:<40} {1}".format(
+            'Repository',
+            " ".join("{0:>9}".format(x) for x in REPO_PHASES + ['total'])))
+        totals = {name: sum(phases.values()) for name, phases in repos.items()}
+        for name in sorted(repos, key=lambda x: -totals[x]):
+            lines.append("{0:<40} {1}".format(
+                name,
+                " ".join("{0:>8.2f}s".format(x) for x in
+                         [repos[name][y] for y in REPO_PHASES] +
+                         [totals[name]])))
+
+    return "\n".join(lines)
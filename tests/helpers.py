@@ -0,0 +1,13 @@
+"""Helpers shared by the osa-differ tests."""
+from git import Repo
+
+
+def make_commits(p, count, message="Testing {0}"):
+    """Create a repo (if needed) and add a number of commits to it."""
+    repo = Repo.init(str(p))
+    for x in range(0, count):
+        file = p / 'test.txt'
+        file.write_text(u'{0} {1}'.format(message, x), encoding='utf-8')
+        repo.index.add(['test.txt'])
+        repo.index.commit(message.format(x))
+    return repo
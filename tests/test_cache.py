@@ -0,0 +1,59 @@
+"""Testing the osa-differ caches."""
+import os
+import time
+
+from osa_differ import cache
+
+
+class TestDiskCache(object):
+    """Testing the on-disk cache."""
+
+    def test_get_put(self, tmpdir):
+        """Verify that values can be stored and read back."""
+        disk_cache = cache.DiskCache(str(tmpdir / 'cache'), 1024 * 1024)
+
+        assert disk_cache.get(['missing']) is None
+        disk_cache.put(['key', 1], {'value': [1, 2, 3]})
+
+        assert disk_cache.get(['key', 1]) == {'value': [1, 2, 3]}
+        assert disk_cache.get(['key', 2]) is None
+
+    def test_corrupt_entry(self, tmpdir):
+        """Verify that unreadable entries are treated as misses."""
+        disk_cache = cache.DiskCache(str(tmpdir), 1024 * 1024)
+        disk_cache.put('key', 'value')
+        with open(disk_cache._path('key'), 'w') as f:
+            f.write('{not json')
+
+        assert disk_cache.get('key') is None
+
+    def test_evict_least_recently_used(self, tmpdir):
+        """Verify that the least recently used entries are evicted."""
+        disk_cache = cache.DiskCache(str(tmpdir), 350)
+        for key in ['a', 'b', 'c']:
+            disk_cache.put(key, 'x' * 100)
+        # Make 'a' the oldest entry, then use it so 'b' becomes the oldest.
+        past = time.time() - 100
+        for key in ['a', 'b', 'c']:
+            os.utime(disk_cache._path(key), (past, past))
+            past += 10
+        disk_cache.get('a')
+
+        disk_cache.put('d', 'x' * 100)
+
+        assert disk_cache.get('b') is None
+        assert disk_cache.get('a') is not None
+        assert disk_cache.get('c') is not None
+        assert disk_cache.get('d') is not None
+
+    def test_tiered_cache(self, tmpdir):
+        """Verify that values read from disk are kept in memory."""
+        disk_cache = cache.DiskCache(str(tmpdir), 1024 * 1024)
+        disk_cache.put('key', 'value')
+        tiered_cache = cache.TieredCache(disk_cache)
+
+        assert tiered_cache.get('key') == 'value'
+        os.remove(disk_cache._path('key'))
+        assert tiered_cache.get('key') == 'value'
+        tiered_cache.put('other', 'value')
+        assert disk_cache.get('other') == 'value'
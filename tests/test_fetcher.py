@@ -0,0 +1,76 @@
+"""Testing the osa-differ fetch stage."""
+import os
+
+from git import Repo
+
+from helpers import make_commits
+
+from osa_differ import fetcher
+
+
+class TestFetcher(object):
+    """Testing the osa-differ fetch stage."""
+
+    def test_fetch_repos(self, tmpdir):
+        """Verify that missing repos are cloned and others fetched."""
+        source = make_commits(tmpdir.mkdir('source'), 1)
+        storage = tmpdir.mkdir('storage')
+        existing_dir = "{0}/existing".format(str(storage))
+        Repo.clone_from(source.working_dir, existing_dir, bare=True)
+        new_sha = make_commits(tmpdir / 'source', 1).head.commit.hexsha
+        missing_dir = "{0}/missing".format(str(storage))
+        repo_updates = [
+            (missing_dir, source.working_dir, []),
+            (existing_dir, source.working_dir, []),
+        ]
+
+        results = fetcher.fetch_repos(repo_updates,
+                                      clone_options={'bare': True},
+                                      concurrency=2)
+
+        assert [x.action for x in results] == ['clone', 'fetch']
+        assert [x.status for x in results] == ['ok', 'ok']
+        assert Repo(missing_dir).bare
+        assert Repo(existing_dir).commit(new_sha)
+        assert 'clone ok: 1' in fetcher.format_summary(results)
+        assert os.path.exists(os.path.join(missing_dir, 'objects', 'info',
+                                           'commit-graph'))
+
+    def test_fetch_repos_auto(self, tmpdir):
+        """Verify that auto mode skips repos that have their commits."""
+        source = make_commits(tmpdir.mkdir('source'), 1)
+        repo_dir = "{0}/clone".format(str(tmpdir))
+        Repo.clone_from(source.working_dir, repo_dir)
+        sha = source.head.commit.hexsha
+
+        results = fetcher.fetch_repos([(repo_dir, source.working_dir, [sha])],
+                                      fetch='auto')
+        assert results[0].action == 'skip'
+
+        results = fetcher.fetch_repos(
+            [(repo_dir, source.working_dir, [sha, '0' * 40])],
+            fetch='auto'
+        )
+        assert results[0].action == 'fetch'
+
+    def test_fetch_repos_failure(self, tmpdir):
+        """Verify that failed clones are reported and cleaned up."""
+        repo_dir = "{0}/clone".format(str(tmpdir))
+        missing_url = "{0}/doesnotexist".format(str(tmpdir))
+
+        results = fetcher.fetch_repos([(repo_dir, missing_url, [])])
+
+        assert results[0].status == 'failed'
+        assert results[0].detail
+        assert not os.path.exists(repo_dir)
+
+    def test_fetch_repos_timeout(self, tmpdir):
+        """Verify that slow git commands are stopped."""
+        source = make_commits(tmpdir.mkdir('source'), 1)
+        repo_dir = "{0}/clone".format(str(tmpdir))
+
+        results = fetcher.fetch_repos([(repo_dir, source.working_dir, [])],
+                                      timeout=0.0001)
+
+        assert results[0].status == 'timeout'
+        assert not os.path.exists(repo_dir)
@@ -0,0 +1,50 @@
+"""Testing the osa-differ storage maintenance."""
+import os
+
+from git import Repo
+
+from helpers import make_commits
+
+from osa_differ import maintenance
+from osa_differ import osa_differ
+
+
+class TestMaintenance(object):
+    """Testing storage maintenance."""
+
+    def test_find_repos(self, tmpdir):
+        """Verify that only repos are found in the storage directory."""
+        make_commits(tmpdir.mkdir('checkout'), 1)
+        Repo.init(str(tmpdir / 'bare'), bare=True)
+        tmpdir.mkdir('.cache')
+        tmpdir.mkdir('other')
+
+        result = maintenance.find_repos(str(tmpdir))
+
+        assert [os.path.basename(x) for x in result] == ['bare', 'checkout']
+
+    def test_run_osa_differ_maintain(self, tmpdir, monkeypatch, capsys):
+        """Verify that every step runs and is reported for every repo."""
+        storage = tmpdir.mkdir('storage')
+        for name in ['os_a', 'os_b']:
+            make_commits(storage.mkdir(name), 3)
+        monkeypatch.setattr('sys.argv', ['osa-differ', 'maintain',
+                                         '--directory', str(storage)])
+
+        osa_differ.run_osa_differ()
+        out, _ = capsys.readouterr()
+
+        for name in ['os_a', 'os_b']:
+            git_dir = str(storage / name / '.git')
+            assert os.path.exists(os.path.join(git_dir, 'packed-refs'))
+            assert os.path.exists(os.path.join(git_dir, 'objects', 'pack',
+                                               'multi-pack-index'))
+            assert name in out
+        assert 'Total (2 repositories)' in out
+        assert 'failed' not in out
+
+    def test_format_size(self):
+        """Verify that sizes are formatted for humans."""
+        assert maintenance.format_size(512) == '512 B'
+        assert maintenance.format_size(1536) == '1.5 KiB'
+        assert maintenance.format_size(3 * 1024 ** 3) == '3.0 GiB'
@@ -2,18 +2,54 @@
 import argparse
 import json
 import os
+import shutil
 import subprocess
+import sys
 
 
-from git import Repo
+from git import GitCommandError, Repo
+
+from helpers import make_commits
 
 import httpretty
 
+from osa_differ import cache
+from osa_differ import exceptions
+from osa_differ import fetcher
 from osa_differ import osa_differ
 
 from pytest import raises
 
 
+def get_loaded_modules(code, *modules):
+    """Run code in a new interpreter and list the modules it imported."""
+    source_dir = os.path.dirname(os.path.dirname(osa_differ.__file__))
+    code += ("\nsys.stderr.write(' '.join(x for x in {0!r} "
+             "if x in sys.modules))".format(list(modules)))
+    process = subprocess.Popen([sys.executable, '-c', 'import sys\n' + code],
+                               cwd=source_dir,
+                               stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE)
+    _, stderr = process.communicate()
+    return stderr.decode('UTF-8').split()
+
+
+def make_osa_repo(p, role_url, role_versions):
+    """Create an openstack-ansible repo pinning one role at two versions."""
+    repo = Repo.init(str(p))
+    for version in role_versions:
+        file = p / 'ansible-role-requirements.yml'
+        file.write_text(u"""
+- name: os_test
+  scm: git
+  src: {0}
+  version: {1}
+""".format(role_url, version), encoding='utf-8')
+        repo.index.add(['ansible-role-requirements.yml'])
+        repo.index.commit("Pin os_test to {0}".format(version))
+    return repo
+
+
 class TestOSADiffer(object):
     """Testing osa-differ."""
 
@@ -49,6 +85,12 @@ class TestOSADiffer(object):
         assert args['new_commit'][0] == '13.3.1'
         assert args['version_mappings'] == {'foo': {'1.0.0': 'v1.0.0'}}
 
+    def test_arguments_auto_update(self):
+        """Verify that --auto-update selects the auto update mode."""
+        parser = osa_differ.create_parser()
+        args = parser.parse_args(['13.3.0', '13.3.1', '--auto-update'])
+        assert args.update == 'auto'
+
     def test_create_parser(self):
         """Verify that we can create an argument parser."""
         parser = osa_differ.create_parser()
@@ -122,6 +164,92 @@ class TestOSADiffer(object):
                                          hide_merges=False)
         assert len(list(commits)) == 2
 
+    def test_iter_commits(self, tmpdir):
+        """Verify that commits are streamed as records."""
+        repo = make_commits(tmpdir.mkdir('test'), 3, u"Commit \u00e9 #{0}")
+        head = repo.head.commit
+
+        commits = osa_differ.iter_commits(str(tmpdir / 'test'), 'HEAD~2',
+                                          'HEAD')
+        commit = next(commits)
+        commits.close()
+
+        assert commit.hexsha == head.hexsha
+        assert commit.summary == u"Commit \u00e9 #2"
+        assert commit.author == head.author.name
+        assert commit.date == head.authored_datetime.isoformat()
+
+        # Summaries are only the first line, like GitPython's.
+        repo.index.commit("line one\nline two\n\nbody\n")
+        commits = list(osa_differ.iter_commits(str(tmpdir / 'test'),
+                                               'HEAD~3', 'HEAD'))
+        assert [x.summary for x in commits] == [
+            repo.head.commit.summary, u"Commit \u00e9 #2", u"Commit \u00e9 #1"]
+        assert commits[0].summary == "line one"
+
+    def test_iter_commits_invalid(self, tmpdir):
+        """Verify that invalid ranges raise an error."""
+        make_commits(tmpdir.mkdir('test'), 1)
+
+        with raises(GitCommandError):
+            list(osa_differ.iter_commits(str(tmpdir / 'test'), 'HEAD~2',
+                                         'HEAD'))
+
+    def test_get_commits_cached(self, tmpdir):
+        """Verify that commit ranges are cached by resolved SHA."""
+        p = tmpdir.mkdir('test')
+        path = str(p)
+        repo = Repo.init(path)
+        for x in range(0, 3):
+            file = p / "test{0}.txt".format(x)
+            file.write_text(u"Test", encoding='utf-8')
+            repo.index.add(['test{0}.txt'.format(x)])
+            repo.index.commit("Commit #{0}".format(x))
+        commit_cache = cache.DiskCache(str(tmpdir / 'cache'), 1024 * 1024)
+        old_sha = repo.commit('HEAD~2').hexsha
+        new_sha = repo.commit('HEAD').hexsha
+
+        commits = osa_differ.get_commits(path, 'HEAD~2', 'HEAD',
+                                         commit_cache=commit_cache,
+                                         repo_url='http://example.com')
+
+        assert [x.summary for x in commits] == ['Commit #2', 'Commit #1']
+        assert commits[0].hexsha == new_sha
+        assert commits[0].author == repo.head.commit.author.name
+        cached = osa_differ.get_cached_commits(commit_cache,
+                                               'http://example.com',
+                                               old_sha, new_sha)
+        assert cached == commits
+        assert osa_differ.get_cached_commits(commit_cache,
+                                             'http://example.com',
+                                             'HEAD~2', 'HEAD') is None
+
+    def test_make_report_cached(self, tmpdir):
+        """Verify that cached SHA ranges do not need the repo."""
+        p = tmpdir.mkdir('test')
+        path = str(p)
+        repo = Repo.init(path)
+        for x in range(0, 2):
+            file = p / 'test.txt'
+            file.write_text(u'Testing{0}'.format(x), encoding='utf-8')
+            repo.index.add(['test.txt'])
+            repo.index.commit('Testing {0}'.format(x))
+        commit_cache = cache.DiskCache(str(tmpdir / 'cache'), 1024 * 1024)
+        new_pins = [("test", "http://example.com", repo.commit('HEAD').hexsha)]
+        old_pins = [("test", "http://example.com",
+                     repo.commit('HEAD~1').hexsha)]
+
+        report = osa_differ.make_report(str(tmpdir), old_pins, new_pins,
+                                        commit_cache=commit_cache)
+        empty_storage = str(tmpdir.mkdir('empty'))
+        cached_report = osa_differ.make_report(empty_storage, old_pins,
+                                               new_pins,
+                                               commit_cache=commit_cache)
+
+        assert "Testing 1" in report
+        assert cached_report == report
+        assert os.listdir(empty_storage) == []
+
     def test_get_projects(self, tmpdir):
         """Verify that we can retrieve projects."""
         p = tmpdir.mkdir('test')
@@ -182,6 +310,131 @@ novncproxy_git_project_group: nova_console
         assert isinstance(roles, list)
         assert roles[0][0] == 'apt_package_pinning'
 
+    def test_get_roles_leaves_working_tree(self, tmpdir):
+        """Verify that roles are read from git objects, not the checkout."""
+        p = tmpdir.mkdir('test')
+        path = str(p)
+        repo = Repo.init(path)
+        file = p / 'ansible-role-requirements.yml'
+        file.write_text(u"""
+- name: apt_package_pinning
+  scm: git
+  src: https://github.com/openstack/openstack-ansible-apt_package_pinning
+  version: master
+""", encoding='utf-8')
+        repo.index.add(['ansible-role-requirements.yml'])
+        repo.index.commit("Test")
+        file.write_text(u"local changes", encoding='utf-8')
+
+        roles = osa_differ.get_roles(path,
+                                     'HEAD',
+                                     'ansible-role-requirements.yml')
+        assert roles[0][0] == 'apt_package_pinning'
+        assert file.read_text(encoding='utf-8') == u"local changes"
+
+    def test_get_manifests(self, tmpdir):
+        """Verify that we can read roles and projects at a commit."""
+        p = tmpdir.mkdir('test')
+        path = str(p)
+        repo = Repo.init(path)
+        file = p / 'ansible-role-requirements.yml'
+        file.write_text(u"""
+- name: apt_package_pinning
+  scm: git
+  src: https://github.com/openstack/openstack-ansible-apt_package_pinning
+  version: master
+""", encoding='utf-8')
+        pkgs = p.mkdir('playbooks').mkdir('defaults').mkdir('repo_packages')
+        file = pkgs / 'openstack_testing.yml'
+        file.write_text(u"""---
+tempest_git_repo: https://git.openstack.org/openstack/tempest
+tempest_git_install_branch: 1493c7f0ba49bfccb9ff8516b10a65d949d7462e
+tempest_git_project_group: utility_all
+""", encoding='utf-8')
+        file = pkgs / 'README.txt'
+        file.write_text(u"Not a manifest", encoding='utf-8')
+        pkgs_dir = 'playbooks/defaults/repo_packages'
+        repo.index.add(['ansible-role-requirements.yml',
+                        '{0}/openstack_testing.yml'.format(pkgs_dir),
+                        '{0}/README.txt'.format(pkgs_dir)])
+        repo.index.commit("Test")
+        sha = repo.head.commit.hexsha
+        repo.git.rm('-r', '-q', 'playbooks')
+        repo.index.commit("Remove projects")
+
+        roles, projects = osa_differ.get_manifests(
+            path, sha, 'ansible-role-requirements.yml')
+        assert roles[0][0] == 'apt_package_pinning'
+        assert roles[0][2] == 'master'
+        assert projects == [(
+            'tempest',
+            'https://git.openstack.org/openstack/tempest',
+            '1493c7f0ba49bfccb9ff8516b10a65d949d7462e')]
+        assert not os.path.exists(str(pkgs))
+
+    def test_get_manifests_parse_cache(self, tmpdir, monkeypatch):
+        """Verify that manifest files are parsed once for each blob."""
+        p = tmpdir.mkdir('test')
+        repo = Repo.init(str(p))
+        pkgs = p.mkdir('playbooks').mkdir('defaults').mkdir('repo_packages')
+        (pkgs / 'a.yml').write_text(u"""---
+nova_git_repo: https://git.openstack.org/openstack/nova
+nova_git_install_branch: master
+nova_git_project_group: nova_all
+""", encoding='utf-8')
+        for version in ['stable/a', 'stable/b']:
+            (p / 'ansible-role-requirements.yml').write_text(u"""
+- name: os_nova
+  src: https://git.openstack.org/openstack/openstack-ansible-os_nova
+  version: {0}
+""".format(version), encoding='utf-8')
+            (pkgs / 'b.yml').write_text(u"""---
+keystone_git_repo: https://git.openstack.org/openstack/keystone
+keystone_git_install_branch: {0}
+""".format(version), encoding='utf-8')
+            repo.index.add(['ansible-role-requirements.yml',
+                            'playbooks/defaults/repo_packages/a.yml',
+                            'playbooks/defaults/repo_packages/b.yml'])
+            repo.index.commit("Pin {0}".format(version))
+
+        parsed = []
+        load_blob_yaml = osa_differ._load_blob_yaml
+
+        def mock_load_blob_yaml(blob):
+            parsed.append(blob.path)
+            return load_blob_yaml(blob)
+
+        monkeypatch.setattr(osa_differ, '_load_blob_yaml',
+                            mock_load_blob_yaml)
+        parse_cache = cache.DiskCache(str(tmpdir / 'cache'), 1024 * 1024)
+        manifests = [osa_differ.get_manifests(str(p), x,
+                                              'ansible-role-requirements.yml',
+                                              parse_cache)
+                     for x in ['HEAD~1', 'HEAD']]
+
+        assert sorted(parsed) == [
+            'ansible-role-requirements.yml',
+            'ansible-role-requirements.yml',
+            'playbooks/defaults/repo_packages/a.yml',
+            'playbooks/defaults/repo_packages/b.yml',
+            'playbooks/defaults/repo_packages/b.yml',
+        ]
+        assert manifests[1][1] == [
+            ('nova', 'https://git.openstack.org/openstack/nova', 'master'),
+            ('keystone', 'https://git.openstack.org/openstack/keystone',
+             'stable/b'),
+        ]
+
+        # Another process reads the same pins from the cache on disk.
+        monkeypatch.setattr(osa_differ, '_manifest_cache',
+                            cache.MemoryCache())
+        del parsed[:]
+        cached = osa_differ.get_manifests(str(p), 'HEAD',
+                                          'ansible-role-requirements.yml',
+                                          parse_cache)
+        assert cached == manifests[1]
+        assert parsed == []
+
     @httpretty.activate
     def test_post_gist(self):
         """Verify that posting gists works."""
@@ -270,6 +523,26 @@ novncproxy_git_project_group: nova_console
 
         assert result == 'flip'
 
+    def test_commit_range_empty(self, tmpdir):
+        """Verify that a range between the same commits is invalid."""
+        repo = make_commits(tmpdir.mkdir('test'), 2)
+
+        with raises(exceptions.InvalidCommitRangeException):
+            osa_differ.validate_commit_range(repo.working_dir, 'HEAD',
+                                             repo.head.commit.hexsha)
+
+    def test_update_repo_commit_graph(self, tmpdir):
+        """Verify that updated repos get commit-graph files."""
+        origin = make_commits(tmpdir.mkdir('origin'), 2)
+        repo_dir = str(tmpdir / 'clone')
+
+        repo = osa_differ.update_repo(repo_dir, origin.working_dir)
+
+        assert os.path.exists(os.path.join(repo.git_dir, 'objects', 'info',
+                                           'commit-graph'))
+        assert repo.git.config('fetch.writeCommitGraph') == 'true'
+        assert osa_differ.get_commit_graph_commands(repo_dir) == []
+
     def test_make_osa_report(self, tmpdir):
         """Verify that we can make the OSA header report."""
         p = tmpdir.mkdir('test')
@@ -356,6 +629,586 @@ novncproxy_git_project_group: nova_console
 
         assert report == ''
 
+    def test_get_repo_updates(self):
+        """Verify that we list the repos needed for a report."""
+        old_pins = [("nova", "http://example.com/nova", "1.0"),
+                    ("gone", "http://example.com/gone", "1.0")]
+        new_pins = [("nova", "http://example.com/nova", "2.0"),
+                    ("added", "http://example.com/added", "1.0")]
+        version_mappings = {"nova": {"1.0": "v1.0"}}
+
+        pin_diff = osa_differ.diff_pins(old_pins, new_pins, version_mappings)
+        result = osa_differ.get_repo_updates("/storage", pin_diff)
+
+        assert result == [("/storage/nova", "http://example.com/nova",
+                           ["v1.0", "2.0"])]
+
+    def test_diff_pins(self):
+        """Verify that repos are sorted by how their pins changed."""
+        old_pins = [("nova", "http://example.com/nova", "1.0"),
+                    ("gone", "http://example.com/gone", "1.0"),
+                    ("glance", "http://example.com/glance", "1.0"),
+                    ("neutron", "http://example.com/neutron", "old")]
+        new_pins = [("glance", "http://example.com/glance", "1.0"),
+                    ("added", "http://example.com/added", "1.0"),
+                    ("nova", "http://example.com/nova", "2.0"),
+                    ("neutron", "http://example.com/neutron", "new")]
+        version_mappings = {"neutron": {"old": "new"}}
+
+        pin_diff = osa_differ.diff_pins(old_pins, new_pins,
+                                        version_mappings)
+
+        assert pin_diff.ranges == [
+            ("glance", "http://example.com/glance", "1.0", "1.0"),
+            ("nova", "http://example.com/nova", "1.0", "2.0"),
+            ("neutron", "http://example.com/neutron", "new", "new"),
+        ]
+        assert [x[0] for x in pin_diff.changed] == ["nova"]
+        assert [x[0] for x in pin_diff.unchanged] == ["glance", "neutron"]
+        assert pin_diff.added == [new_pins[1]]
+        assert pin_diff.removed == [old_pins[1]]
+        assert pin_diff.counts() == {'added': 1, 'removed': 1, 'changed': 1,
+                                     'unchanged': 2}
+
+        summary = osa_differ.render_template('offline-pin-summary.j2',
+                                             {'pin_diff': pin_diff})
+        assert "1 changed, 2 unchanged, 1 added and\n1 removed." in summary
+        assert "Added: ``added``" in summary
+        assert "Removed: ``gone``" in summary
+
+    def test_make_report_unchanged_pin(self, tmpdir):
+        """Verify that repos with unchanged pins are never touched."""
+        new_pins = [("test", "http://example.com", "1.0")]
+        old_pins = [("test", "http://example.com", "1.0")]
+
+        report = osa_differ.make_report(str(tmpdir), old_pins, new_pins,
+                                        do_update=True)
+
+        assert "No commits were found in `test <http://example.com>`" in report
+        assert not os.path.exists(str(tmpdir / 'test'))
+        pin_diff = osa_differ.diff_pins(old_pins, new_pins)
+        assert osa_differ.get_repo_updates(str(tmpdir), pin_diff) == []
+
+    def test_summarize_commits(self):
+        """Verify that long ranges keep their newest and oldest commits."""
+        authors = ['alice', 'bob', 'bob']
+        commits = (osa_differ.CommitRecord(str(x), "Commit #{0}".format(x),
+                                           authors[x % 3],
+                                           "2017-0{0}-01T00:00:00+00:00"
+                                           .format(x // 4 + 1))
+                   for x in range(9, -1, -1))
+
+        kept, summary = osa_differ.summarize_commits(commits, 5)
+
+        assert [x.hexsha for x in kept] == ['9', '8', '7', '1', '0']
+        assert summary == {
+            'total': 10,
+            'newest': 3,
+            'oldest': 2,
+            'omitted': 5,
+            'authors': [['bob', 6], ['alice', 4]],
+            'months': [['2017-03', 2], ['2017-02', 4], ['2017-01', 4]],
+        }
+
+    def test_get_report_commits_merges(self, tmpdir):
+        """Verify that the limit counts the commits that are listed."""
+        repo = make_commits(tmpdir.mkdir('test'), 1)
+        base_sha = repo.head.commit.hexsha
+        side = repo.index.commit('Side change', head=False)
+        main = repo.index.commit('Main change')
+        repo.index.commit('Combine branches', parent_commits=[main, side])
+
+        commits, truncated = osa_differ.get_report_commits(
+            str(tmpdir / 'test'), base_sha, 'HEAD', max_commits=2)
+
+        assert len(commits) == 2
+        assert truncated['total'] == 3
+        assert truncated['omitted'] == 1
+
+    def test_arguments_max_commits_per_repo(self, capsys):
+        """Verify that commit limits below 1 are rejected."""
+        parser = osa_differ.create_parser()
+        args = parser.parse_args(['13.3.0', '13.3.1',
+                                  '--max-commits-per-repo', '5'])
+        assert args.max_commits_per_repo == 5
+
+        for value in ['0', '-1']:
+            with raises(SystemExit):
+                parser.parse_args(['13.3.0', '13.3.1',
+                                   '--max-commits-per-repo', value])
+            _, err = capsys.readouterr()
+            assert "is not a number of at least 1" in err
+
+    def test_make_report_truncated(self, tmpdir):
+        """Verify that ranges over the limit are summarized."""
+        repo = make_commits(tmpdir.mkdir('test'), 10)
+        commit_cache = cache.DiskCache(str(tmpdir / 'cache'), 1024 * 1024)
+        pin_range = ("test", "http://example.com",
+                     repo.commit('HEAD~9').hexsha, repo.commit('HEAD').hexsha)
+
+        report = osa_differ.make_range_report(str(tmpdir), pin_range,
+                                              commit_cache=commit_cache,
+                                              max_commits=4)
+        empty_storage = str(tmpdir.mkdir('empty'))
+        record = osa_differ.make_range_record(empty_storage, pin_range,
+                                              commit_cache=commit_cache,
+                                              max_commits=4)
+
+        assert "9 commits were found in" in report
+        assert "The newest 2 and the oldest 2 of them are listed" in report
+        assert "5 more commits" in report
+        assert "Testing 9" in report
+        assert "Testing 5" not in report
+        assert "Commits by month:" in report
+        assert [x['summary'] for x in record['commits']] == [
+            'Testing 9', 'Testing 8', 'Testing 2', 'Testing 1']
+        assert record['truncated']['total'] == 9
+        assert os.listdir(empty_storage) == []
+
+        assert report == osa_differ.make_report(
+            str(tmpdir), [pin_range[0:3]], [pin_range[0:2] + pin_range[3:]],
+            max_commits=4)
+
+        full_report = osa_differ.make_range_report(str(tmpdir), pin_range,
+                                                   max_commits=9)
+        assert "9 commits were found in" in full_report
+        assert "Commits by month:" not in full_report
+
+    def test_make_report_parallel(self, tmpdir):
+        """Verify that parallel reports keep the order of the pins."""
+        new_pins = []
+        old_pins = []
+        for name in ['zeta', 'alpha', 'mu']:
+            p = tmpdir.mkdir(name)
+            repo = Repo.init(str(p))
+            for x in range(0, 2):
+                file = p / 'test.txt'
+                file.write_text(u'Testing{0}'.format(x), encoding='utf-8')
+                repo.index.add(['test.txt'])
+                repo.index.commit('{0} commit {1}'.format(name, x))
+            new_pins.append((name, "http://example.com", "HEAD"))
+            old_pins.append((name, "http://example.com", "HEAD~1"))
+
+        report = osa_differ.make_report(str(tmpdir), old_pins, new_pins,
+                                        jobs=3)
+
+        positions = [report.index("{0} commit 1".format(x))
+                     for x in ['zeta', 'alpha', 'mu']]
+        assert positions == sorted(positions)
+        assert report == osa_differ.make_report(str(tmpdir), old_pins,
+                                                new_pins)
+
+    def test_make_report_failures(self, tmpdir):
+        """Verify that failures are reported for each repository."""
+        for name in ['good', 'bad']:
+            p = tmpdir.mkdir(name)
+            repo = Repo.init(str(p))
+            for x in range(0, 2):
+                file = p / 'test.txt'
+                file.write_text(u'Testing{0}'.format(x), encoding='utf-8')
+                repo.index.add(['test.txt'])
+                repo.index.commit('Testing {0}'.format(x))
+
+        new_pins = [("good", "http://example.com", "HEAD"),
+                    ("bad", "http://example.com", "HEAD")]
+        old_pins = [("good", "http://example.com", "HEAD~1"),
+                    ("bad", "http://example.com", "HEAD~5")]
+
+        with raises(exceptions.RepoReportException) as excinfo:
+            osa_differ.make_report(str(tmpdir), old_pins, new_pins, jobs=2)
+
+        assert [x[0] for x in excinfo.value.failures] == ['bad']
+        assert "bad: Commit HEAD~5" in str(excinfo.value)
+
+    def test_iter_range_sections(self, tmpdir):
+        """Verify that sections are streamed before failures are raised."""
+        for name in ['bad', 'good']:
+            make_commits(tmpdir.mkdir(name), 2, name + " {0}")
+        new_pins = [("bad", "http://example.com", "HEAD"),
+                    ("good", "http://example.com", "HEAD")]
+        old_pins = [("bad", "http://example.com", "HEAD~5"),
+                    ("good", "http://example.com", "HEAD~1")]
+
+        pin_diff = osa_differ.diff_pins(old_pins, new_pins)
+        sections = osa_differ.iter_range_sections(str(tmpdir),
+                                                  pin_diff.ranges, jobs=2)
+
+        assert "good 1" in next(sections)
+        with raises(exceptions.RepoReportException):
+            next(sections)
+
+    def test_make_report_fragment_cache(self, tmpdir, monkeypatch):
+        """Verify that rendered sections are cached until templates change."""
+        repo = make_commits(tmpdir.mkdir('test'), 2)
+        fragment_cache = cache.DiskCache(str(tmpdir / 'cache'), 1024 * 1024)
+        new_pins = [("test", "http://example.com", repo.commit('HEAD').hexsha)]
+        old_pins = [("test", "http://example.com",
+                     repo.commit('HEAD~1').hexsha)]
+        report = osa_differ.make_report(str(tmpdir), old_pins, new_pins,
+                                        fragment_cache=fragment_cache)
+
+        empty_storage = str(tmpdir.mkdir('empty'))
+        cached_report = osa_differ.make_report(empty_storage, old_pins,
+                                               new_pins,
+                                               fragment_cache=fragment_cache)
+        assert cached_report == report
+
+        templates = tmpdir.mkdir('templates')
+        for name in os.listdir(osa_differ.TEMPLATE_DIR):
+            with open(os.path.join(osa_differ.TEMPLATE_DIR, name)) as f:
+                (templates / name).write_text(f.read() + u"\nChanged\n",
+                                              encoding='utf-8')
+        monkeypatch.setattr(osa_differ, 'TEMPLATE_DIR', str(templates))
+        report = osa_differ.make_report(str(tmpdir), old_pins, new_pins,
+                                        fragment_cache=fragment_cache)
+        assert "Changed" in report
+
+    def test_get_template_digest(self, monkeypatch):
+        """Verify that templates are only hashed once."""
+        digest = osa_differ.get_template_digest()
+
+        def listdir(path):
+            raise AssertionError("Templates were read again")
+        monkeypatch.setattr(os, 'listdir', listdir)
+
+        assert osa_differ.get_template_digest() == digest
+
+    def test_run_osa_differ_report_cache(self, tmpdir, monkeypatch, capsys):
+        """Verify that identical requests are answered from the cache."""
+        role = make_commits(tmpdir.mkdir('role'), 3)
+        storage = tmpdir.mkdir('storage')
+        osa = make_osa_repo(storage.mkdir('openstack-ansible'),
+                            role.working_dir,
+                            [role.commit('HEAD~2').hexsha,
+                             role.commit('HEAD').hexsha])
+        argv = ['osa-differ', 'HEAD~1', 'HEAD',
+                '--directory', str(storage),
+                '--osa-repo-url', osa.working_dir,
+                '--skip-projects']
+        monkeypatch.setattr('sys.argv', argv)
+
+        osa_differ.run_osa_differ()
+        report, _ = capsys.readouterr()
+        assert "2 commits were found in" in report
+        assert "Testing 2" in report
+
+        shutil.rmtree(str(storage / 'os_test'))
+        osa_differ.run_osa_differ()
+        cached_report, _ = capsys.readouterr()
+        assert cached_report == report
+        assert not os.path.exists(str(storage / 'os_test'))
+
+    def test_run_osa_differ_report_cache_reno_failure(self, tmpdir,
+                                                      monkeypatch, capsys):
+        """Verify that reports missing release notes are not cached."""
+        role = make_commits(tmpdir.mkdir('role'), 3)
+        storage = tmpdir.mkdir('storage')
+        osa = make_osa_repo(storage.mkdir('openstack-ansible'),
+                            role.working_dir,
+                            [role.commit('HEAD~2').hexsha,
+                             role.commit('HEAD').hexsha])
+        osa.git.config("user.name", "Chuck Norris")
+        osa.git.config("user.email", "chuck.norris@example.com")
+        osa.create_tag('1.0.0', ref='HEAD~1', message='Release 1.0.0')
+        osa.create_tag('2.0.0', ref='HEAD', message='Release 2.0.0')
+        argv = ['osa-differ', '1.0.0', '2.0.0',
+                '--directory', str(storage),
+                '--osa-repo-url', osa.working_dir,
+                '--skip-projects', '--release-notes']
+        monkeypatch.setattr('sys.argv', argv)
+        reno_runs = []
+
+        def mock_run_reno(osa_repo_dir, version, options):
+            reno_runs.append(version)
+            return reno_output
+
+        monkeypatch.setattr(osa_differ, 'run_reno', mock_run_reno)
+
+        reno_output = None
+        for x in range(0, 2):
+            osa_differ.run_osa_differ()
+            capsys.readouterr()
+            assert '2.0.0' in reno_runs
+            del reno_runs[:]
+
+        reno_output = "2.0.0\n======\n"
+        osa_differ.run_osa_differ()
+        report, _ = capsys.readouterr()
+        del reno_runs[:]
+        osa_differ.run_osa_differ()
+        cached_report, _ = capsys.readouterr()
+        assert cached_report == report
+        assert reno_runs == []
+
+    def test_run_osa_differ_timings(self, tmpdir, monkeypatch, capsys):
+        """Verify that timings are summarized and traced per repository."""
+        role = make_commits(tmpdir.mkdir('role'), 3)
+        storage = tmpdir.mkdir('storage')
+        osa = make_osa_repo(storage.mkdir('openstack-ansible'),
+                            role.working_dir,
+                            [role.commit('HEAD~2').hexsha,
+                             role.commit('HEAD').hexsha])
+        trace_file = str(tmpdir / 'trace.json')
+        argv = ['osa-differ', 'HEAD~1', 'HEAD',
+                '--directory', str(storage),
+                '--osa-repo-url', osa.working_dir,
+                '--skip-projects', '--no-cache',
+                '--timings', '--trace', trace_file]
+        monkeypatch.setattr('sys.argv', argv)
+
+        osa_differ.run_osa_differ()
+        _, err = capsys.readouterr()
+
+        assert "osa-update" in err
+        assert "os_test" in err
+        with open(trace_file) as f:
+            events = json.load(f)['traceEvents']
+        names = set(x['name'] for x in events if x['ph'] == 'X')
+        for name in ['osa-update', 'manifests', 'clone', 'validate', 'log',
+                     'render', 'publish']:
+            assert name in names
+
+    def test_run_osa_differ_json(self, tmpdir, monkeypatch, capsys):
+        """Verify that structured reports skip the templates."""
+        role = make_commits(tmpdir.mkdir('role'), 3)
+        storage = tmpdir.mkdir('storage')
+        osa = make_osa_repo(storage.mkdir('openstack-ansible'),
+                            role.working_dir,
+                            [role.commit('HEAD~2').hexsha,
+                             role.commit('HEAD').hexsha])
+        argv = ['osa-differ', 'HEAD~1', 'HEAD',
+                '--directory', str(storage),
+                '--osa-repo-url', osa.working_dir,
+                '--skip-projects', '--format', 'ndjson']
+        monkeypatch.setattr('sys.argv', argv)
+
+        def fail_render(*args):
+            raise AssertionError("Templates were rendered")
+
+        monkeypatch.setattr(osa_differ, 'render_template', fail_render)
+        osa_differ.run_osa_differ()
+        out, _ = capsys.readouterr()
+        records = [json.loads(x) for x in out.splitlines() if x]
+
+        assert [(x['type'], x['section']) for x in records] == [
+            ('repo', 'openstack-ansible'), ('pins', 'roles'),
+            ('repo', 'roles')]
+        assert records[1]['counts'] == {'added': 0, 'removed': 0,
+                                        'changed': 1, 'unchanged': 0}
+        assert records[2]['repo'] == 'os_test'
+        assert records[2]['new_sha'] == role.commit('HEAD').hexsha
+        assert [x['summary'] for x in records[2]['commits']] == [
+            'Testing 2', 'Testing 1']
+        assert records[2]['commits'][0]['url'].endswith(
+            '/commit/' + role.commit('HEAD').hexsha)
+
+        argv[-1] = 'json'
+        osa_differ.run_osa_differ()
+        out, _ = capsys.readouterr()
+        assert json.loads(out) == records
+
+    def test_run_osa_differ_previous(self, tmpdir, monkeypatch, capsys):
+        """Verify that a saved report is extended to a newer commit."""
+        role = make_commits(tmpdir.mkdir('role'), 5)
+        storage = tmpdir.mkdir('storage')
+        osa = make_osa_repo(storage.mkdir('openstack-ansible'),
+                            role.working_dir,
+                            [role.commit('HEAD~4').hexsha,
+                             role.commit('HEAD~2').hexsha,
+                             role.commit('HEAD').hexsha])
+        previous_file = str(tmpdir / 'previous.json')
+
+        def run(old, new, *options):
+            argv = ['osa-differ', old, new,
+                    '--directory', str(storage),
+                    '--osa-repo-url', osa.working_dir,
+                    '--skip-projects', '--no-cache', '--format', 'json']
+            monkeypatch.setattr('sys.argv', argv + list(options))
+            osa_differ.run_osa_differ()
+            return json.loads(capsys.readouterr()[0])
+
+        ranges = []
+        iter_commits = osa_differ.iter_commits
+
+        def mock_iter_commits(repo_dir, old_commit, new_commit, *args):
+            ranges.append((os.path.basename(repo_dir), old_commit[:7],
+                           new_commit[:7]))
+            return iter_commits(repo_dir, old_commit, new_commit, *args)
+
+        # Extend HEAD~2..HEAD~1 to HEAD~2..HEAD.
+        with open(previous_file, 'w') as f:
+            json.dump(run('HEAD~2', 'HEAD~1'), f)
+        report = run('HEAD~2', 'HEAD')
+        monkeypatch.setattr(osa_differ, 'iter_commits', mock_iter_commits)
+        extended = run('HEAD~2', 'HEAD', '--previous', previous_file)
+        assert extended == report
+        assert ranges == [
+            ('openstack-ansible', osa.commit('HEAD~1').hexsha[:7],
+             osa.commit('HEAD').hexsha[:7]),
+            ('os_test', role.commit('HEAD~2').hexsha[:7],
+             role.commit('HEAD').hexsha[:7]),
+        ]
+        assert len(extended[-1]['commits']) == 4
+
+        # A report of a newer commit can't be extended back in time, so
+        # rolled back repos are read in full again.
+        with open(previous_file, 'w') as f:
+            json.dump(report, f)
+        del ranges[:]
+        rolled_back = run('HEAD~2', 'HEAD~1', '--previous', previous_file)
+        monkeypatch.setattr(osa_differ, 'iter_commits', iter_commits)
+        assert rolled_back == run('HEAD~2', 'HEAD~1')
+        assert ('os_test', role.commit('HEAD~4').hexsha[:7],
+                role.commit('HEAD~2').hexsha[:7]) in ranges
+
+    def test_lazy_imports(self, tmpdir, monkeypatch, capsys):
+        """Verify that heavy dependencies are only imported when used."""
+        heavy = ['git', 'jinja2', 'requests', 'yaml']
+        assert get_loaded_modules(
+            "from osa_differ import osa_differ\n"
+            "sys.argv = ['osa-differ', '--help']\n"
+            "try:\n"
+            "    osa_differ.run_osa_differ()\n"
+            "except SystemExit:\n"
+            "    pass\n", *heavy) == []
+
+        # Cached reports don't need the templates or the manifests.
+        role = make_commits(tmpdir.mkdir('role'), 3)
+        storage = tmpdir.mkdir('storage')
+        osa = make_osa_repo(storage.mkdir('openstack-ansible'),
+                            role.working_dir,
+                            [role.commit('HEAD~2').hexsha,
+                             role.commit('HEAD').hexsha])
+        argv = ['osa-differ', 'HEAD~1', 'HEAD',
+                '--directory', str(storage),
+                '--osa-repo-url', osa.working_dir,
+                '--skip-projects', '--quiet']
+        monkeypatch.setattr('sys.argv', argv)
+        osa_differ.run_osa_differ()
+        assert get_loaded_modules(
+            "from osa_differ import osa_differ\n"
+            "sys.argv = {0!r}\n"
+            "osa_differ.run_osa_differ()\n".format(argv),
+            *heavy) == ['git']
+
+    def test_parse_commit_pairs(self, tmpdir):
+        """Verify that commit pairs are read from arguments and files."""
+        pairs_file = tmpdir / 'pairs.txt'
+        pairs_file.write_text(u"# Stable branches\n\n15.1.0 15.1.1\n",
+                              encoding='utf-8')
+
+        result = osa_differ.parse_commit_pairs(['13.3.0..13.3.1'],
+                                               str(pairs_file))
+
+        assert result == [('13.3.0', '13.3.1'), ('15.1.0', '15.1.1')]
+        with raises(ValueError):
+            osa_differ.parse_commit_pairs(['13.3.0'])
+
+    def test_run_osa_differ_batch(self, tmpdir, monkeypatch, capsys):
+        """Verify that batches share one fetch stage for all reports."""
+        role = make_commits(tmpdir.mkdir('role'), 3)
+        storage = tmpdir.mkdir('storage')
+        osa = make_osa_repo(storage.mkdir('openstack-ansible'),
+                            role.working_dir,
+                            [role.commit('HEAD~{0}'.format(x)).hexsha
+                             for x in [2, 1, 0]])
+        output_dir = str(tmpdir / 'reports')
+        argv = ['osa-differ', 'batch', 'HEAD~2..HEAD~1', 'HEAD~1..HEAD',
+                '--directory', str(storage),
+                '--osa-repo-url', osa.working_dir,
+                '--output-dir', output_dir,
+                '--skip-projects', '--no-cache']
+        monkeypatch.setattr('sys.argv', argv)
+        fetch_calls = []
+        real_fetch_repos = fetcher.fetch_repos
+
+        def mock_fetch_repos(repo_updates, *args):
+            fetch_calls.append(repo_updates)
+            return real_fetch_repos(repo_updates, *args)
+
+        monkeypatch.setattr(fetcher, 'fetch_repos', mock_fetch_repos)
+
+        osa_differ.run_osa_differ()
+        out, _ = capsys.readouterr()
+
+        assert len(fetch_calls) == 1
+        assert len(fetch_calls[0]) == 2
+        assert out.count("Report written to file") == 2
+        with open(os.path.join(output_dir,
+                               'osa-diff-HEAD~1-HEAD.rst')) as f:
+            report = f.read()
+        assert "1 commit was found in" in report
+        assert "Testing 2" in report
+
+    def test_run_osa_differ_batch_no_fetch_stage(self, tmpdir, monkeypatch,
+                                                 capsys):
+        """Verify that repos shared by a batch are updated once."""
+        role = make_commits(tmpdir.mkdir('role'), 3)
+        storage = tmpdir.mkdir('storage')
+        osa = make_osa_repo(storage.mkdir('openstack-ansible'),
+                            role.working_dir,
+                            [role.commit('HEAD~{0}'.format(x)).hexsha
+                             for x in [2, 1, 0]])
+        argv = ['osa-differ', 'batch', 'HEAD~2..HEAD~1', 'HEAD~1..HEAD',
+                '--directory', str(storage),
+                '--osa-repo-url', osa.working_dir,
+                '--output-dir', str(tmpdir / 'reports'),
+                '--skip-projects', '--no-cache', '--update',
+                '--fetch-concurrency', '0']
+        monkeypatch.setattr('sys.argv', argv)
+        updates = []
+        real_update_repo = osa_differ.update_repo
+
+        def mock_update_repo(repo_dir, repo_url, fetch=False, **kwargs):
+            if fetch:
+                updates.append((os.path.basename(repo_dir),
+                                kwargs.get('commits')))
+            return real_update_repo(repo_dir, repo_url, fetch, **kwargs)
+
+        monkeypatch.setattr(osa_differ, 'update_repo', mock_update_repo)
+
+        osa_differ.run_osa_differ()
+        out, _ = capsys.readouterr()
+
+        role_updates = [x for x in updates if x[0] == 'os_test']
+        assert len(role_updates) == 1
+        assert len(role_updates[0][1]) == 4
+        assert out.count("Report written to file") == 2
+
+    def test_run_osa_differ_fetch_stage_failure(self, tmpdir, monkeypatch,
+                                                capsys):
+        """Verify that repos the fetch stage failed on are never stale."""
+        role = make_commits(tmpdir.mkdir('role'), 3)
+        storage = tmpdir.mkdir('storage')
+        osa = make_osa_repo(storage.mkdir('openstack-ansible'),
+                            role.working_dir,
+                            [role.commit('HEAD~2').hexsha,
+                             role.commit('HEAD').hexsha])
+        argv = ['osa-differ', 'HEAD~1', 'HEAD',
+                '--directory', str(storage),
+                '--osa-repo-url', osa.working_dir,
+                '--skip-projects', '--no-cache']
+        monkeypatch.setattr('sys.argv', argv)
+        osa_differ.run_osa_differ()
+        capsys.readouterr()
+
+        # The role can no longer be fetched, so the update must fail.
+        shutil.move(role.working_dir, str(tmpdir / 'moved'))
+        monkeypatch.setattr('sys.argv', argv + ['--update'])
+        with raises(exceptions.RepoReportException) as e:
+            osa_differ.run_osa_differ()
+        assert [x[0] for x in e.value.failures] == ['os_test']
+
+        # Batches update those repos before any of their reports.
+        monkeypatch.setattr('sys.argv', [
+            'osa-differ', 'batch', 'HEAD~1..HEAD',
+            '--directory', str(storage),
+            '--osa-repo-url', osa.working_dir,
+            '--output-dir', str(tmpdir / 'reports'),
+            '--skip-projects', '--no-cache', '--update'])
+        with raises(GitCommandError):
+            osa_differ.run_osa_differ()
+
     def test_publish_report(self):
         """Verify that we can publish a report to stdout."""
         report = "Sample report"
@@ -393,6 +1246,23 @@ novncproxy_git_project_group: nova_console
         assert 'Report written to file' in result
         assert 'test.rst' in result
 
+    def test_stream_report(self, tmpdir, capsys):
+        """Verify that sections are written out as they are generated."""
+        parser = osa_differ.create_parser()
+        args = parser.parse_args(['HEAD~1', 'HEAD'])
+
+        def sections():
+            yield "Sample "
+            out, _ = capsys.readouterr()
+            assert out == "Sample "
+            yield "report"
+
+        result = osa_differ.stream_report(sections(), args, 'HEAD~1', 'HEAD')
+        out, _ = capsys.readouterr()
+
+        assert result == ''
+        assert out == "report"
+
     @httpretty.activate
     def test_publish_report_to_gist(self):
         """Verify that we can post the report to a gist."""
@@ -503,6 +1373,134 @@ novncproxy_git_project_group: nova_console
         assert result.active_branch.name == 'master'
         assert not result.is_dirty()
 
+    def test_repo_clone_update_bare(self, tmpdir):
+        """Verify that we can keep a bare clone up to date."""
+        p = tmpdir.mkdir('test')
+        path = str(p)
+        repo = Repo.init(path)
+        file = p / 'test.txt'
+        file.write_text(u'Testing', encoding='utf-8')
+        repo.index.add(['test.txt'])
+        repo.index.commit('Testing')
+
+        p = tmpdir.mkdir("test2")
+        path_clonefrom = "{0}/testrepodoesntexist".format(str(p))
+        osa_differ.update_repo(path_clonefrom, path,
+                               clone_options={'bare': True})
+        result = osa_differ.update_repo(path_clonefrom, path, fetch=True)
+
+        assert result.bare
+        assert result.head.commit.hexsha == repo.head.commit.hexsha
+        assert not os.path.exists("{0}/test.txt".format(path_clonefrom))
+
+    def test_repo_clone_update_partial(self, tmpdir):
+        """Verify that partial clones stay partial when updated."""
+        p = tmpdir.mkdir('test')
+        path = str(p)
+        repo = Repo.init(path)
+        repo.git.config("uploadpack.allowFilter", "true")
+        repo.git.config("uploadpack.allowAnySHA1InWant", "true")
+        file = p / 'test.txt'
+        file.write_text(u'Testing1', encoding='utf-8')
+        repo.index.add(['test.txt'])
+        repo.index.commit('Testing 1')
+        repo_url = "file://{0}".format(path)
+
+        clone_dir = "{0}/clone".format(str(tmpdir.mkdir("test2")))
+        osa_differ.update_repo(clone_dir, repo_url,
+                               clone_options={'bare': True,
+                                              'filter': 'blob:none'})
+        file.write_text(u'Testing2', encoding='utf-8')
+        repo.index.add(['test.txt'])
+        repo.index.commit('Testing 2')
+        result = osa_differ.update_repo(clone_dir, repo_url, fetch=True)
+
+        assert osa_differ.get_partial_clone_filter(result) == 'blob:none'
+        missing = result.git.rev_list('--objects', '--missing=print',
+                                      '--all')
+        assert len([x for x in missing.split('\n') if x[0] == '?']) == 2
+        commits = osa_differ.get_commits(clone_dir, 'HEAD~1', 'HEAD')
+        assert commits[0].summary == 'Testing 2'
+        assert result.git.show('HEAD~1:test.txt') == 'Testing1'
+
+    def test_find_missing_commits(self, tmpdir):
+        """Verify that we can find commits missing from a repo."""
+        p = tmpdir.mkdir('test')
+        path = str(p)
+        repo = Repo.init(path)
+        file = p / 'test.txt'
+        file.write_text(u'Testing', encoding='utf-8')
+        repo.index.add(['test.txt'])
+        commit = repo.index.commit('Testing')
+
+        result = osa_differ.find_missing_commits(
+            path,
+            [commit.hexsha, 'HEAD', commit.tree.hexsha, 'HEAD~1', '0' * 40])
+
+        assert result == [commit.tree.hexsha, 'HEAD~1', '0' * 40]
+
+    def test_repo_update_auto(self, tmpdir):
+        """Verify that auto updates only fetch missing commits."""
+        p = tmpdir.mkdir('test')
+        path = str(p)
+        repo = Repo.init(path)
+        file = p / 'test.txt'
+        file.write_text(u'Testing1', encoding='utf-8')
+        repo.index.add(['test.txt'])
+        old_sha = repo.index.commit('Testing 1').hexsha
+
+        clone_dir = "{0}/clone".format(str(tmpdir.mkdir("test2")))
+        osa_differ.update_repo(clone_dir, path)
+        file.write_text(u'Testing2', encoding='utf-8')
+        repo.index.add(['test.txt'])
+        new_sha = repo.index.commit('Testing 2').hexsha
+
+        osa_differ.update_repo(clone_dir, path, 'auto', commits=[old_sha])
+        assert osa_differ.find_missing_commits(clone_dir, [new_sha])
+
+        osa_differ.update_repo(clone_dir, path, 'auto',
+                               commits=[old_sha, new_sha])
+        assert not osa_differ.find_missing_commits(clone_dir, [new_sha])
+
+    def test_migrate_storage_dir(self, tmpdir):
+        """Verify that checkouts are converted into bare repositories."""
+        storage = tmpdir.mkdir('storage')
+        for name in ['openstack-ansible', 'nova']:
+            p = storage.mkdir(name)
+            repo = Repo.init(str(p))
+            file = p / 'test.txt'
+            file.write_text(u'Testing', encoding='utf-8')
+            repo.index.add(['test.txt'])
+            repo.index.commit('Testing')
+        sha = repo.head.commit.hexsha
+
+        migrated = osa_differ.migrate_storage_dir(str(storage))
+
+        assert migrated == ['nova']
+        assert osa_differ.migrate_storage_dir(str(storage)) == []
+        assert not Repo(str(storage / 'openstack-ansible')).bare
+        repo = Repo(str(storage / 'nova'))
+        assert repo.bare
+        assert repo.head.commit.hexsha == sha
+        assert not os.path.exists(str(storage / 'nova' / 'test.txt'))
+
+    def test_migrate_storage_dir_interrupted(self, tmpdir):
+        """Verify that migrations stopped while removing a checkout finish."""
+        storage = tmpdir.mkdir('storage')
+        repo = make_commits(storage.mkdir('nova'), 1)
+        sha = repo.head.commit.hexsha
+        repo.git.config('--bool', 'core.bare', 'true')
+        os.rename(str(storage / 'nova' / '.git'),
+                  str(storage / 'nova.bare-migration'))
+
+        migrated = osa_differ.migrate_storage_dir(str(storage))
+
+        assert migrated == ['nova']
+        assert sorted(os.listdir(str(storage))) == ['nova']
+        repo = Repo(str(storage / 'nova'))
+        assert repo.bare
+        assert repo.head.commit.hexsha == sha
+
     def test_repo_update_update(self, tmpdir):
         """Verify that update_repo tries to update the repo."""
         p = tmpdir.mkdir('test')
@@ -554,7 +1552,7 @@ novncproxy_git_project_group: nova_console
         assert result.active_branch.name == 'master'
         assert not result.is_dirty()
 
-    def test_get_release_notes(self, tmpdir):
+    def test_get_release_notes(self, tmpdir, monkeypatch):
         """Ensure getting release notes works."""
         p = tmpdir.mkdir('releasenotes')
         tmpdir.mkdir('releasenotes/notes')
@@ -622,3 +1620,69 @@ novncproxy_git_project_group: nova_console
         reno_output = osa_differ.get_release_notes(path, '41.0.0', '42.0.0')
         assert "41.0.0" in reno_output
         assert "42.0.0" in reno_output
+        assert reno_output.index("42.0.0") < reno_output.index("41.0.0")
+        assert repo.head.commit.message == 'Fixed issue2'
+
+        # Failed runs show no notes and are not cached.
+        run_reno = osa_differ.run_reno
+        assert run_reno(path, '42.0.0', ['--no-such-option']) is None
+        notes_cache = cache.MemoryCache()
+        monkeypatch.setattr(osa_differ, 'run_reno', lambda *args: None)
+        failed_output = osa_differ.get_release_notes(
+            path, '41.0.0', '42.0.0', notes_cache=notes_cache)
+        assert "41.0.0" not in failed_output
+
+        # Released tags are read from the cache on the next run.
+        reno_runs = []
+
+        def mock_run_reno(*args):
+            reno_runs.append(args[1])
+            return run_reno(*args)
+
+        monkeypatch.setattr(osa_differ, 'run_reno', mock_run_reno)
+        for x in range(0, 2):
+            cached_output = osa_differ.get_release_notes(
+                path, '41.0.0', '42.0.0', notes_cache=notes_cache)
+        assert cached_output == reno_output
+        assert reno_runs == ['42.0.0', '41.0.0', '42.0.0']
+
+    def test_parse_release_notes(self):
+        """Verify that reno output is split into release note entries."""
+        reno_output = (
+            "=============\nRelease Notes\n=============\n\n"
+            ".. _Release Notes_42.0.0:\n\n42.0.0\n======\n\n"
+            ".. _Release Notes_42.0.0_Prelude:\n\nPrelude\n-------\n\n"
+            ".. releasenotes/notes/a.yaml @ b'1234'\n\n"
+            "Prelude text.\n\n"
+            ".. _Release Notes_42.0.0_Bug Fixes:\n\nBug Fixes\n---------\n\n"
+            ".. releasenotes/notes/b.yaml @ b'1234'\n\n"
+            "- A fix\n  on two lines.\n\n"
+            ".. releasenotes/notes/c.yaml @ b'1234'\n\n"
+            "- Another fix.\n\n\n"
+        )
+
+        entries = osa_differ.parse_release_notes(reno_output)
+
+        assert entries == [
+            {'version': '42.0.0', 'section': 'Prelude',
+             'file': 'releasenotes/notes/a.yaml', 'text': 'Prelude text.'},
+            {'version': '42.0.0', 'section': 'Bug Fixes',
+             'file': 'releasenotes/notes/b.yaml',
+             'text': 'A fix\non two lines.'},
+            {'version': '42.0.0', 'section': 'Bug Fixes',
+             'file': 'releasenotes/notes/c.yaml', 'text': 'Another fix.'},
+        ]
+        assert osa_differ.parse_release_notes("") == []
+
+    def test_temporary_worktree(self, tmpdir):
+        """Verify that temporary worktrees leave the repo untouched."""
+        repo = make_commits(tmpdir.mkdir('test'), 2)
+
+        with osa_differ.temporary_worktree(repo.working_dir,
+                                           'HEAD~1') as worktree_dir:
+            with open(os.path.join(worktree_dir, 'test.txt')) as f:
+                assert f.read().endswith(' 0')
+
+        assert not os.path.exists(worktree_dir)
+        assert repo.head.commit.message == 'Testing 1'
+        assert len(repo.git.worktree('list').splitlines()) == 1
@@ -0,0 +1,131 @@
+"""Testing the osa-differ report server."""
+import json
+import threading
+from multiprocessing.pool import ThreadPool
+
+from git import Repo
+
+from osa_differ import osa_differ
+from osa_differ import server
+
+import requests
+
+
+def make_repo(p, count):
+    """Create a repo with a number of commits."""
+    repo = Repo.init(str(p))
+    for x in range(0, count):
+        file = p / 'test.txt'
+        file.write_text(u'Testing {0}'.format(x), encoding='utf-8')
+        repo.index.add(['test.txt'])
+        repo.index.commit('Testing {0}'.format(x))
+    return repo
+
+
+def start_server(tmpdir):
+    """Start a report server for a small openstack-ansible repo."""
+    role = make_repo(tmpdir.mkdir('role'), 3)
+    storage = tmpdir.mkdir('storage')
+    osa_dir = storage.mkdir('openstack-ansible')
+    osa = Repo.init(str(osa_dir))
+    for version in ['HEAD~2', 'HEAD']:
+        (osa_dir / 'ansible-role-requirements.yml').write_text(u"""
+- name: os_test
+  scm: git
+  src: {0}
+  version: {1}
+""".format(role.working_dir, role.commit(version).hexsha), encoding='utf-8')
+        osa.index.add(['ansible-role-requirements.yml'])
+        osa.index.commit("Pin os_test to {0}".format(version))
+
+    parser = osa_differ.create_serve_parser()
+    args = parser.parse_args(['--port', '0',
+                              '--directory', str(storage),
+                              '--osa-repo-url', osa.working_dir,
+                              '--skip-projects'])
+    report_server = server.create_server(args, str(storage))
+    thread = threading.Thread(target=report_server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    url = "http://{0}:{1}".format(*report_server.server_address[:2])
+    return report_server, url
+
+
+class TestServer(object):
+    """Testing the report server."""
+
+    def test_report(self, tmpdir):
+        """Verify that concurrent report requests are answered."""
+        report_server, url = start_server(tmpdir)
+        try:
+            def get_report(x):
+                return requests.get(url + '/report',
+                                    params={'old': 'HEAD~1', 'new': 'HEAD'})
+
+            responses = ThreadPool(4).map(get_report, range(8))
+        finally:
+            report_server.shutdown()
+            report_server.server_close()
+
+        assert all(x.status_code == 200 for x in responses)
+        assert len(set(x.text for x in responses)) == 1
+        assert "2 commits were found in" in responses[0].text
+
+    def test_report_json(self, tmpdir):
+        """Verify that structured reports can be requested."""
+        report_server, url = start_server(tmpdir)
+        try:
+            response = requests.get(url + '/report',
+                                    params={'old': 'HEAD~1', 'new': 'HEAD',
+                                            'format': 'ndjson'})
+            invalid = requests.get(url + '/report',
+                                   params={'old': 'HEAD~1', 'new': 'HEAD',
+                                           'format': 'xml'})
+        finally:
+            report_server.shutdown()
+            report_server.server_close()
+
+        assert response.status_code == 200
+        assert response.headers['Content-Type'] == 'application/x-ndjson'
+        records = [json.loads(x) for x in response.text.splitlines()]
+        assert [x.get('repo') for x in records] == ['openstack-ansible',
+                                                    None, 'os_test']
+        assert len(records[2]['commits']) == 2
+        assert invalid.status_code == 400
+
+    def test_report_errors(self, tmpdir):
+        """Verify that invalid requests are rejected."""
+        report_server, url = start_server(tmpdir)
+        try:
+            health = requests.get(url + '/health')
+            missing = requests.get(url + '/report', params={'old': 'HEAD'})
+            invalid = requests.get(url + '/report',
+                                   params={'old': 'HEAD~1', 'new': 'nope'})
+            not_found = requests.get(url + '/nope')
+        finally:
+            report_server.shutdown()
+            report_server.server_close()
+
+        assert health.text == "ok\n"
+        assert missing.status_code == 400
+        assert invalid.status_code == 400
+        assert "nope" in invalid.text
+        assert not_found.status_code == 404
+
+    def test_get_report_args(self):
+        """Verify that request parameters override the server options."""
+        parser = osa_differ.create_serve_parser()
+        server_args = parser.parse_args(['--release-notes'])
+
+        args = server.get_report_args(server_args, {
+            'old': ['HEAD~1'],
+            'new': ['HEAD'],
+            'release_notes': ['false'],
+            'update': ['auto'],
+        })
+
+        assert args.old_commit == ['HEAD~1']
+        assert args.new_commit == ['HEAD']
+        assert args.release_notes is False
+        assert args.update == 'auto'
+        assert server_args.release_notes is True
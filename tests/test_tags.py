@@ -0,0 +1,59 @@
+"""Testing the osa-differ tag index."""
+import os
+
+from git import Repo
+
+from osa_differ import tags
+
+
+def make_tagged_repo(p, names):
+    """Create a repo with an annotated tag on a new commit for each name."""
+    repo = Repo.init(str(p))
+    repo.git.config("user.name", "Chuck Norris")
+    repo.git.config("user.email", "chuck.norris@example.com")
+    for name in names:
+        file = p / 'test.txt'
+        file.write_text(u'Testing {0}'.format(name), encoding='utf-8')
+        repo.index.add(['test.txt'])
+        repo.index.commit('Testing {0}'.format(name))
+        repo.create_tag(name, message=name)
+    return repo
+
+
+class TestTags(object):
+    """Testing the tag index."""
+
+    def test_parse_tag(self):
+        """Verify that pre-releases sort before their release."""
+        names = ['17.0.1', '17.0.0', '16.0.10', '17.0.0.0rc1', 'kilo-eol',
+                 '16.0.9', '17.0.0.0b1', '17.0.0.0rc2']
+
+        result = sorted(names, key=lambda x: tags.parse_tag(x)[0])
+
+        assert result == ['kilo-eol', '16.0.9', '16.0.10', '17.0.0.0b1',
+                          '17.0.0.0rc1', '17.0.0.0rc2', '17.0.0', '17.0.1']
+        assert tags.parse_tag('17.0.0.0rc1')[1:] == ('17.0.0', True)
+        assert tags.parse_tag('17.0.0')[1:] == ('17.0.0', False)
+
+    def test_tag_index(self, tmpdir):
+        """Verify that the index is stored and refreshed with new tags."""
+        repo = make_tagged_repo(tmpdir.mkdir('test'),
+                                ['1.0.0', '2.0.0.0rc1', '2.0.0'])
+
+        tag_index = tags.TagIndex(repo.working_dir)
+
+        assert os.path.exists(tag_index.path)
+        assert tag_index.between('1.0.0', '2.0.0') == ['1.0.0', '2.0.0.0rc1']
+        assert tag_index.nearest_tag('HEAD') == '2.0.0'
+        assert tag_index.nearest_tag('HEAD~2') == '1.0.0'
+        assert not tag_index.refresh()
+
+        file = tmpdir / 'test' / 'test.txt'
+        file.write_text(u'Untagged', encoding='utf-8')
+        repo.index.add(['test.txt'])
+        repo.index.commit('Untagged')
+        repo.create_tag('2.0.1', ref='HEAD~1', message='2.0.1')
+        tag_index = tags.TagIndex(repo.working_dir)
+
+        assert tag_index.names[-1] == '2.0.1'
+        assert tag_index.nearest_tag('HEAD') == '2.0.1'
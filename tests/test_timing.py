@@ -0,0 +1,39 @@
+"""Testing the osa-differ timing spans."""
+import json
+
+from osa_differ import timing
+
+
+class TestTiming(object):
+    """Testing timing spans."""
+
+    def test_span_disabled(self):
+        """Verify that spans are not recorded unless enabled."""
+        tracer = timing.Tracer()
+        with timing.span('test'):
+            pass
+
+        assert tracer.spans == []
+
+    def test_write_trace_jsonl(self, tmpdir):
+        """Verify that JSON lines traces get one span per line."""
+        tracer = timing.enable()
+        try:
+            with timing.span('render', repo='os_test'):
+                pass
+            timing.record('fetch', tracer.start, 1.5, thread='fetch os_test',
+                          repo='os_test')
+        finally:
+            timing.disable()
+        trace_file = str(tmpdir / 'trace.jsonl')
+
+        timing.write_trace(tracer, trace_file)
+
+        with open(trace_file) as f:
+            spans = [json.loads(x) for x in f]
+        assert [x['name'] for x in spans] == ['render', 'fetch']
+        assert spans[1]['thread'] == 'fetch os_test'
+        assert spans[1]['repo'] == 'os_test'
+        summary = timing.format_summary(tracer)
+        assert "os_test" in summary
+        assert "1.50s" in summary